@@ -19,6 +19,11 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...utils.latest_cache import latest_cache
+from ...utils.topology import topology
+from ...utils.availability import site_availability as site_availability_pct
+from ...utils.series import fetch_series
+from ...utils.downsample import check_method, downsample_rows
 
 router = APIRouter()
 
@@ -170,26 +175,23 @@ def get_sensor_data(user: user_dependency,site_id: int, db: Session = Depends(ge
             p.name AS parameter_name,
             p.unit AS parameter_unit,
             a.analyser_name AS analyzer_name,
-            sd.value AS latest_value,
-            sd.time AS latest_time
+            l.value AS latest_value,
+            l.time AS latest_time
         FROM
-            sensor_data sd
+            latest_sensor_data l
         JOIN
-            stations s ON sd.station_id = s.id
+            station_parameters sp ON sp.id = l.station_param_id
         JOIN
-            parameters p ON sd.parameter_id = p.id
+            analyser_parameter ap ON ap.id = sp.analyser_param_id
         JOIN
-            analysers a ON sd.analyser_id = a.id
+            stations s ON sp.station_id = s.id
+        JOIN
+            parameters p ON ap.parameter_id = p.id
+        JOIN
+            analysers a ON ap.analyser_id = a.id
         WHERE
-            sd.site_id = :site_id
-            AND sd.time = (
-                SELECT MAX(time)
-                FROM sensor_data sd2
-                WHERE sd2.site_id = sd.site_id
-                AND sd2.station_id = sd.station_id
-                AND sd2.parameter_id = sd.parameter_id
-                AND sd2.analyser_id = sd.analyser_id
-            );
+            l.site_id = :site_id
+            AND l.value IS NOT NULL;
         """)
         latest_values = db.execute(latest_value_query, {"site_id": site_id}).fetchall()
         # Updated key: use (station_name, parameter_name)
@@ -303,49 +305,34 @@ def get_sensor_data(user: user_dependency,site_id: int, db: Session = Depends(ge
 @router.get("/api/site/dashboard/card-details/{site_id}", tags=["dashboard"])
 def get_card_details(user: user_dependency,site_id: int, db: Session = Depends(getdb)):
     try:
-        query = text("""
-        SELECT
-            s.name AS station_name,
-            p.name AS parameter_name,
-            p.label AS parameter_label,
-            p.unit AS parameter_unit,
-            p.min_thershold AS min_threshold,
-            p.max_thershold AS max_threshold,
-            mt.monitoring_type AS monitoring_type_name,
-            sd.value AS latest_value,
-            sd.time AS latest_time
-        FROM sensor_data sd
-        JOIN stations s ON sd.station_id = s.id
-        JOIN parameters p ON sd.parameter_id = p.id
-        JOIN analysers a ON sd.analyser_id = a.id
-        LEFT JOIN monitoring_types mt ON p.monitoring_type_id = mt.id
-        WHERE sd.site_id = :site_id
-          AND sd.time = (
-              SELECT MAX(sd2.time)
-              FROM sensor_data sd2
-              WHERE sd2.site_id = sd.site_id
-                AND sd2.station_id = sd.station_id
-                AND sd2.parameter_id = sd.parameter_id
-                AND sd2.analyser_id = sd.analyser_id
-          );
-        """)
-        results = db.execute(query, {"site_id": site_id}).fetchall()
+        # names/thresholds come from the topology snapshot and latest values
+        # from the worker's latest-value cache; the DB is only hit on a miss
+        # or when stale
+        topo = topology.site(db, site_id)
+        latest = latest_cache.site(db, site_id)
 
         card_details = []
-        for row in results:
+        for p in (topo.params if topo else ()):
+            if p.parameter_id is None:
+                continue
+            current = latest.latest(p.station_param_id)
+            if current is None:
+                continue
+            value, ts = current
+            station_name = topo.station_by_id[p.station_id].name
             card_details.append({
-                "stationName": row.station_name,
-                "parameterName": f"{row.station_name}-{row.parameter_label}",
-                "unit": row.parameter_unit,
-                "parameterLabel": row.parameter_label,
-                "parameterUnit": row.parameter_unit if row.parameter_unit != "nan" else "",
-                "minThreshold": row.min_threshold,
-                "maxThreshold": row.max_threshold,
-                "monitoringType": row.monitoring_type_name,
+                "stationName": station_name,
+                "parameterName": f"{station_name}-{p.parameter_label}",
+                "unit": p.parameter_unit,
+                "parameterLabel": p.parameter_label,
+                "parameterUnit": p.parameter_unit if p.parameter_unit != "nan" else "",
+                "minThreshold": p.min_threshold,
+                "maxThreshold": p.max_threshold,
+                "monitoringType": p.monitoring_type,
                 "latestValue": {
-                    "value": float(row.latest_value),
-                    "time": row.latest_time.isoformat()
-                } if row.latest_value is not None else None
+                    "value": value,
+                    "time": ts.isoformat()
+                }
             })
 
         return {"cardDetails": card_details}
@@ -374,18 +361,25 @@ def get_chart_details(
     site_id: int,
     offset: int = 0,
     limit: int = 15,
+    max_points: int | None = Query(None, ge=2, le=100_000, description="Decimate each series to at most this many points"),
+    downsample: str = Query("minmax", description="'minmax' (per-pixel low/high, keeps spikes) or 'lttb'"),
     db: Session = Depends(getdb),
 ):
+    check_method(downsample)
     try:
         # 1) Get paginated (station_id, parameter_id) pairs for non‑expired stations
         key_query = text("""
-            SELECT DISTINCT sd.station_id, sd.parameter_id
-            FROM sensor_data sd
+            SELECT DISTINCT sp.station_id, ap.parameter_id
+            FROM latest_sensor_data l
+            JOIN station_parameters sp
+              ON sp.id = l.station_param_id
+            JOIN analyser_parameter ap
+              ON ap.id = sp.analyser_param_id
             JOIN stations s
-              ON sd.station_id = s.id
-            WHERE sd.site_id = :site_id
+              ON sp.station_id = s.id
+            WHERE l.site_id = :site_id
               AND (s.calibration_expiry_date IS NULL OR s.calibration_expiry_date >= NOW())
-            ORDER BY sd.station_id, sd.parameter_id
+            ORDER BY sp.station_id, ap.parameter_id
             OFFSET :offset LIMIT :limit
         """)
         key_rows = db.execute(
@@ -409,30 +403,31 @@ def get_chart_details(
                 VALUES {values_clause}
             ),
             latest_details AS (
-                SELECT DISTINCT ON (sd.station_param_id)
-                    sd.station_id,
-                    sd.parameter_id,
+                SELECT
+                    sp.id         AS station_param_id,
+                    sp.station_id,
+                    ap.parameter_id,
                     s.name        AS station_name,
                     p.name        AS parameter_name,
                     p.label       AS parameter_label,
-                    sd.value      AS latest_value,
-                    sd.time       AS latest_time,
+                    l.value       AS latest_value,
+                    l.time        AS latest_time,
                     sp.para_threshold AS max_threshold,
                     sp.para_unit      AS parameter_unit
-                FROM sensor_data sd
-                JOIN selected_keys sk
-                  ON sd.station_id = sk.station_id
-                 AND sd.parameter_id = sk.parameter_id
+                FROM latest_sensor_data l
                 JOIN station_parameters sp
-                  ON sd.station_param_id = sp.id
+                  ON l.station_param_id = sp.id
                 JOIN analyser_parameter ap
                   ON sp.analyser_param_id = ap.id
+                JOIN selected_keys sk
+                  ON sp.station_id = sk.station_id
+                 AND ap.parameter_id = sk.parameter_id
                 JOIN parameters p
                   ON ap.parameter_id = p.id
                 JOIN stations s
-                  ON sd.station_id = s.id
-                WHERE sd.site_id = :site_id
-                ORDER BY sd.station_param_id, sd.time DESC
+                  ON sp.station_id = s.id
+                WHERE l.site_id = :site_id
+                ORDER BY sp.id
             )
             SELECT * FROM latest_details;
         """)
@@ -453,42 +448,26 @@ def get_chart_details(
             for row in latest_rows
         }
 
-        # 3) Fetch 24h time series for those same keys (already filtered by non‑expired stations)
-        data_query = text(f"""
-            WITH selected_keys (station_id, parameter_id) AS (
-                VALUES {values_clause}
-            )
-            SELECT
-                time_bucket('1 hour', sd.time) AS bucket,
-                sd.station_id,
-                sd.parameter_id,
-                s.name AS station_name,
-                p.name AS parameter_name,
-                AVG(sd.value) AS avg_value
-            FROM sensor_data sd
-            JOIN selected_keys sk
-              ON sd.station_id = sk.station_id
-             AND sd.parameter_id = sk.parameter_id
-            JOIN stations s
-              ON sd.station_id = s.id
-            JOIN station_parameters sp
-              ON sd.station_param_id = sp.id
-            JOIN analyser_parameter ap
-              ON sp.analyser_param_id = ap.id
-            JOIN parameters p
-              ON ap.parameter_id = p.id
-            WHERE sd.site_id = :site_id
-              AND sd.time >= NOW() - INTERVAL '24 hours'
-              AND (s.calibration_expiry_date IS NULL OR s.calibration_expiry_date >= NOW())
-            GROUP BY bucket, sd.station_id, sd.parameter_id, s.name, p.name
-            ORDER BY sd.station_id, sd.parameter_id, bucket;
-        """)
-        rows = db.execute(data_query, {"site_id": site_id}).fetchall()
+        # 3) Hourly 24h series of those station parameters (aggregates + raw tail),
+        #    averaged over the analysers measuring the same parameter at a station
+        spid_keys = {row.station_param_id: (row.station_id, row.parameter_id) for row in latest_rows}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        sums: dict[tuple, list] = defaultdict(lambda: [0.0, 0])
+        for ts, spid, value in fetch_series(
+            db, list(spid_keys), now - datetime.timedelta(hours=24), now, "1 hour", site_id=site_id
+        ):
+            if value is not None:
+                acc = sums[(spid_keys[spid], ts)]
+                acc[0] += value
+                acc[1] += 1
+
+        series = [(bucket, key, total / n) for (key, bucket), (total, n) in sorted(sums.items(), key=lambda kv: kv[0][::-1])]
+        if max_points:
+            series = downsample_rows(series, max_points, downsample)
 
         # 4) Assemble chart blocks
         chart_map: dict[tuple[int, int], dict] = {}
-        for r in rows:
-            key = (r.station_id, r.parameter_id)
+        for bucket, key, avg_val in sorted(series, key=lambda r: (r[1], r[0])):
             meta = latest_map.get(key)
             if not meta:
                 continue
@@ -504,10 +483,8 @@ def get_chart_details(
                 "unit":           meta["unit"],
             })
 
-            avg_val = (float(r.avg_value)
-                       if r.avg_value is not None and math.isfinite(r.avg_value)
-                       else None)
-            block["x_axis"].append(r.bucket.isoformat())
+            avg_val = avg_val if math.isfinite(avg_val) else None
+            block["x_axis"].append(bucket.isoformat())
             block["y_axis"].append(avg_val)
 
         return JSONResponse({
@@ -595,74 +572,9 @@ def get_site_details(site_id: int, user: user_dependency, db: Session = Depends(
         """), {"site_id": site_id}).fetchone().pcb_parameter_ct
 
         # --------------------------------------
-        # 7. NEW DATA AVAILABILITY USING sensor_stddev_1hr
+        # 7. DATA AVAILABILITY (last 24h, sensor_stddev_1hr)
         # --------------------------------------
-        availability_result = db.execute(text("""
-    WITH time_window AS (
-        SELECT 
-            CAST(:start_time AS timestamp) AS start_time,
-            CAST(:end_time AS timestamp) AS end_time
-    ),
-
-    params AS (
-        SELECT 
-            sp.id AS station_param_id,
-            sp.param_interval
-        FROM station_parameters sp
-        JOIN stations st ON st.id = sp.station_id
-        WHERE st.site_id = :site_id
-    ),
-
-    expected AS (
-        SELECT
-            station_param_id,
-            CASE 
-                WHEN param_interval > 0 THEN CEIL(86400.0 / param_interval)
-                ELSE 0
-            END AS expected_rows
-        FROM params
-    ),
-
-    actual AS (
-        SELECT
-            p.station_param_id,
-            COALESCE(SUM(s.n), 0) AS actual_rows
-        FROM sensor_stddev_1hr s
-        CROSS JOIN time_window tw
-        JOIN params p ON p.station_param_id = s.station_param_id
-        WHERE s.bucket_ist BETWEEN tw.start_time AND tw.end_time
-        GROUP BY p.station_param_id
-    ),
-
-    final AS (
-        SELECT
-            e.station_param_id,
-            ROUND(
-                (COALESCE(a.actual_rows, 0) / NULLIF(e.expected_rows, 0)::numeric) * 100,
-                2
-            ) AS availability
-        FROM expected e
-        LEFT JOIN actual a ON a.station_param_id = e.station_param_id
-    )
-
-    SELECT AVG(availability) AS site_availability FROM final;
-"""),
-{
-    "site_id": site_id,
-    "start_time": start_ist.strftime("%Y-%m-%d %H:%M:%S"),
-    "end_time": now_ist.strftime("%Y-%m-%d %H:%M:%S"),
-}).fetchone()
-
-
-        # Safe float conversion
-        site_availability = (
-            float(availability_result.site_availability)
-            if availability_result and availability_result.site_availability is not None
-            else 0.0
-        )
-
-        # clamp to 0–100
-        site_availability = min(max(site_availability, 0.0), 100.0)
+        site_availability = site_availability_pct(db, site_id, start_ist, now_ist)
 
         # --------------------------------------
         # 8. Build Response (same structure)
@@ -10,6 +10,7 @@ from ...utils.utils import *
 router = APIRouter()
 
 from ..auth.authentication import user_dependency
+from ...utils.topology import bump
 
 @router.post("/api/analyser-parameter/create", summary="Create a new analyser parameter", tags=["analyser_parameter"])
 def create_analyser_parameter(
@@ -151,6 +152,7 @@ def update_analyser_parameter(user : user_dependency , analyser_id: int, paramet
         raise HTTPException(status_code=404, detail="Analyser Parameter not found")
     
     analyser_param.updated_by = 1  # Example: Modify as needed
+    bump(db)
     db.commit()
     db.refresh(analyser_param)
     return {"detail": "Analyser Parameter updated successfully", "data": analyser_param}
@@ -167,6 +169,7 @@ def delete_analyser_parameter(user : user_dependency , analyser_id: int, paramet
         raise HTTPException(status_code=404, detail="Analyser Parameter not found")
     
     db.delete(analyser_param)
+    bump(db)
     db.commit()
     return response_strct(
         status_code=status.HTTP_200_OK,
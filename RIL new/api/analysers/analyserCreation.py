@@ -16,6 +16,7 @@ from ...database.session import getdb
 from ...utils.utils import response_strct
 
 from ..auth.authentication import user_dependency
+from ...utils.topology import bump
 
 router = APIRouter()
 
@@ -154,6 +155,7 @@ def update_analyser(
             existing_analyser.model = model
         
         existing_analyser.updated_by = 1
+        bump(db)
         db.commit()
         db.refresh(existing_analyser)
 
@@ -193,6 +195,7 @@ def delete_analyser( user : user_dependency ,analyser_uid: str, db: Session = De
                 error=""
             )
         db.delete(existing_analyser)
+        bump(db)
         db.commit()
         return response_strct(
             status_code=status.HTTP_200_OK,
@@ -331,6 +334,7 @@ def delete_all_analysers(
 
         # Perform bulk delete
         db.query(Analyser).delete()
+        bump(db)
         db.commit()
 
         # Reset auto-increment (id) sequence
@@ -5,8 +5,10 @@ from datetime import timedelta
 from ...modals.masters import *
 from ...database.session import getdb
 from ..auth.authentication import user_dependency
+from ...utils.series import IST_ORIGIN, fetch_series
+from collections import defaultdict
 import logging
-from pytz import timezone, UTC
+from pytz import timezone
 
 router = APIRouter(
     prefix="/api/camera-parameter",
@@ -162,12 +164,10 @@ async def get_camera_parameter_hourly_data(user: user_dependency,camera_id: int,
         tz = timezone('Asia/Kolkata')
         end_time_local = dt.now(tz).replace(minute=0, second=0, microsecond=0)
         start_time_local = end_time_local - timedelta(hours=24)
-        
-        start_time = start_time_local.astimezone(UTC)
-        end_time = end_time_local.astimezone(UTC)
-        
+
         x_axis = [(start_time_local + timedelta(hours=i)).isoformat() for i in range(25)]
         all_parameters_data = []
+        params = []
 
         for camera_param in camera_params:
             # Fix: Retrieve stationParameter first
@@ -189,36 +189,19 @@ async def get_camera_parameter_hourly_data(user: user_dependency,camera_id: int,
             if not parameter:
                 continue
 
-            parameter_id = parameter.id
-            parameter_name = parameter.name
-            parameter_unit = parameter.unit
-
-            query = (
-                db.query(
-                    func.date_trunc('hour', SensorData.time).label('hour'),
-                    func.avg(SensorData.value).label('avg_value')
-                )
-                .filter(
-                    SensorData.parameter_id == parameter_id,
-                    SensorData.time >= start_time,
-                    SensorData.time <= end_time
-                )
-                .group_by(func.date_trunc('hour', SensorData.time))
-                .order_by(func.date_trunc('hour', SensorData.time))
-            )
-
-            hourly_data = query.all()
-
-            if hourly_data:
-                data_dict = {
-                    row.hour.astimezone(tz).replace(minute=0, second=0, microsecond=0).isoformat(): 
-                    float(row.avg_value) if row.avg_value is not None else None
-                    for row in hourly_data
-                }
-            else:
-                data_dict = {}
-
-            y_axis = [data_dict.get(ts, None) for ts in x_axis]
+            params.append((station_param.id, parameter.name, parameter.unit))
+
+        # IST hours of the camera's station parameters: aggregates + raw tail,
+        # the current (partial) hour included
+        hourly: dict = defaultdict(dict)
+        if params:
+            for ts, spid, value in fetch_series(
+                db, [p[0] for p in params], start_time_local, dt.now(tz), "1 hour", origin=IST_ORIGIN
+            ):
+                hourly[spid][ts.astimezone(tz).isoformat()] = value
+
+        for station_param_id, parameter_name, parameter_unit in params:
+            y_axis = [hourly[station_param_id].get(ts) for ts in x_axis]
 
             parameter_data = {
                 "parameter_name": parameter_name,
@@ -8,7 +8,6 @@ from datetime import datetime
 from pathlib import Path
 from decimal import Decimal
 import json
-from sqlalchemy import select, join
 
 router = APIRouter()
 
@@ -19,6 +18,7 @@ from ...schemas.masterSchema import DeviceCreation , DeviceUpdate
 from pydantic import ValidationError,BaseModel
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...ingestion.resolution_index import resolution_index, invalidate
 
 @router.post('/api/device/create/{site_id}', summary="Register a new device", tags=['Device'])
 async def create_device(
@@ -89,6 +89,7 @@ async def create_device(
         )
 
         db.add(new_device)
+        invalidate(db, device_uids=[device_uid])
         db.commit()
         db.refresh(new_device)
 
@@ -256,6 +257,7 @@ def assign_stations_to_device(
         if not exists:
             db.add(DeviceStation(device_id=device_id, station_id=sid))
 
+    invalidate(db, device_ids=[device_id])
     db.commit()
     return 
 from sqlalchemy.orm import aliased
@@ -564,29 +566,17 @@ class GeneratedConfigOut(BaseModel):
 
 
 def build_device_config(device_id: int, db: Session) -> dict:
-    # [same as before: fetch station_ids, station_rows, site_uid, device]
-    rows = db.execute(
-        select(DeviceStation.station_id)
-        .where(DeviceStation.device_id == device_id)
-    ).all()
-    station_ids = [r.station_id for r in rows]
-    if not station_ids:
+    # stations / analyser / parameter UIDs come from the shared resolution
+    # index, the same mapping ingestion uses to decode this payload
+    entry = resolution_index.get_by_device_id(db, device_id)
+    if entry is None:
+        raise HTTPException(404, f"Device {device_id} not found")
+    if not entry.stations:
         raise HTTPException(400, f"No stations mapped to device {device_id}")
 
-    station_rows = db.execute(
-        select(Station.id, Station.station_uid, Station.site_id)
-        .where(Station.id.in_(station_ids))
-    ).all()
-    if not station_rows:
-        raise HTTPException(400, "Mapped station IDs not found")
-
-    site_ids = {r.site_id for r in station_rows}
-    if len(site_ids) > 1:
+    site_uids = {st["site_uid"] for st in entry.stations.values()}
+    if len(site_uids) > 1:
         raise HTTPException(400, "Stations span multiple sites")
-    site = db.get(Site, site_ids.pop())
-    device = db.get(Device, device_id)
-    if not device:
-        raise HTTPException(404, f"Device {device_id} not found")
 
     # build JSON payload
     import datetime as dt_mod
@@ -594,41 +584,20 @@ def build_device_config(device_id: int, db: Session) -> dict:
     now_ist = dt_mod.datetime.now(ist).isoformat()
 
     cfg = {
-        "site_uid":   site.siteuid,
-        "chipid":     device.chip_id,
-        "device_uid": device.device_uid,
+        "site_uid":   site_uids.pop(),
+        "chipid":     entry.chip_id,
+        "device_uid": entry.device_uid,
         "timestamp":  now_ist,
         "data":       [],
     }
 
-    for st_id, st_uid, _ in station_rows:
-        ap_rows = db.execute(
-            select(stationParameter.analyser_param_id)
-            .where(stationParameter.station_id == st_id)
-        ).all()
-        ap_ids = [r.analyser_param_id for r in ap_rows]
-        if not ap_ids:
-            continue
-
-        j = join(
-            AnalyserParameter, Analyser,
-            AnalyserParameter.analyser_id == Analyser.id
-        ).join(
-            Parameter, AnalyserParameter.parameter_id == Parameter.id
-        )
-        mappings = db.execute(
-            select(Analyser.analyser_uid, Parameter.uuid)
-            .select_from(j)
-            .where(AnalyserParameter.id.in_(ap_ids))
-        ).all()
-
-        for analyser_uid, parameter_uuid in mappings:
-            cfg["data"].append({
-                "station_uid":  st_uid,
-                "analyser_id":  analyser_uid,
-                "parameter_id": parameter_uuid,
-                "value":        0
-            })
+    for station_uid, analyser_uid, parameter_uuid in entry.params:
+        cfg["data"].append({
+            "station_uid":  station_uid,
+            "analyser_id":  analyser_uid,
+            "parameter_id": parameter_uuid,
+            "value":        0
+        })
 
     return cfg
 
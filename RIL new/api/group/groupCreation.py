@@ -8,6 +8,7 @@ from starlette import status
 from sqlalchemy.exc import SQLAlchemyError
 
 from ..auth.authentication import user_dependency
+from ...utils.topology import bump
 
 router = APIRouter()
 
@@ -138,6 +139,7 @@ def update_group(
             existing_group.updated_by = 1 
 
 
+        bump(db)
         db.commit()
         db.refresh(existing_group)
 
@@ -8,6 +8,7 @@ from starlette import status
 from sqlalchemy.exc import SQLAlchemyError
 
 from ..auth.authentication import user_dependency
+from ...utils.topology import bump
 
 router = APIRouter()
 
@@ -121,6 +122,7 @@ def update_monitoring_type(
             existing_type.monitoring_type = monitoring_type
 
         existing_type.updated_by = 1  # Hardcoded for now
+        bump(db)
         db.commit()
         db.refresh(existing_type)
 
@@ -164,6 +166,7 @@ def delete_monitoring_type(user : user_dependency , type_id: int, db: Session =
             )
 
         db.delete(monitoring_type)
+        bump(db)
         db.commit()
 
         return response_strct(
@@ -13,6 +13,8 @@ from ..auth.authentication import user_dependency
 from ...modals.masters import *
 
 from ...utils.permissions import enforce_site_access
+from ...utils.topology import topology
+from ...utils.exceedance import RULE_THRESHOLD, site_exceedances
 
 from pydantic import BaseModel
 
@@ -129,7 +131,7 @@ def get_site_alerts(
         )
 
     # --------------------------------------------------------------------
-    # 2️⃣ TODAY EXCEEDANCE USING sensor_agg_15min ONLY
+    # 2️⃣ TODAY EXCEEDANCE FROM exceedance_events
     # --------------------------------------------------------------------
     ist = pytz.timezone("Asia/Kolkata")
     now_ist = dt.datetime.now(ist)
@@ -140,60 +142,27 @@ def get_site_alerts(
     today_start_utc = today_start_ist.astimezone(dt.timezone.utc)
     today_end_utc = today_end_ist.astimezone(dt.timezone.utc)
 
-    # Fetch all station parameters
-    sp_sql = text("""
-        SELECT 
-            sp.id AS station_param_id,
-            sp.para_threshold,
-            sp.para_unit,
-            p.name AS parameter_name,
-            stn.name AS station_name
-        FROM station_parameters sp
-        JOIN analyser_parameter ap ON sp.analyser_param_id = ap.id
-        JOIN parameters p ON ap.parameter_id = p.id
-        JOIN stations stn ON sp.station_id = stn.id
-        WHERE stn.site_id = :site_id
-    """)
-
-    params = db.execute(sp_sql, {"site_id": site_id}).mappings().all()
-
+    # One alert per exceeding 15-min bucket of today (avg > threshold * 1.10),
+    # expanded from the events written at ingest; names joined from the
+    # topology snapshot
+    topo = topology.site(db, site_id)
     exceed_output: List[SiteAlertOut] = []
 
-    # 15-min exceedance with values + bucket_start
-    exceed_sql = text("""
-        SELECT 
-            bucket AS bucket_start,
-            avg_value,
-            bucket AT TIME ZONE 'UTC' AS bucket_utc
-        FROM sensor_agg_15min
-        WHERE station_param_id = :sp_id
-        AND bucket >= :start_utc AND bucket < :end_utc
-        AND avg_value > :threshold * 1.10
-        ORDER BY bucket ASC;
-    """)
-
-    for p in params:
-        rows = db.execute(
-            exceed_sql,
-            {
-                "sp_id": p["station_param_id"],
-                "start_utc": today_start_utc,
-                "end_utc": today_end_utc,
-                "threshold": p["para_threshold"],
-            },
-        ).mappings().all()
-
-        for r in rows:
+    if topo is not None:
+        for r in site_exceedances(db, site_id, today_start_utc, today_end_utc, RULE_THRESHOLD):
+            p = topo.param_by_id.get(r.station_param_id)
+            if p is None or p.parameter_id is None:
+                continue
             exceed_output.append(
                 SiteAlertOut(
-                    station_name=p["station_name"],
-                    parameter_name=p["parameter_name"],
-                    exceedance_value=r["avg_value"],
-                    exceedance_time=r["bucket_start"],
+                    station_name=topo.station_by_id[p.station_id].name,
+                    parameter_name=p.parameter_name,
+                    exceedance_value=r.value,
+                    exceedance_time=r.bucket,
                     mail_delivered=False,
                     delivered_time=None,
                     mail_status=None,
-                    bucket_start=r["bucket_start"],
+                    bucket_start=r.bucket,
                 )
             )
 
@@ -15,6 +15,7 @@ import html
 
 
 from ..auth.authentication import user_dependency
+from ...utils.topology import bump
 
 router = APIRouter()
 
@@ -201,6 +202,7 @@ def update_parameter(
 
         existing_param.updated_by = 1  # Hardcoded for now
 
+        bump(db)
         db.commit()
         db.refresh(existing_param)
 
@@ -328,6 +330,7 @@ def truncate_parameter_table(user : user_dependency ,db: Session = Depends(getdb
         if user is None or user['role'] != 'admin':
             raise HTTPException(status_code=401, detail="Authentication failed")
         db.execute(text("TRUNCATE TABLE parameters RESTART IDENTITY CASCADE;"))
+        bump(db)
         db.commit()
         return response_strct(
             status_code=status.HTTP_200_OK,
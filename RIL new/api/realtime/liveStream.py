@@ -0,0 +1,226 @@
+# OM VIGHNHARTAYE NAMO NAMAH :
+"""
+Live site stream over WebSocket, replacing the dashboard's timer polling of
+latest-parameters / chart-details.
+
+    wss://<host>/api/ws/site/{site_id}?token=<access token>
+
+Browsers cannot set an Authorization header on a WebSocket, so the access
+token travels in the query string; it is decoded exactly like
+`user_dependency` and checked with `enforce_site_access`.
+
+Messages (JSON text frames):
+    {"type": "snapshot",   "values": [{"station_param_id", "value", "time", "status"}]}
+    {"type": "value",      "station_param_id", "value", "time"}
+    {"type": "status",     "station_param_id", "status": "normal" | "exceeded"}
+    {"type": "exceedance", "station_param_id", "value", "threshold", "time"}
+    {"type": "resync"}     client fell behind / upstream reconnected:
+                           reload over REST or reconnect for a new snapshot
+
+One upstream subscription (the `latest_values` channel that feeds
+utils/latest_cache) serves the whole worker; deltas for a site are computed
+and serialised once and the same frame is queued to every client of that
+site.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, Set
+
+import orjson
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from ..auth.authentication import get_current_user
+from ...utils.db import db_session
+from ...utils.latest_cache import CHANNEL, latest_cache
+from ...utils.permissions import enforce_site_access
+from ...utils.topology import topology
+from ...utils import pubsub
+
+router = APIRouter()
+
+CLIENT_QUEUE_SIZE = 256
+
+
+def _thresholds(db, site_id: int) -> Dict[int, float]:
+    topo = topology.site(db, site_id)
+    return {p.station_param_id: p.threshold for p in topo.params} if topo else {}
+
+
+def _status(value, threshold) -> str:
+    if threshold is not None and value is not None and value > threshold:
+        return "exceeded"
+    return "normal"
+
+
+class SiteHub:
+    """Fan-out of upstream readings to the WebSocket clients of each site."""
+
+    def __init__(self):
+        self._loop = None
+        self._clients: Dict[int, Set[asyncio.Queue]] = {}
+        self._thresholds: Dict[int, Dict[int, float]] = {}
+        self._status: Dict[int, Dict[int, str]] = {}
+        self._seen: Dict[int, Dict[int, tuple]] = {}     # site not primed yet: newest (value, time)
+        self._subscribed = False
+
+    def attach(self, site_id: int) -> asyncio.Queue:
+        """Queue receiving the site's frames from now on (call before loading the snapshot)."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if not self._subscribed:
+            self._subscribed = True
+            pubsub.subscribe(CHANNEL, self._on_upstream)
+        queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        if site_id not in self._clients:
+            self._clients[site_id] = set()
+            self._seen[site_id] = {}
+        self._clients[site_id].add(queue)
+        return queue
+
+    def prime(self, site_id: int, thresholds: Dict[int, float], status: Dict[int, str]):
+        """
+        Thresholds and snapshot status of a site.  Readings that arrived while
+        the first snapshot loaded were queued as values only; their status
+        changes against the snapshot are queued now.
+        """
+        if site_id not in self._clients:
+            return
+        self._thresholds[site_id] = thresholds
+        if site_id in self._status:
+            return
+        self._status[site_id] = dict(status)
+        frames = []
+        for spid, (value, time_iso) in self._seen.pop(site_id, {}).items():
+            frames.extend(self._status_frames(site_id, spid, value, time_iso))
+        for frame in frames:
+            self._broadcast(site_id, orjson.dumps(frame).decode())
+
+    def detach(self, site_id: int, queue: asyncio.Queue):
+        clients = self._clients.get(site_id)
+        if clients is None:
+            return
+        clients.discard(queue)
+        if not clients:
+            del self._clients[site_id]
+            self._thresholds.pop(site_id, None)
+            self._status.pop(site_id, None)
+            self._seen.pop(site_id, None)
+
+    # listener thread → event loop
+    def _on_upstream(self, msg: dict):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._fanout, msg)
+
+    def _fanout(self, msg: dict):
+        if msg.get("all"):
+            for site_id in list(self._clients):
+                self._broadcast(site_id, orjson.dumps({"type": "resync"}).decode())
+            return
+
+        site_id = msg.get("site_id")
+        if site_id not in self._clients:
+            return
+        seen = self._seen.get(site_id)
+
+        frames = []
+        for spid, value, t, *_ in msg.get("rows") or ():
+            time_iso = _iso(t)
+            frames.append({"type": "value", "station_param_id": spid, "value": value, "time": time_iso})
+            if seen is not None:
+                seen[spid] = (value, time_iso)     # status once the snapshot is in
+            else:
+                frames.extend(self._status_frames(site_id, spid, value, time_iso))
+        for frame in frames:
+            self._broadcast(site_id, orjson.dumps(frame).decode())
+
+    def _status_frames(self, site_id: int, spid: int, value, time_iso: str) -> list:
+        status = self._status[site_id]
+        threshold = self._thresholds.get(site_id, {}).get(spid)
+        new_status = _status(value, threshold)
+        if status.get(spid, "normal") == new_status:
+            return []
+        status[spid] = new_status
+        frames = [{"type": "status", "station_param_id": spid, "status": new_status}]
+        if new_status == "exceeded":
+            frames.append({
+                "type": "exceedance", "station_param_id": spid,
+                "value": value, "threshold": threshold, "time": time_iso,
+            })
+        return frames
+
+    def _broadcast(self, site_id: int, payload: str):
+        for queue in list(self._clients.get(site_id, ())):
+            try:
+                queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # slow client: drop its backlog and ask it to resync
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(orjson.dumps({"type": "resync"}).decode())
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+hub = SiteHub()
+
+
+def _load_snapshot(site_id: int):
+    with db_session() as db:
+        thresholds = _thresholds(db, site_id)
+        latest = latest_cache.site(db, site_id)
+    values, status = [], {}
+    for spid, threshold in thresholds.items():
+        current = latest.latest(spid)
+        if current is None:
+            continue
+        status[spid] = _status(current[0], threshold)
+        values.append({
+            "station_param_id": spid,
+            "value": current[0],
+            "time": current[1].isoformat(),
+            "status": status[spid],
+        })
+    return thresholds, status, values
+
+
+@router.websocket("/api/ws/site/{site_id}")
+async def site_live_stream(websocket: WebSocket, site_id: int, token: str = Query(...)):
+    try:
+        user = await get_current_user(token)
+        enforce_site_access(user, site_id)
+    except HTTPException as e:
+        await websocket.close(code=4401 if e.status_code == 401 else 4403)
+        return
+
+    await websocket.accept()
+    # attach first: readings published while the snapshot loads are queued, not lost
+    queue = hub.attach(site_id)
+
+    async def drain_incoming():
+        # clients only send keep-alives; this also notices disconnects
+        while True:
+            await websocket.receive_text()
+
+    receiver = None
+    try:
+        thresholds, status, values = await run_in_threadpool(_load_snapshot, site_id)
+        hub.prime(site_id, thresholds, status)
+        receiver = asyncio.create_task(drain_incoming())
+        await websocket.send_text(orjson.dumps({"type": "snapshot", "values": values}).decode())
+        while True:
+            get = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({get, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                get.cancel()
+                break
+            await websocket.send_text(get.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        hub.detach(site_id, queue)
@@ -7,7 +7,7 @@ from sqlalchemy.sql import text
 
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from sqlalchemy import select, func, case,text
+from sqlalchemy import select, case,text
 from ...schemas.masterSchema import *
 from ...modals.masters import *
 from ...database.session import getdb
@@ -16,6 +16,9 @@ from collections import defaultdict
 from typing import Dict, List
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...utils.latest_cache import latest_cache
+from ...utils.topology import topology
+from ...utils.series import IST_ORIGIN, fetch_series
 
 
  # Assuming you have a database session dependency
@@ -26,45 +29,19 @@ router = APIRouter()
 def get_metadata(user:user_dependency,site_id: int, db: Session = Depends(getdb)):
     enforce_site_access(user, site_id)
     try:
-        # 1) Site + group
-        site = db.query(Site).filter(Site.id == site_id).first()
-        if not site:
+        # 1) Site, group, stations and parameters from the topology snapshot
+        topo = topology.site(db, site_id)
+        if topo is None:
             raise HTTPException(status_code=404, detail="Site not found")
+        site = topo.site
 
-        group_name = (
-            db.query(Group.group_name)
-            .filter(Group.id == site.group_id)
-            .scalar()
-        )
+        # 2) Stations per monitoring type (1 ambient, 2 effluent, 3 emission)
+        typed_stations = {1: set(), 2: set(), 3: set()}
+        for p in topo.params:
+            if p.monitoring_type_id in typed_stations:
+                typed_stations[p.monitoring_type_id].add(p.station_id)
 
-        # 2) Stations
-        stations = (
-            db.query(Station.id, Station.name)
-            .filter(Station.site_id == site_id)
-            .all()
-        )
-        station_ids = [s.id for s in stations]
-        station_name_map = {s.id: s.name for s in stations}
-
-        # 3) Counts via raw SQL
-        counts = db.execute(
-            text("""
-                SELECT
-                  COUNT(DISTINCT CASE WHEN p.monitoring_type_id = 1 THEN sp.station_id END) AS ambient,
-                  COUNT(DISTINCT CASE WHEN p.monitoring_type_id = 2 THEN sp.station_id END) AS effluent,
-                  COUNT(DISTINCT CASE WHEN p.monitoring_type_id = 3 THEN sp.station_id END) AS emission
-                FROM analyser_parameter ap
-                JOIN parameters p ON p.id = ap.parameter_id
-                JOIN station_parameters sp ON sp.analyser_param_id = ap.id
-                WHERE sp.station_id = ANY(:station_ids)
-            """),
-            {"station_ids": station_ids}
-        ).fetchone()
-        ambient_count  = counts.ambient  or 0
-        effluent_count = counts.effluent or 0
-        emission_count = counts.emission or 0
-
-        # 4) Build siteDetails
+        # 3) Build siteDetails
         site_details = {
             "siteId":                   f"site_{site.id}",
             "siteName":                 site.site_name,
@@ -75,10 +52,10 @@ def get_metadata(user:user_dependency,site_id: int, db: Session = Depends(getdb)
             "latitude":                 str(site.latitude) if site.latitude is not None else None,
             "longitude":                str(site.longitude) if site.longitude is not None else None,
             "location":                 site.city or site.address,
-            "ambient_stations_count":   ambient_count,
-            "effluent_stations_count":  effluent_count,
-            "emission_stations_count":  emission_count,
-            "groupName":                group_name,
+            "ambient_stations_count":   len(typed_stations[1]),
+            "effluent_stations_count":  len(typed_stations[2]),
+            "emission_stations_count":  len(typed_stations[3]),
+            "groupName":                site.group_name,
             "authExpiry":               site.auth_expiry.isoformat() if site.auth_expiry else None,
             "siteCurrentStatusEndTime": datetime.datetime.now().isoformat(),
         }
@@ -114,42 +91,32 @@ class LastParameterValue(BaseModel):
 @router.get("/site/{site_id}/latest-parameters", tags=['real-time'])
 def get_latest_site_parameters(user: user_dependency,site_id: int, db: Session = Depends(getdb)):
     enforce_site_access(user, site_id)
-    subquery = (
-        select(
-            SensorData.parameter_id,
-            func.max(SensorData.time).label("latest_time")
-        )
-        .where(SensorData.site_id == site_id)
-        .group_by(SensorData.parameter_id)
-        .subquery()
-    )
-
-    
-    query = (
-        select(
-            Parameter.name,
-            SensorData.value,
-            SensorData.time
-        )
-        .join(AnalyserParameter, AnalyserParameter.parameter_id == Parameter.id)
-        .join(stationParameter, stationParameter.analyser_param_id == AnalyserParameter.id)
-        .join(Station, Station.id == stationParameter.station_id)
-        .join(SensorData, (SensorData.parameter_id == Parameter.id) & (SensorData.site_id == site_id))
-        .join(subquery, (SensorData.parameter_id == subquery.c.parameter_id) & (SensorData.time == subquery.c.latest_time))
-        .where(Station.site_id == site_id)
-        .where(Parameter.monitoring_type_id.isnot(None))
-        .group_by(Parameter.id, SensorData.value, SensorData.time)
-    )
-
-    results = db.execute(query).fetchall()
+    # served from the worker's topology snapshot and latest-value cache
+    # (DB only on miss / stale)
+    topo = topology.site(db, site_id)
+    if topo is None:
+        return []
+    latest = latest_cache.site(db, site_id)
+
+    # newest reading per monitored parameter across the site's stations
+    newest = {}
+    for p in topo.params:
+        if p.monitoring_type_id is None:
+            continue
+        current = latest.latest(p.station_param_id)
+        if current is None:
+            continue
+        pid = p.parameter_id
+        if pid not in newest or current[1] > newest[pid][2]:
+            newest[pid] = (p.parameter_name, current[0], current[1])
 
     return [
         {
             "parameter_name": name,
-            "latest_value": float(value) if value is not None else None,
+            "latest_value": value,
             "timestamp": timestamp
         }
-        for name, value, timestamp in results
+        for _, (name, value, timestamp) in sorted(newest.items())
     ]
 
 
@@ -160,58 +127,37 @@ def get_latest_site_parameters(user: user_dependency,site_id: int, db: Session =
     tags=["real-time"]
 )
 def get_latest_station_parameters(user: user_dependency,site_id: int, db: Session = Depends(getdb)):
-    SD = SensorData
-    SP = stationParameter
-    ST = Station
-
     enforce_site_access(user, site_id)
-    # 1) latest‑time subquery
-    subq = (
-        select(
-            SD.station_param_id,
-            func.max(SD.time).label("latest_time")
-        )
-        .where(SD.site_id == site_id)
-        .group_by(SD.station_param_id)
-        .subquery()
-    )
-
-    # 2) main query: include an "expired" boolean
-    stmt = (
-        select(
-            SD.station_param_id,
-            SD.value.label("latest_value"),
-            SP.para_unit.label("unit"),
-            SD.time.label("timestamp"),
-            SP.is_editable.label("is_editable"),
-            # compute expired = (calibration_expiry_date < now())
-            (ST.calibration_expiry_date < func.now()).label("expired")
-        )
-        .select_from(SD)
-        .join(subq,
-              (SD.station_param_id == subq.c.station_param_id) &
-              (SD.time            == subq.c.latest_time)
-        )
-        .join(SP, SD.station_param_id == SP.id)
-        .join(ST, SP.station_id == ST.id)
-        .where(SD.site_id == site_id)
-        .order_by(SD.station_param_id)
+    topo = topology.site(db, site_id)
+    latest = (
+        db.query(LatestSensorData)
+        .filter(LatestSensorData.site_id == site_id)
+        .order_by(LatestSensorData.station_param_id)
+        .all()
     )
 
-    rows = db.execute(stmt).all()
+    # join to the snapshot in Python: (reading, station parameter, expired)
+    now = datetime.datetime.utcnow()
+    rows = []
+    for l in latest:
+        p = topo.param_by_id.get(l.station_param_id) if topo else None
+        if p is None:
+            continue
+        exp = topo.station_by_id[p.station_id].calibration_expiry_date
+        rows.append((l, p, bool(exp and exp < now)))
     if not rows:
         raise HTTPException(status_code=404, detail="No sensor data for this site")
 
     return [
         LastParameterValue(
-            station_param_id = r.station_param_id,
-            latest_value     = float(r.latest_value) if not r.expired else None,
-            unit             = r.unit     if not r.expired else None,
-            timestamp        = r.timestamp.isoformat() if (r.timestamp and not r.expired) else None,
-            is_editable      = r.is_editable,
-            expired          = bool(r.expired),
+            station_param_id = l.station_param_id,
+            latest_value     = float(l.value) if (l.value is not None and not expired) else None,
+            unit             = p.unit     if not expired else None,
+            timestamp        = l.time.isoformat() if (l.time and not expired) else None,
+            is_editable      = p.is_editable,
+            expired          = expired,
         )
-        for r in rows
+        for l, p, expired in rows
     ]
 
 
@@ -246,65 +192,62 @@ async def get_aggregated_avg_last24hrs(
         # either none were valid or all expired
         return []  
 
-    # 2) Build the CSV list from only the valid, non‑expired IDs
-    ids_csv = ",".join(map(str, valid_rows))
-
-    # 3) Determine bucket for time_bucket()
-    bucket = "1 hour" if interval == "1h" else "15 minutes"
-
-    # 4) 24hr window in UTC
-    past_24hr_utc = now_utc - timedelta(hours=24)
-
-    # 5) Run your aggregation only for valid_rows
-    sql = text(f"""
+    # 2) Names of the valid, non‑expired station parameters
+    meta_rows = db.execute(text("""
         SELECT
           sp.id                                      AS station_param_id,
           p.name                                     AS parameter_name,
           a.analyser_name                            AS analyser_name,
           (p.name || '-' || a.analyser_name)         AS display_name,
-          time_bucket('{bucket}', sd.time, 'Asia/Kolkata')                AS interval_start_utc,
-          time_bucket('{bucket}', sd.time, 'Asia/Kolkata') + INTERVAL '{bucket}' AS interval_end_utc,
-          AVG(sd.value)                              AS avg_value,
-          COUNT(*)                                   AS total_records,
-          MAX(p.unit)                                AS unit
-        FROM sensor_data sd
-        JOIN station_parameters sp ON sd.station_param_id = sp.id
+          p.unit                                     AS unit
+        FROM station_parameters sp
         JOIN analyser_parameter ap    ON sp.analyser_param_id = ap.id
         JOIN parameters p             ON ap.parameter_id = p.id
         JOIN analysers a              ON ap.analyser_id = a.id
-        WHERE sd.station_param_id IN ({ids_csv})
-          AND sd.time >= :past_24hr
-          AND sd.time <= :now
-        GROUP BY sp.id, p.name, a.analyser_name, interval_start_utc
-        ORDER BY display_name, interval_start_utc;
-    """)
+        WHERE sp.id = ANY(:spids)
+    """), {"spids": list(valid_rows)}).fetchall()
+    meta = {r.station_param_id: r for r in meta_rows}
+    if not meta:
+        return []
 
-    rows = db.execute(sql, {"past_24hr": past_24hr_utc, "now": now_utc}).fetchall()
+    # 3) Determine bucket (IST-aligned)
+    bucket = "1 hour" if interval == "1h" else "15 minutes"
+    width = timedelta(hours=1) if interval == "1h" else timedelta(minutes=15)
+
+    # 4) 24hr window in UTC
+    past_24hr_utc = now_utc - timedelta(hours=24)
+
+    # 5) Aggregates + raw tail, with the number of readings per interval
+    rows = sorted(
+        fetch_series(db, list(meta), past_24hr_utc, now_utc, bucket, origin=IST_ORIGIN, counts=True),
+        key=lambda r: (meta[r.station_param_id].display_name or "", r.ts),
+    )
 
     # 6) Assemble response as before...
     ist = ZoneInfo("Asia/Kolkata")
     response: dict[int, dict] = {}
     for r in rows:
-        start_ist = r.interval_start_utc.astimezone(ist)
-        end_ist   = r.interval_end_utc.astimezone(ist)
+        start_ist = r.ts.astimezone(ist)
+        end_ist   = (r.ts + width).astimezone(ist)
         x_axis = start_ist.strftime("%d/%m %H:%M")
 
         spid = r.station_param_id
+        m = meta[spid]
         if spid not in response:
             response[spid] = {
                 "station_param_id": spid,
-                "parameter_name":  r.parameter_name,
-                "analyser_name":   r.analyser_name,
-                "display_name":    r.display_name,
-                "unit":            r.unit,
+                "parameter_name":  m.parameter_name,
+                "analyser_name":   m.analyser_name,
+                "display_name":    m.display_name,
+                "unit":            m.unit,
                 "aggregated_data": [],
             }
 
         response[spid]["aggregated_data"].append({
             "interval_start": start_ist.isoformat(),
             "interval_end":   end_ist.isoformat(),
-            "avg_value":      float(r.avg_value) if r.avg_value is not None else None,
-            "total_records":  r.total_records,
+            "avg_value":      r.value,
+            "total_records":  r.n,
             "x_axis":         x_axis,
         })
 
@@ -2,14 +2,13 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import text
-from datetime import datetime, time
-from pytz import timezone as pytz_timezone
+from datetime import datetime
 
 from ...database.session import getdb
-from ...modals.masters import stationParameter
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...utils.topology import topology
+from ...utils.availability import availability, daily_counts, expected_readings
 
 router = APIRouter()
 
@@ -25,16 +24,14 @@ async def get_current_data_availability(
 ):
     """
     Returns DAY-WISE data availability (%) for a parameter.
-    Based on raw hourly reading counts stored in sensor_processed_1hr.
+    Based on hourly reading counts (utils/availability).
     """
     enforce_site_access(user, site_id)
     try:
-        # 1️⃣ Fetch param_interval (raw logging interval in seconds)
-        param_interval = (
-            db.query(stationParameter.param_interval)
-            .filter(stationParameter.id == station_param_id)
-            .scalar()
-        )
+        # 1️⃣ param_interval (raw logging interval in seconds) from the site snapshot
+        topo = topology.site(db, site_id)
+        param = topo.param_by_id.get(station_param_id) if topo is not None else None
+        param_interval = param.interval if param is not None and param.station_id == station_id else None
 
         if not param_interval or param_interval <= 0:
             raise HTTPException(
@@ -42,58 +39,28 @@ async def get_current_data_availability(
                 f"No valid param_interval found for station_param_id={station_param_id}"
             )
 
-        # 2️⃣ Convert input dates → IST → naive timestamps
-        IST = pytz_timezone("Asia/Kolkata")
+        # 2️⃣ Daily ACTUAL readings (IST days)
+        start_day = datetime.strptime(from_date, "%Y-%m-%d").date()
+        end_day = datetime.strptime(to_date, "%Y-%m-%d").date()
+        counts = daily_counts(db, [station_param_id], start_day, end_day)[station_param_id]
 
-        start_dt = IST.localize(
-            datetime.combine(datetime.strptime(from_date, "%Y-%m-%d"), time(0, 0))
-        ).replace(tzinfo=None)
+        # 3️⃣ Expected readings PER DAY
+        expected_per_day = expected_readings(param_interval, 86400)
 
-        end_dt = IST.localize(
-            datetime.combine(datetime.strptime(to_date, "%Y-%m-%d"), time(23, 59, 59))
-        ).replace(tzinfo=None)
-
-        # 3️⃣ Query daily ACTUAL readings from sensor_processed_1hr
-        sql = text("""
-            SELECT
-                date(sp.bucket_ist) AS day,
-                SUM(sp.data_aval) AS actual_readings
-            FROM sensor_processed_1hr sp
-            WHERE sp.site_id = :site_id
-              AND sp.station_id = :station_id
-              AND sp.station_param_id = :station_param_id
-              AND sp.bucket_ist BETWEEN :start_dt AND :end_dt
-            GROUP BY date(sp.bucket_ist)
-            ORDER BY day;
-        """)
-
-        rows = db.execute(sql, {
-            "site_id": site_id,
-            "station_id": station_id,
-            "station_param_id": station_param_id,
-            "start_dt": start_dt,
-            "end_dt": end_dt
-        }).fetchall()
-
-        # 4️⃣ Expected readings PER DAY
-        expected_per_day = int(24 * (3600 / param_interval))
-
-        # 5️⃣ Build per-day response list
+        # 4️⃣ Build per-day response list
         daily_results = []
-        for row in rows:
-            actual = int(row.actual_readings or 0)
-            pct = round((actual / expected_per_day) * 100, 2) if expected_per_day > 0 else 0
-            pct = min(pct, 100.0)
+        for day, actual in sorted(counts.items()):
+            pct = availability(actual, param_interval, 86400)
 
             daily_results.append({
-                "date": str(row.day),
+                "date": str(day),
                 "expected_readings": expected_per_day,
                 "actual_readings": actual,
                 "availability_percentage": pct,
                 "availability_out_of_100": f"{pct}%"
             })
 
-        # 6️⃣ Final response
+        # 5️⃣ Final response
         return {
             "site_id": site_id,
             "station_id": station_id,
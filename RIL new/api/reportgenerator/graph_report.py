@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 
 from ..auth.authentication import user_dependency
 from ...database.session import getdb
+from ...utils.formula_engine import compile_formula
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -128,7 +129,7 @@ def get_klm_report_optimized(
                 else:
                     usage_map = {p: lv[p] - fv[p] for p in params}
                     try:
-                        raw = eval(formula, {}, usage_map)
+                        raw = compile_formula(formula).evaluate(usage_map)
                         usage = round(abs(raw), 2)
                     except Exception:
                         usage = None
@@ -256,7 +257,7 @@ def get_kld_report(
                         usage_map[param] = float(row[0]) if row and row[0] else 0.0
 
                 try:
-                    result_value = eval(formula_str, {}, usage_map)
+                    result_value = compile_formula(formula_str).evaluate(usage_map)
                 except Exception:
                     result_value = None
 
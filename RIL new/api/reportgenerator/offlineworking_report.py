@@ -239,7 +239,6 @@ def get_sms_alert_report(
         import logging
 import re
 import calendar
-import pytz
 from datetime import datetime, date, timedelta
 from typing import List, Dict, Any
 
@@ -249,6 +248,8 @@ from sqlalchemy.orm import Session
 
 from ..auth.authentication import user_dependency
 from ...database.session import getdb
+from ...utils.formula_engine import compile_formula
+from ...utils.totaliser_report import DayBounds, compute_kld_report
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -298,75 +299,46 @@ def get_klm_report_optimized(
         ).fetchall()
         site_map = {r[0]: r[1] for r in site_rows}
 
-        IST = pytz.timezone('Asia/Kolkata')
-
-        def fetch_bounds_for(params: List[str], start_ist: datetime, end_ist: datetime):
-            month_start_6am = datetime(start_ist.year, start_ist.month, 1, 6, 0, 0)
-            start_utc = IST.localize(month_start_6am).astimezone(pytz.UTC)
-            end_utc = IST.localize(end_ist).astimezone(pytz.UTC)
-
-            sids = [site_map[p] for p in params if p in site_map]
-            if not sids:
-                return {}, {}, {}, {}
-
-            rows = db.execute(
-                text("""
-                    WITH md AS (
-                      SELECT param_label, value,
-                             (time AT TIME ZONE 'Asia/Kolkata') AS ist_time
-                        FROM sensor_data
-                       WHERE site_id = ANY(:sids)
-                         AND param_label = ANY(:params)
-                         AND time >= :start_utc
-                         AND time <  :end_utc
-                    ),
-                    firsts AS (
-                      SELECT DISTINCT ON(param_label)
-                             param_label, ist_time AS first_time, value AS first_value
-                        FROM md
-                       ORDER BY param_label, ist_time ASC
-                    ),
-                    lasts AS (
-                      SELECT DISTINCT ON(param_label)
-                             param_label, ist_time AS last_time, value AS last_value
-                        FROM md
-                       ORDER BY param_label, ist_time DESC
-                    )
-                    SELECT f.param_label,
-                           f.first_value, f.first_time,
-                           l.last_value,  l.last_time
-                      FROM firsts f
-                      LEFT JOIN lasts l USING(param_label)
-                """),
-                {"sids": sids, "params": params, "start_utc": start_utc, "end_utc": end_utc}
-            ).fetchall()
-
-            fv, ft, lv, lt = {}, {}, {}, {}
-            for pl, fval, ftime, lval, ltime in rows:
-                fv[pl] = float(fval or 0)
-                ft[pl] = ftime.isoformat() if ftime else None
-                lv[pl] = float(lval or 0)
-                lt[pl] = ltime.isoformat() if ltime else None
-
-            for p in params:
-                fv.setdefault(p, 0.0)
-                ft.setdefault(p, None)
-                lv.setdefault(p, 0.0)
-                lt.setdefault(p, None)
-            return fv, ft, lv, lt
-
         results: List[Dict[str, Any]] = []
 
-        def process_period(start_ist, end_ist, y, m, d=None):
+        # 3️⃣ Periods as [first totaliser day, end day) – a totaliser day runs 06:00 → 06:00 IST
+        periods = []
+        if pname and month > 0 and day:
+            periods.append((date(year, month, 1), date(year, month, day) + timedelta(days=1), year, month, day))
+        elif pname and month == 0:
+            for m in range(1, 13):
+                st = date(year, m, 1)
+                en = date(year + (m // 12), (m % 12) + 1, 1)
+                if year == today.year and m == today.month:
+                    en = today + timedelta(days=1)
+                periods.append((st, en, year, m, None))
+        else:
+            if month == 0:
+                month = today.month
+            single = (
+                date(year, month, day) if day else
+                today if (year == today.year and month == today.month) else
+                date(year, month, calendar.monthrange(year, month)[1])
+            )
+            periods.append((date(year, month, 1), single + timedelta(days=1), year, month, day))
+
+        # 4️⃣ One read of the daily first/last values for the whole span
+        bounds = DayBounds.load(
+            db, site_map,
+            min(p[0] for p in periods),
+            max(p[1] for p in periods),
+        )
+
+        for start_day, end_day, y, m, d in periods:
             for plant, formula, cfo_limit in formulas:
                 params = sorted(param_re.findall(formula))
-                fv, ft, lv, lt = fetch_bounds_for(params, start_ist, end_ist)
+                fv, ft, lv, lt = bounds.reduce(params, start_day, end_day)
                 if any(ft[p] is None or lt[p] is None for p in params):
                     usage = '-'
                 else:
                     usage_map = {p: lv[p] - fv[p] for p in params}
                     try:
-                        raw = eval(formula, {}, usage_map)
+                        raw = compile_formula(formula).evaluate(usage_map)
                         usage = round(abs(raw), 2)
                     except Exception:
                         usage = None
@@ -386,32 +358,6 @@ def get_klm_report_optimized(
                     entry["day"] = d
                 results.append(entry)
 
-        if pname and month > 0 and day:
-            st = datetime(year, month, 1)
-            en = datetime(year, month, day, 23, 59, 59)
-            process_period(st, en, year, month, day)
-            return {"status": "success", "data": results}
-
-        if pname and month == 0:
-            for m in range(1, 13):
-                st = datetime(year, m, 1)
-                en = datetime(year + (m // 12), (m % 12) + 1, 1)
-                if year == today.year and m == today.month:
-                    en = datetime.combine(today + timedelta(days=1), datetime.min.time())
-                process_period(st, en, year, m)
-            return {"status": "success", "data": results}
-
-        if month == 0:
-            month = today.month
-        single = (
-            date(year, month, day) if day else
-            today if (year == today.year and month == today.month) else
-            date(year, month, calendar.monthrange(year, month)[1])
-        )
-        st = datetime.combine(single, datetime.min.time())
-        en = st + timedelta(days=1)
-        process_period(st, en, year, month, day)
-
         return {"status": "success", "data": results}
 
     except Exception as ex:
@@ -443,68 +389,8 @@ def get_kld_report(
 
         logging.info(f"Generating KLD report for {station_name} from {from_date} to {to_date}...")
 
-        formulas = db.execute(
-            text("""
-                SELECT plant_name, formula, cfo_limit_kld
-                FROM station_formulas
-                WHERE station_name = :station_name AND is_active = TRUE
-                  AND (:plant_name IS NULL OR plant_name = :plant_name)
-            """),
-            {"station_name": station_name, "plant_name": plant_name}
-        ).fetchall()
-
-        results = []
-        for single_date in (from_date + timedelta(n) for n in range((to_date - from_date).days + 1)):
-            is_today = (single_date == today)
-            for plant, formula_str, cfo_limit in formulas:
-                params = list(set(re.findall(r"T\d+", formula_str)))
-                usage_map = {}
-                for param in params:
-                    site = db.execute(
-                        text("SELECT site_id FROM totaliser_data WHERE parameter_name = :param LIMIT 1"),
-                        {"param": param}
-                    ).fetchone()
-                    if not site:
-                        usage_map[param] = 0
-                        continue
-                    site_id = site[0]
-
-                    if is_today:
-                        v6am_row = db.execute(
-                            text("""SELECT value_6am FROM daily_totaliser_usage
-                                    WHERE site_id=:sid AND parameter_name=:param AND date=:d"""),
-                            {"sid": site_id, "param": param, "d": single_date}
-                        ).fetchone()
-                        v6am = float(v6am_row[0]) if v6am_row and v6am_row[0] else 0.0
-
-                        latest = db.execute(
-                            text("""SELECT value FROM sensor_data
-                                    WHERE site_id=:sid AND param_label=:param AND time >= date_trunc('day', now())
-                                    ORDER BY time DESC LIMIT 1"""),
-                            {"sid": site_id, "param": param}
-                        ).fetchone()
-                        latest_value = float(latest[0]) if latest else 0.0
-                        usage_map[param] = latest_value - v6am
-                    else:
-                        row = db.execute(
-                            text("""SELECT usage FROM daily_totaliser_usage
-                                    WHERE site_id=:sid AND parameter_name=:param AND date=:d"""),
-                            {"sid": site_id, "param": param, "d": single_date}
-                        ).fetchone()
-                        usage_map[param] = float(row[0]) if row and row[0] else 0.0
-
-                try:
-                    result_value = eval(formula_str, {}, usage_map)
-                except Exception:
-                    result_value = None
-
-                results.append({
-                    "date": single_date,
-                    "plant": plant,
-                    "station": station_name,
-                    "kld_usage": abs(round(result_value, 2)) if result_value is not None else None,
-                    "cfo_limit_kld": float(cfo_limit) if cfo_limit is not None else None
-                })
+        # one usage query for the whole range, formulas evaluated over the day axis
+        results = compute_kld_report(db, station_name, from_date, to_date, plant_name)
         return {"status": "success", "data": results}
 
     except Exception as e:
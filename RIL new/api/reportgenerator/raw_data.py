@@ -1,45 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-import datetime, io, gzip
 from ...database.session import getdb
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...utils.topology import topology
+from ...utils.series import plan_series
+from ...utils.streaming import (
+    column_names, format_rows, gzip_stream, normalize_bucket, parse_iso, select_params, site_param, validate_layout,
+    wide_rows,
+)
+from ...utils.arrow_export import arrow_stream, check_format, extension, is_columnar, media_type
 
 router = APIRouter(prefix="/api/raw-data", tags=["Raw Data"])
 
-SQL_TPL = """
-SELECT time_bucket(:bucket, time) AS ts,
-       AVG(value::double precision) AS avg
-FROM sensor_data
-WHERE site_id = :site_id
-  AND station_param_id = :spid
-  AND time >= :start AND time < :end
-GROUP BY 1
-ORDER BY 1;
-"""
-
-_ALLOWED_BUCKETS = {
-    "1 minute","2 minutes","5 minutes","10 minutes","15 minutes",
-    "30 minutes","60 minutes","120 minutes","240 minutes","1440 minutes"
-}
-
-def _parse_iso(ts: str, field: str):
-    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%d %H:%M:%S%z"):
-        try:
-            return datetime.datetime.strptime(ts, fmt)
-        except ValueError:
-            pass
-    raise HTTPException(400, f"Invalid {field} format. Use ISO8601 with timezone.")
-
-def _normalize_bucket(b: str | None) -> str:
-    if not b:
-        return "1 minute"
-    if b not in _ALLOWED_BUCKETS:
-        raise HTTPException(400, f"Invalid bucket. Allowed: {', '.join(sorted(_ALLOWED_BUCKETS))}")
-    return b
-
 
 @router.get("/export-gz/{site_id}")
 def export_raw_data_gz(
@@ -58,56 +33,39 @@ def export_raw_data_gz(
     Streams raw sensor data as gzip-compressed CSV.
     Only columns: timestamp,value
     """
-    start_dt = _parse_iso(from_date, "from_date")
-    end_dt   = _parse_iso(to_date, "to_date")
-    bucket   = _normalize_bucket(bucket)
+    start_dt = parse_iso(from_date, "from_date")
+    end_dt   = parse_iso(to_date, "to_date")
+    bucket   = normalize_bucket(bucket)
+
+    # the aggregate tiers are keyed by station parameter only: check the site here
+    site_param(topology.site(db, site_id), station_param_id)
+
+    # hourly / daily buckets come from the aggregates, the open tail from sensor_data
+    plan = plan_series(db, [station_param_id], start_dt, end_dt, bucket, site_id=site_id)
 
     engine = db.get_bind()
     conn = engine.connect().execution_options(stream_results=True)
 
-    params = {
-        "bucket": bucket,
-        "site_id": site_id,
-        "spid": station_param_id,
-        "start": start_dt,
-        "end": end_dt,
-    }
-
     if debug:
-        plan_sql = "EXPLAIN (ANALYZE, BUFFERS) " + SQL_TPL
-        plan_rows = conn.execute(text(plan_sql), params).fetchall()
+        plan_sql = "EXPLAIN (ANALYZE, BUFFERS) " + plan.sql
+        plan_rows = conn.execute(text(plan_sql), plan.params).fetchall()
         conn.close()
-        return {"explain": [r[0] for r in plan_rows]}
+        return {"segments": plan.describe(), "explain": [r[0] for r in plan_rows]}
+
+    result = plan.execute(conn)
 
-    result = conn.execute(text(SQL_TPL), params)
+    def csv_lines():
+        # CSV header
+        yield b"timestamp,value\n"
+        for ts, _, avg in result:
+            yield f"{ts.isoformat()},{float(avg)}\n".encode("utf-8")
 
     def gz_iter():
         """
         Stream gzip CSV directly from DB cursor.
         """
         try:
-            buf = io.BytesIO()
-            with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
-                # CSV header
-                gz.write(b"timestamp,value\n")
-
-                for ts, avg in result:
-                    line = f"{ts.isoformat()},{float(avg)}\n"
-                    gz.write(line.encode("utf-8"))
-
-                    # Yield chunks periodically (~64KB)
-                    if buf.tell() > 65536:
-                        gz.flush()
-                        buf.seek(0)
-                        chunk = buf.read()
-                        yield chunk
-                        buf.seek(0)
-                        buf.truncate(0)
-
-                # Flush any remaining data
-                gz.flush()
-            buf.seek(0)
-            yield buf.read()
+            yield from gzip_stream(csv_lines())
         finally:
             conn.close()
 
@@ -121,3 +79,78 @@ def export_raw_data_gz(
             "X-Accel-Buffering": "no",
         },
     )
+
+
+@router.get("/export-gz-multi/{site_id}")
+def export_raw_data_multi_gz(
+    user: user_dependency,
+    site_id: int,
+    from_date: str,
+    to_date: str,
+    station_param_ids: str = Query("all", description="'all' or comma-separated station_param_ids"),
+    bucket: str | None = Query(None, description="e.g. '1 minute' (default), '5 minutes'"),
+    layout: str = Query("long", description="'long' (one line per reading) or 'wide' (one column per parameter)"),
+    format: str = Query("csv", description="'csv', 'json', 'arrow' (IPC stream) or 'parquet'"),
+    db: Session = Depends(getdb),
+):
+    """
+    Streams bucketed sensor data of many station parameters of a site from a
+    single server-side cursor ordered by time: gzip-compressed CSV / JSON, or
+    typed columns as an Arrow IPC stream / Parquet file (zstd-compressed).
+    """
+    enforce_site_access(user, site_id)
+
+    start_dt = parse_iso(from_date, "from_date")
+    end_dt   = parse_iso(to_date, "to_date")
+    bucket   = normalize_bucket(bucket)
+    columnar = is_columnar(format)
+    validate_layout(layout, "csv" if columnar else format)
+    if columnar:
+        check_format(format)
+
+    topo = topology.site(db, site_id)
+    params = select_params(topo, station_param_ids)
+    names = column_names(topo, params)
+    meta = {"bucket": bucket, "from": start_dt.isoformat(), "to": end_dt.isoformat()}
+
+    plan = plan_series(db, list(names), start_dt, end_dt, bucket, site_id=site_id)
+
+    engine = db.get_bind()
+    conn = engine.connect().execution_options(stream_results=True)
+    result = plan.execute(conn)
+
+    if columnar:
+        spids = list(names)
+        if layout == "wide":
+            columns = [("timestamp", "timestamp")] + [(names[s], "float64") for s in spids]
+            rows = ((ts, *values) for ts, values in wide_rows(result, spids))
+        else:
+            station = {p.station_param_id: topo.station_by_id[p.station_id].name for p in params}
+            parameter = {p.station_param_id: p.parameter_name or p.label for p in params}
+            columns = [
+                ("timestamp", "timestamp"), ("station_param_id", "int64"),
+                ("station", "dictionary"), ("parameter", "dictionary"), ("value", "float64"),
+            ]
+            rows = ((ts, spid, station.get(spid), parameter.get(spid), v) for ts, spid, v in result)
+        body = arrow_stream(rows, columns, format)
+        content_type = media_type(format)
+        filename = f"site_{site_id}_{len(names)}_params_{layout}_{bucket.replace(' ','_')}.{extension(format)}"
+    else:
+        body = gzip_stream(format_rows(result, layout, format, names, meta))
+        content_type = "application/gzip"
+        filename = f"site_{site_id}_{len(names)}_params_{layout}_{bucket.replace(' ','_')}.{format}.gz"
+
+    def body_iter():
+        try:
+            yield from body
+        finally:
+            conn.close()
+
+    return StreamingResponse(
+        body_iter(),
+        media_type=content_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
@@ -1,15 +1,21 @@
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends
 from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.gzip import GZipMiddleware
 from starlette.background import BackgroundTask
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-import datetime, orjson
+import orjson
 from ...database.session import getdb
 from fastapi import Query
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...utils.topology import topology
+from ...utils.series import plan_series
+from ...utils.downsample import check_method, downsample_rows
+from ...utils.streaming import (
+    column_names, format_rows, normalize_bucket, parse_iso, select_params, site_param, validate_layout,
+)
 
 router = APIRouter(prefix="/api/raw-data", tags=["Raw Data"])
 
@@ -18,36 +24,6 @@ from time import perf_counter
 from fastapi.responses import ORJSONResponse
 
 
-SQL_TPL = """
-SELECT time_bucket(:bucket, time) AS ts,
-       AVG(value::double precision) AS avg
-FROM sensor_data
-WHERE site_id = :site_id
-  AND station_param_id = :spid
-  AND time >= :start AND time < :end
-GROUP BY 1
-ORDER BY 1;
-"""
-
-def _parse_iso(ts: str, field: str):
-    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%d %H:%M:%S%z"):
-        try:
-            return datetime.datetime.strptime(ts, fmt)
-        except ValueError:
-            pass
-    raise HTTPException(400, f"Invalid {field} format. Use ISO8601 with timezone.")
-
-_ALLOWED_BUCKETS = {
-    "1 minute","2 minutes","5 minutes","10 minutes","15 minutes",
-    "30 minutes","60 minutes","120 minutes","240 minutes","1440 minutes"
-}
-def _normalize_bucket(b: str | None) -> str:
-    if not b:
-        return "1 minute"
-    if b not in _ALLOWED_BUCKETS:
-        raise HTTPException(400, f"Invalid bucket. Allowed: {', '.join(sorted(_ALLOWED_BUCKETS))}")
-    return b
-
 @router.get("/{site_id}")
 def get_raw_data(
      user: user_dependency, 
@@ -58,41 +34,46 @@ def get_raw_data(
     to_date: str,
     bucket: str | None = Query(None, description="e.g. '1 minute' (default), '5 minutes'"),
     debug: bool = Query(False, description="Return EXPLAIN ANALYZE instead of data"),
+    max_points: int | None = Query(None, ge=2, le=100_000, description="Decimate to at most this many points (chart width in px)"),
+    downsample: str = Query("minmax", description="'minmax' (per-pixel low/high, keeps spikes) or 'lttb'"),
     db: Session = Depends(getdb),
 ):
     enforce_site_access(user, site_id)
     
-    start_dt = _parse_iso(from_date, "from_date")
-    end_dt   = _parse_iso(to_date,   "to_date")
-    bucket   = _normalize_bucket(bucket)
+    start_dt = parse_iso(from_date, "from_date")
+    end_dt   = parse_iso(to_date,   "to_date")
+    bucket   = normalize_bucket(bucket)
+    check_method(downsample)
+
+    # the aggregate tiers are keyed by station parameter only: check the site here
+    site_param(topology.site(db, site_id), station_param_id)
+
+    # hourly / daily buckets come from the aggregates, the open tail from sensor_data
+    plan = plan_series(db, [station_param_id], start_dt, end_dt, bucket, site_id=site_id)
 
     engine = db.get_bind()
     conn = engine.connect().execution_options(stream_results=True)
 
-    params = {
-        "bucket": bucket,
-        "site_id": site_id,
-        "spid": station_param_id,
-        "start": start_dt,
-        "end": end_dt,         # end-exclusive in SQL:  time < :end
-    }
-
     if debug:
-        plan_sql = "EXPLAIN (ANALYZE, BUFFERS) " + SQL_TPL
-        plan_rows = conn.execute(text(plan_sql), params).fetchall()
+        plan_sql = "EXPLAIN (ANALYZE, BUFFERS) " + plan.sql
+        plan_rows = conn.execute(text(plan_sql), plan.params).fetchall()
         conn.close()
-        return {"explain": [r[0] for r in plan_rows]}
+        return {"segments": plan.describe(), "explain": [r[0] for r in plan_rows]}
 
-    result = conn.execute(text(SQL_TPL), params)
+    result = plan.execute(conn)
 
     def row_iter():
         try:
             # include meta so you can verify the bucket in the client
             yield b'{"meta":'
-            yield orjson.dumps({"bucket": bucket, "from": start_dt.isoformat(), "to": end_dt.isoformat()})
+            yield orjson.dumps({
+                "bucket": bucket, "from": start_dt.isoformat(), "to": end_dt.isoformat(),
+                "max_points": max_points,
+            })
             yield b',"raw_data":['
+            rows = downsample_rows(result, max_points, downsample) if max_points else result
             first = True
-            for ts, avg in result:
+            for ts, _, avg in rows:
                 item = {"timestamp": ts.isoformat(), "value": float(avg)}
                 if not first: 
                     yield b","
@@ -102,4 +83,46 @@ def get_raw_data(
         finally:
             conn.close()  # ensure the DB connection is released even if client disconnects
 
-    return StreamingResponse(row_iter(), media_type="application/json")
\ No newline at end of file
+    return StreamingResponse(row_iter(), media_type="application/json")
+
+
+@router.get("/multi/{site_id}")
+def get_raw_data_multi(
+    user: user_dependency,
+    site_id: int,
+    from_date: str,
+    to_date: str,
+    station_param_ids: str = Query("all", description="'all' or comma-separated station_param_ids"),
+    bucket: str | None = Query(None, description="e.g. '1 minute' (default), '5 minutes'"),
+    layout: str = Query("long", description="'long' (one item per reading) or 'wide' (values per timestamp)"),
+    max_points: int | None = Query(None, ge=2, le=100_000, description="Decimate each series to at most this many points"),
+    downsample: str = Query("minmax", description="'minmax' (per-pixel low/high, keeps spikes) or 'lttb'"),
+    db: Session = Depends(getdb),
+):
+    enforce_site_access(user, site_id)
+
+    start_dt = parse_iso(from_date, "from_date")
+    end_dt   = parse_iso(to_date,   "to_date")
+    bucket   = normalize_bucket(bucket)
+    validate_layout(layout, "json")
+    check_method(downsample)
+
+    topo = topology.site(db, site_id)
+    params = select_params(topo, station_param_ids)
+    names = column_names(topo, params)
+    meta = {"bucket": bucket, "from": start_dt.isoformat(), "to": end_dt.isoformat(), "max_points": max_points}
+
+    plan = plan_series(db, list(names), start_dt, end_dt, bucket, site_id=site_id)
+
+    engine = db.get_bind()
+    conn = engine.connect().execution_options(stream_results=True)
+    result = plan.execute(conn)
+
+    def row_iter():
+        try:
+            rows = downsample_rows(result, max_points, downsample) if max_points else result
+            yield from format_rows(rows, layout, "json", names, meta)
+        finally:
+            conn.close()  # ensure the DB connection is released even if client disconnects
+
+    return StreamingResponse(row_iter(), media_type="application/json")
@@ -0,0 +1,112 @@
+import os
+import re
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from ...database.session import getdb
+from ...schemas.masterSchema import ReportJobSubmit
+from ..auth.authentication import user_dependency
+from ...utils.report_jobs import authorize, get_job, job_view, result_path, submit
+
+router = APIRouter(prefix="/api/report-jobs", tags=["Report Jobs"])
+
+READ_CHUNK = 1024 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _job_or_404(db, user, job_id: str) -> dict:
+    job = get_job(db, job_id)
+    if job is None:
+        raise HTTPException(404, "Report job not found")
+    authorize(user, job)
+    return job
+
+
+@router.post("", status_code=202)
+def submit_report_job(user: user_dependency, body: ReportJobSubmit, db: Session = Depends(getdb)):
+    """
+    Queue a long-range report (averaged sensor report, raw data, KLM, KLD).
+    `spec` takes the arguments of the report endpoint; an identical spec that
+    is queued, running or finished returns that job instead of a new one.
+    """
+    job, created = submit(db, body.kind, body.spec, user)
+    return {**job_view(job), "deduplicated": not created}
+
+
+@router.get("/{job_id}")
+def get_report_job(job_id: str, user: user_dependency, db: Session = Depends(getdb)):
+    return job_view(_job_or_404(db, user, job_id))
+
+
+def _file_chunks(path: str, start: int, length: int):
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        while length > 0:
+            data = fh.read(min(READ_CHUNK, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _byte_range(header: str, size: int):
+    """(start, end) inclusive for a single `bytes=` range, None to send the whole file; 416 if unsatisfiable."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1          # suffix: the last N bytes
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(416, "Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+@router.get("/{job_id}/download")
+def download_report_job(
+    job_id: str,
+    user: user_dependency,
+    range: str | None = Header(None),
+    if_range: str | None = Header(None),
+    db: Session = Depends(getdb),
+):
+    """
+    Result of a finished job.  Supports `Range: bytes=…` (one range) and
+    `If-Range` with the ETag, so interrupted downloads can resume.
+    """
+    job = _job_or_404(db, user, job_id)
+    if job["status"] != "done":
+        raise HTTPException(409, f"Report job is {job['status']}")
+    path = result_path(job)
+    if path is None:
+        raise HTTPException(410, "Report file is no longer available, submit the report again")
+
+    size = os.path.getsize(path)
+    etag = f'"{job_id}-{size}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{job["file_name"]}"',
+        # already compressed; keeps GZipMiddleware away from byte ranges
+        "Content-Encoding": "identity",
+    }
+
+    span = _byte_range(range, size) if range and (not if_range or if_range == etag) else None
+    if span is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(_file_chunks(path, 0, size), media_type=job["media_type"], headers=headers)
+
+    start, end = span
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _file_chunks(path, start, end - start + 1),
+        status_code=206,
+        media_type=job["media_type"],
+        headers=headers,
+    )
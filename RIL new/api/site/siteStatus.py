@@ -3,13 +3,23 @@ from sqlalchemy.sql import func, text
 from ...modals.masters import *
 from fastapi import APIRouter, Depends, HTTPException,Query
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy import func
 from ...database.session import getdb
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from ..auth.authentication import user_dependency
 from ...modals.masters import LatestSensorData 
 from sqlalchemy import MetaData, Table
 from ...utils.permissions import enforce_site_access
+from ...utils.latest_cache import latest_cache, current_bucket
+from ...utils.topology import topology
+from ...utils.exceedance import RULE_THRESHOLD, exceeding_now
+from ...utils.series import IST_ORIGIN, fetch_series
+from ...utils.quantiles import window_sketches
+from types import SimpleNamespace
+import numpy as np
+from zoneinfo import ZoneInfo
+
+IST = ZoneInfo("Asia/Kolkata")
 
 router = APIRouter(tags=["site-status"])
 
@@ -20,68 +30,63 @@ async def get_site_table_details(user: user_dependency,site_id: str, db: Session
     current_time = datetime.utcnow()
     yesterday_time = current_time - timedelta(hours=24)
 
-    # Get site details
-    site = db.query(Site).filter(Site.id == site_id).first()
-    if not site:
+    # Site, stations and parameters from the topology snapshot
+    topo = topology.site(db, int(site_id))
+    if topo is None:
         raise HTTPException(status_code=404, detail="Site not found")
+    site = topo.site
+    stations = topo.stations
 
-    # Get all stations for the site
-    stations = db.query(Station).filter(Station.site_id == site.id).all()
-    station_ids = [station.id for station in stations]
-
-    # Build a subquery to fetch the latest sensor value per parameter/station/analyser
-    subquery = db.query(
-        SensorData.parameter_id,
-        SensorData.analyser_id,
-        SensorData.station_id,
-        SensorData.value,
-        SensorData.time,
-        func.row_number().over(
-            partition_by=[SensorData.parameter_id, SensorData.analyser_id, SensorData.station_id],
-            order_by=SensorData.time.desc()
-        ).label("row_num")
-    ).filter(SensorData.site_id == site.id).subquery()
-
-    # Compute sensor parameter statistics over the last 24 hours
-    parameters_stats = (
+    # Latest sensor value per parameter/station/analyser
+    latest_rows = (
+        db.query(LatestSensorData.station_param_id, LatestSensorData.value)
+        .filter(LatestSensorData.site_id == site.id)
+        .all()
+    )
+    current = {}
+    for spid, value in latest_rows:
+        p = topo.param_by_id.get(spid)
+        if p is not None:
+            current[(p.station_id, p.parameter_id, p.analyser_id)] = value
+
+    # Sensor parameter statistics over the last 24 hours (ids only; names
+    # are joined from the snapshot below)
+    stats = (
         db.query(
-            Station.name.label("station_name"),
-            Parameter.name.label("parameter_name"),
-            Parameter.unit,
-            Parameter.id.label("parameter_id"),
-            Parameter.max_thershold,
-            Analyser.analyser_name,
-            Analyser.id.label("analyser_id"),
+            SensorData.station_id,
+            SensorData.parameter_id,
+            SensorData.analyser_id,
             func.min(SensorData.value).label("min_value"),
             func.max(SensorData.value).label("max_value"),
             func.avg(SensorData.value).label("avg_value"),
-            subquery.c.value.label("current_value")  # Latest value from subquery
-        )
-        .join(Station, SensorData.station_id == Station.id)
-        .join(Parameter, SensorData.parameter_id == Parameter.id)
-        .join(Analyser, SensorData.analyser_id == Analyser.id)
-        .join(
-            subquery,
-            (subquery.c.parameter_id == SensorData.parameter_id) &
-            (subquery.c.analyser_id == SensorData.analyser_id) &
-            (subquery.c.station_id == SensorData.station_id) &
-            (subquery.c.row_num == 1),
-            isouter=True
         )
         .filter(SensorData.site_id == site.id, SensorData.time >= yesterday_time)
-        .group_by(
-            Station.name,
-            Parameter.name,
-            Parameter.unit,
-            Parameter.id,
-            Parameter.max_thershold,
-            Analyser.analyser_name,
-            Analyser.id,
-            subquery.c.value
-        )
+        .group_by(SensorData.station_id, SensorData.parameter_id, SensorData.analyser_id)
         .all()
     )
 
+    parameter_by_id = {p.parameter_id: p for p in topo.params if p.parameter_id is not None}
+    analyser_name_by_id = {p.analyser_id: p.analyser_name for p in topo.params if p.analyser_id is not None}
+    parameters_stats = []
+    for r in stats:
+        station = topo.station_by_id.get(r.station_id)
+        param = parameter_by_id.get(r.parameter_id)
+        if station is None or param is None or r.analyser_id not in analyser_name_by_id:
+            continue
+        parameters_stats.append(SimpleNamespace(
+            station_name=station.name,
+            parameter_name=param.parameter_name,
+            unit=param.parameter_unit,
+            parameter_id=param.parameter_id,
+            max_thershold=param.max_threshold,
+            analyser_name=analyser_name_by_id[r.analyser_id],
+            analyser_id=r.analyser_id,
+            min_value=r.min_value,
+            max_value=r.max_value,
+            avg_value=r.avg_value,
+            current_value=current.get((r.station_id, r.parameter_id, r.analyser_id)),
+        ))
+
     # Calculate totalExceedingParameters
     response_map = {}
     for row in parameters_stats:
@@ -114,7 +119,7 @@ async def get_site_table_details(user: user_dependency,site_id: str, db: Session
         "siteLabel": site.siteuid,
         "location": site.address,
         "siteId": site.siteuid,
-        "industry": db.query(Group.group_name).filter(Group.id == site.group_id).scalar(),
+        "industry": site.group_name,
         "siteName": site.site_name,
         "isConnected": "Active",
         "city": site.city,
@@ -140,62 +145,40 @@ def get_site_latest_values(site_id: int, user: user_dependency, db: Session = De
     now = datetime.utcnow()
 
     try:
-        # 1️⃣ Fetch station parameters for this site
-        sp_query = (
-            select(
-                stationParameter.id.label("station_param_id"),
-                stationParameter.station_id,
-                stationParameter.para_threshold,
-                stationParameter.para_unit,
-                Station.name.label("station_name"),
-                Station.calibration_expiry_date.label("expiry_date"),
-                Parameter.name.label("param_name"),
-                MonitoringType.monitoring_type.label("monitoring_type"),
-            )
-            .join(Station, stationParameter.station_id == Station.id)
-            .outerjoin(AnalyserParameter, stationParameter.analyser_param_id == AnalyserParameter.id)
-            .outerjoin(Parameter, AnalyserParameter.parameter_id == Parameter.id)
-            .outerjoin(MonitoringType, Parameter.monitoring_type_id == MonitoringType.id)
-            .where(Station.site_id == site_id)
-        )
-
-        sp_rows = db.execute(sp_query).all()
-        if not sp_rows:
+        # 1️⃣ Station parameters for this site (topology snapshot)
+        topo = topology.site(db, site_id)
+        if topo is None or not topo.params:
             return []
 
-        sp_ids = [r.station_param_id for r in sp_rows]
-
-        # 2️⃣ Fetch latest value from site_status_15min
-        latest_query = text("""
-            SELECT DISTINCT ON (station_param_id)
-                station_param_id,
-                avg_value AS value,
-                bucket_time AS time
-            FROM site_status_15min
-            WHERE station_param_id = ANY(:sp_ids)
-            ORDER BY station_param_id, bucket_time DESC
-        """)
+        # 2️⃣ Current IST 15-min bucket average (same as site_status_15min),
+        #    from the worker's latest-value cache
+        latest = latest_cache.site(db, site_id)
+        bucket = current_bucket()
+        bucket_time = datetime.fromtimestamp(bucket, IST).replace(tzinfo=None)
 
-        latest_rows = db.execute(latest_query, {"sp_ids": sp_ids}).fetchall()
-        latest_map = {row.station_param_id: row for row in latest_rows}
+        # Parameters whose last classified 15-min bucket exceeded (open events)
+        exceeding = exceeding_now(db, site_id, RULE_THRESHOLD)
 
         # 3️⃣ Build response
         response = []
-        for r in sp_rows:
+        for p in topo.params:
+            station = topo.station_by_id[p.station_id]
+            expiry = station.calibration_expiry_date
 
-            latest = latest_map.get(r.station_param_id)
-            val = float(latest.value) if latest and latest.value is not None else 0
+            avg = latest.bucket_avg(p.station_param_id, bucket)
+            val = avg if avg is not None else 0
 
             response.append({
-                "name": f"{r.station_name} - {r.param_name}" if r.param_name else "Unknown",
+                "name": f"{station.name} - {p.parameter_name}" if p.parameter_name else "Unknown",
                 "current": val,
-                "unit": r.para_unit or "",
-                "station_param_id": r.station_param_id,
-                "station_id": r.station_id,
-                "is_expired": bool(r.expiry_date and r.expiry_date < now),
-                "monitoring_type": r.monitoring_type or "",
-                "threshold": r.para_threshold,
-                "time": latest.time if latest else None
+                "unit": p.unit or "",
+                "station_param_id": p.station_param_id,
+                "station_id": p.station_id,
+                "is_expired": bool(expiry and expiry < now),
+                "monitoring_type": p.monitoring_type or "",
+                "threshold": p.threshold,
+                "is_exceeding": p.station_param_id in exceeding,
+                "time": bucket_time if avg is not None else None
             })
 
         return response
@@ -263,7 +246,7 @@ async def get_site_chart_data(user: user_dependency,site_id: str, db: Session =
 
     enforce_site_access(user, site_id)
 
-    current_time = datetime.utcnow()
+    current_time = datetime.now(timezone.utc)
     yesterday_time = current_time - timedelta(hours=24)
 
     # Verify the site exists
@@ -271,45 +254,32 @@ async def get_site_chart_data(user: user_dependency,site_id: str, db: Session =
     if not site:
         raise HTTPException(status_code=404, detail="Site not found")
 
-    chart_query = text("""
-    SELECT 
-        s.name AS station_name,
-        p.name AS parameter_name,
-        p.id AS parameter_id,
-        p.unit AS unit,
-        a.id AS analyser_id,
-        date_trunc('hour', sd.time) AS hour_time,
-        AVG(sd.value) AS avg_value
-    FROM sensor_data sd
-    JOIN stations s ON sd.station_id = s.id
-    JOIN parameters p ON sd.parameter_id = p.id
-    JOIN analysers a ON sd.analyser_id = a.id
-    WHERE sd.site_id = :site_id
-      AND sd.time >= :yesterday_time
-    GROUP BY 
-        p.id,
-        s.name,
-        p.name,
-        p.unit,
-        a.id,
-        date_trunc('hour', sd.time)
-    ORDER BY hour_time ASC
-    """)
-    chart_data_raw = db.execute(chart_query, {"site_id": site.id, "yesterday_time": yesterday_time}).fetchall()
+    # Hourly means of every station parameter of the site (aggregates + raw tail)
+    topo = topology.site(db, site.id)
+    params = {
+        p.station_param_id: p
+        for p in (topo.params if topo is not None else ())
+        if p.parameter_id is not None and p.analyser_id is not None
+    }
+    rows = fetch_series(db, list(params), yesterday_time, current_time, "1 hour", site_id=site.id) if params else ()
 
     chart_data_dict = {}
-    for row in chart_data_raw:
-        param_key = f"{row.station_name}-{row.parameter_name}-analyzer_{row.analyser_id}"
+    for hour_time, station_param_id, avg_value in rows:
+        if avg_value is None:
+            continue
+        p = params[station_param_id]
+        station_name = topo.station_by_id[p.station_id].name
+        param_key = f"{station_name}-{p.parameter_name}-analyzer_{p.analyser_id}"
         if param_key not in chart_data_dict:
             chart_data_dict[param_key] = {
-                "id": f"Emission.{row.station_name}.analyzer_{row.analyser_id}.parameter_{row.parameter_id}",
-                "name": f"{row.station_name}-{row.parameter_name}",
-                "unit": row.unit,
+                "id": f"Emission.{station_name}.analyzer_{p.analyser_id}.parameter_{p.parameter_id}",
+                "name": f"{station_name}-{p.parameter_name}",
+                "unit": p.parameter_unit,
                 "sparkList": [],
                 "sparkListTime": []
             }
-        chart_data_dict[param_key]["sparkList"].append(float(row.avg_value))
-        chart_data_dict[param_key]["sparkListTime"].append(row.hour_time.strftime("%Y-%m-%d %H:%M"))
+        chart_data_dict[param_key]["sparkList"].append(avg_value)
+        chart_data_dict[param_key]["sparkListTime"].append(hour_time.strftime("%Y-%m-%d %H:%M"))
 
     # Ensure every parameter from the table data exists in chart data.
     # (Optional: if some parameters have no hourly chart data, add them with empty lists.)
@@ -390,21 +360,11 @@ async def get_site_chart_detail(
     if not stp:
         raise HTTPException(status_code=404, detail="Station‑Parameter mapping not found")
 
-    # 8) Query sensor_data for hourly averages over the last 24h
-    rows = (
-        db.query(
-            func.date_trunc("hour", SensorData.time).label("hour_time_utc"),
-            func.avg(SensorData.value).label("avg_value"),
-        )
-        .filter(
-            SensorData.site_id == site_id,
-            SensorData.station_param_id == stp.id,
-            SensorData.time >= past_24hr_utc,
-        )
-        .group_by("hour_time_utc")
-        .order_by("hour_time_utc")
-        .all()
-    )
+    # 8) Hourly (IST) averages over the last 24h: aggregates + raw tail
+    rows = [
+        r for r in fetch_series(db, [stp.id], past_24hr_utc, now_utc, "1 hour", origin=IST_ORIGIN, site_id=site_id)
+        if r.value is not None
+    ]
 
     if not rows:
         raise HTTPException(
@@ -412,16 +372,9 @@ async def get_site_chart_detail(
             detail="No chart data found for the specified sensor parameter",
         )
 
-    # 9) Build sparkList and sparkListTime, converting UTC → IST
-    sparkList = []
-    sparkListTime = []
-    for r in rows:
-        dt_utc = r.hour_time_utc
-        if dt_utc.tzinfo is None:
-            dt_utc = dt_utc.replace(tzinfo=timezone.utc)
-        dt_ist = dt_utc.astimezone(ist)
-        sparkList.append(float(r.avg_value))
-        sparkListTime.append(dt_ist.strftime("%Y-%m-%d %H:%M"))
+    # 9) Build sparkList and sparkListTime in IST
+    sparkList = [r.value for r in rows]
+    sparkListTime = [r.ts.astimezone(ist).strftime("%Y-%m-%d %H:%M") for r in rows]
 
     # 10) Fetch parameter info for unit & display name
     param = db.query(Parameter).get(parameter_id)
@@ -449,8 +402,8 @@ async def get_chart_detail_v2(
 ):
     from zoneinfo import ZoneInfo
 
-    now_naive = datetime.utcnow()
-    start_utc = now_naive - timedelta(hours=24)
+    now_utc = datetime.now(timezone.utc)
+    start_utc = now_utc - timedelta(hours=24)
     ist = ZoneInfo("Asia/Kolkata")
     enforce_site_access(user, site_id)
 
@@ -472,57 +425,40 @@ async def get_chart_detail_v2(
         if not parameter:
             raise HTTPException(status_code=404, detail="Parameter not found")
 
-        data = (
-            db.query(
-                func.date_trunc("hour", SensorData.time).label("hour"),
-                func.avg(SensorData.value).label("avg")
-            )
-            .filter(
-                SensorData.site_id == site_id,
-                SensorData.station_param_id == station_param_id,
-                SensorData.time >= start_utc
+        # hourly (IST) averages: aggregates + raw tail
+        data = [
+            r for r in fetch_series(
+                db, [station_param_id], start_utc, now_utc, "1 hour", origin=IST_ORIGIN, site_id=site_id
             )
-            .group_by("hour")
-            .order_by("hour")
-            .all()
-        )
+            if r.value is not None
+        ]
 
         if not data:
             raise HTTPException(status_code=404, detail="No data found")
 
-        sparkList = [float(d.avg) for d in data]
-        sparkListTime = [d.hour.replace(tzinfo=ZoneInfo("UTC")).astimezone(ist).isoformat() for d in data]
-
-        def safe_stats(values):
-            if not values:
-                return 0.0, 0.0, 0.0
-            return min(values), max(values), sum(values) / len(values)
-
-        def percentile(values, p):
-            values = sorted(values)
-            if not values:
-                return 0.0
-            k = (len(values) - 1) * (p / 100)
-            f = int(k)
-            c = min(f + 1, len(values) - 1)
-            return values[f] + (values[c] - values[f]) * (k - f)
-
-        min_v, max_v, avg_v = safe_stats(sparkList)
-        p10 = percentile(sparkList, 10)
-        p25 = percentile(sparkList, 25)
-        p50 = percentile(sparkList, 50)
-        p75 = percentile(sparkList, 75)
-        p90 = percentile(sparkList, 90)
+        sparkList = [d.value for d in data]
+        sparkListTime = [d.ts.astimezone(ist).isoformat() for d in data]
 
-        threshold = parameter.max_thershold or 0.0
+        hourly = np.array(sparkList, dtype=np.float64)
+        min_v, max_v, avg_v = float(hourly.min()), float(hourly.max()), float(hourly.mean())
+
+        # p10..p90: percentiles of the readings themselves (hourly sketches + raw tail)
+        sketch = window_sketches(db, [station_param_id], start_utc, now_utc).get(station_param_id)
+        if sketch is not None:
+            p10, p25, p50, p75, p90 = (float(v) for v in sketch.quantiles([0.1, 0.25, 0.5, 0.75, 0.9]))
+        else:
+            p10 = p25 = p50 = p75 = p90 = 0.0
 
-        above_thresh = len([v for v in sparkList if v > threshold])
-        within_thresh = len(sparkList) - above_thresh
+        threshold = parameter.max_thershold or 0.0
 
-        q1 = len([v for v in sparkList if v <= p25])
-        q2 = len([v for v in sparkList if p25 < v <= p50])
-        q3 = len([v for v in sparkList if p50 < v <= p75])
-        q4 = len([v for v in sparkList if v > p75])
+        # q1..q4: hours per quartile of the hourly averages themselves (the
+        # reading percentiles above would not split the hours into quarters)
+        hourly.sort()
+        h25, h50, h75 = np.percentile(hourly, [25, 50, 75])
+        le25, le50, le75, le_thresh = np.searchsorted(hourly, [h25, h50, h75, threshold], side="right").tolist()
+        q1, q2, q3, q4 = le25, le50 - le25, le75 - le50, len(hourly) - le75
+        above_thresh = len(hourly) - le_thresh
+        within_thresh = le_thresh
 
         return {
             "chartData": {
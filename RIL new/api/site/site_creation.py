@@ -14,6 +14,7 @@ from urllib.parse import unquote
 from ...utils.utils import *
 from starlette import status
 from ..auth.authentication import user_dependency
+from ...utils.topology import bump
 
 router = APIRouter()
 
@@ -263,6 +264,7 @@ async def update_site(
             db.add(site_doc)
             uploaded_files.append(file_path)
 
+    bump(db, site_ids=[site.id])
     db.commit()
     return response_strct(
         status_code=status.HTTP_200_OK,
@@ -24,6 +24,10 @@ from sqlalchemy.orm import Session
 from ...database.session import getdb
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...utils.topology import topology
+from ...utils.series import fetch_series
+from ...utils.exceedance import RULE_SITE_LEVEL, site_events
+from ...utils.availability import site_availability
 
 router = APIRouter()
 
@@ -59,65 +63,35 @@ def get_site_dashboard(user: user_dependency,site_id: int, db: Session = Depends
     parameter_ids = [p.id for p in parameters]
     total_parameters_connected = len(parameter_ids)
 
-    # --- UPDATED DATA AVAILABILITY LOGIC (IST full yesterday) ---
+    # --- DATA AVAILABILITY (IST full yesterday) ---
     # Yesterday in IST
     today_ist = datetime.datetime.utcnow() + datetime.timedelta(hours=5, minutes=30)
     yesterday_ist = (today_ist.date() - datetime.timedelta(days=1))
     local_start = datetime.datetime.combine(yesterday_ist, datetime.time.min)
-    local_end   = datetime.datetime.combine(yesterday_ist, datetime.time.max)
-
-    # 36-second baseline
-    EXPECTED_PER_PAIR = 2400
-
-    # 1) fetch relevant station_param_ids
-    station_param_ids = [
-        sp.id for sp in (
-            db.query(StationParameter)
-              .join(Station, Station.id == StationParameter.station_id)
-              .join(AnalyserParameter, StationParameter.analyser_param_id == AnalyserParameter.id)
-              .filter(
-                  Station.site_id == site_id,
-                  AnalyserParameter.parameter_id.in_(parameter_ids)
-              )
-              .all()
-        )
-    ]
-
-    # 2) count every row in IST day window per pair
-    avail_values = []
-    for sp_id in station_param_ids:
-        cnt = db.query(func.count())\
-            .filter(
-                SensorData.station_param_id == sp_id,
-                func.timezone('Asia/Kolkata', SensorData.time) >= local_start,
-                func.timezone('Asia/Kolkata', SensorData.time) <= local_end
-            )\
-            .select_from(SensorData)\
-            .scalar() or 0
-        avail_values.append(cnt / EXPECTED_PER_PAIR * 100)
-
-    # 3) average
-    data_availability = round(sum(avail_values) / len(avail_values), 2) if avail_values else 0
+    local_end = local_start + datetime.timedelta(days=1)
+
+    # Hourly reading counts of every connected parameter in one query,
+    # expected readings from each parameter's interval
+    topo = topology.site(db, site_id)
+    connected = set(parameter_ids)
+    site_params = [p for p in topo.params if p.parameter_id in connected] if topo is not None else []
+    data_availability = site_availability(db, site_id, local_start, local_end, params=site_params)
     # --- END DATA AVAILABILITY LOGIC ---
 
-    # 4) Exceeding parameters (yesterday IST)
-    exceeding_parameters = (
-        db.query(Parameter.name)
-        .join(SensorData, SensorData.parameter_id == Parameter.id)
-        .join(SiteLevelParameterThreshold, SiteLevelParameterThreshold.parameter_id == Parameter.id)
-        .filter(
-            SensorData.site_id == site_id,
-            func.timezone('Asia/Kolkata', SensorData.time).cast(Date) == yesterday_ist,
-            SensorData.value > SiteLevelParameterThreshold.site_level_threshold
-        )
-        .distinct()
-        .all()
-    )
-    exceeding_parameters = [p[0] for p in exceeding_parameters]
+    # 4) Exceeding parameters (yesterday IST): site-level threshold events
+    ist = pytz.timezone("Asia/Kolkata")
+    yesterday_start_utc = ist.localize(local_start).astimezone(pytz.utc)
+    yesterday_end_utc = yesterday_start_utc + datetime.timedelta(days=1)
+    exceeding_parameters = []
+    if topo is not None:
+        for e in site_events(db, site_id, yesterday_start_utc, yesterday_end_utc, RULE_SITE_LEVEL):
+            p = topo.param_by_id.get(e.station_param_id)
+            if p is not None and p.parameter_name and p.parameter_name not in exceeding_parameters:
+                exceeding_parameters.append(p.parameter_name)
 
     # 5) Other metrics
-    site_status_end_time = db.query(func.max(SensorData.time))\
-                             .filter(SensorData.site_id == site_id)\
+    site_status_end_time = db.query(func.max(LatestSensorData.time))\
+                             .filter(LatestSensorData.site_id == site_id)\
                              .scalar()
     device_count = db.query(Device).filter(Device.site_id == site_id).count()
     licence_expiry = (
@@ -196,7 +170,6 @@ async def get_multi_param_aggregation(
     try:
         import datetime as dt
         import pytz
-        from sqlalchemy import text
 
         ist = pytz.timezone("Asia/Kolkata")
         now_ist = dt.datetime.now(ist)
@@ -210,54 +183,26 @@ async def get_multi_param_aggregation(
             second=now_ist.second
         )
 
-        start_utc = start_ist.astimezone(pytz.utc)
-        end_utc = end_ist.astimezone(pytz.utc)
-
-        query = text(f"""
-    WITH bucketed AS (
-        SELECT 
-            sd.*, 
-            time_bucket(:agg_interval, sd.time, :bucket_origin) AS bucket
-        FROM sensor_data sd
-        WHERE sd.site_id = :site_id
-          AND sd.station_id = :station_id
-          AND sd.time BETWEEN :start_time AND :end_time
-    )
-    SELECT 
-        bucket AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Kolkata' AS time_bucket_ist,
-        station_param_id,
-        AVG(value) AS avg_value,
-        p.name AS parameter_name,
-        sp.pram_lable AS parameter_label
-    FROM bucketed
-    JOIN station_parameters sp ON bucketed.station_param_id = sp.id
-    JOIN analyser_parameter ap ON sp.analyser_param_id = ap.id
-    JOIN parameters p ON ap.parameter_id = p.id
-    GROUP BY bucket, station_param_id, p.name, sp.pram_lable
-    ORDER BY bucket;
-""")
-
-        bucket_origin_utc = start_ist.astimezone(pytz.utc)
-
-
-        result = db.execute(query, {
-            "site_id": site_id,
-            "station_id": station_id,
-            "start_time": start_utc,
-            "end_time": end_utc,
-            "agg_interval": agg_interval,
-            "bucket_origin": bucket_origin_utc
-        }).fetchall()
+        # Station parameters of the station; buckets start at 06:00 IST of from_date
+        topo = topology.site(db, site_id)
+        params = {
+            p.station_param_id: p
+            for p in (topo.params_by_station.get(station_id, ()) if topo is not None else ())
+            if p.parameter_name is not None
+        }
+        result = fetch_series(
+            db, list(params), start_ist, end_ist, agg_interval, origin=start_ist, site_id=site_id
+        ) if params else ()
 
         grouped_data = {}
         for row in result:
-            param_key = f"{row.parameter_name} "
+            param_key = f"{params[row.station_param_id].parameter_name} "
             if param_key not in grouped_data:
                 grouped_data[param_key] = []
             grouped_data[param_key].append({
-                "time_bucket": row.time_bucket_ist.strftime("%Y-%m-%d %H:%M:%S"),
+                "time_bucket": row.ts.astimezone(ist).strftime("%Y-%m-%d %H:%M:%S"),
                
-                "avg_value": row.avg_value,
+                "avg_value": row.value,
             
             })
 
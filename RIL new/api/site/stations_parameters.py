@@ -9,7 +9,8 @@ from zoneinfo import ZoneInfo
 from ..auth.authentication import user_dependency
 
 from ...database.session import getdb
-from ...modals.masters import Site, Station, Parameter, MonitoringType, Analyser, stationParameter, AnalyserParameter
+from ...modals.masters import Station, Parameter, stationParameter, AnalyserParameter
+from ...utils.topology import topology
 
 router = APIRouter()
 
@@ -21,13 +22,14 @@ async def get_stations_and_parameters(
     db: Session = Depends(getdb)
 ):
     try:
-        # 1) Validate site
-        site = db.query(Site).filter(Site.id == site_id).first()
-        if not site:
+        # 1) Site, stations and parameters from the topology snapshot
+        topo = topology.site(db, site_id)
+        if topo is None:
             raise HTTPException(status_code=404, detail="Site not found")
+        site = topo.site
 
-        # 2) Fetch stations
-        stations = db.query(Station).filter(Station.site_id == site_id).all()
+        # 2) Stations
+        stations = topo.stations
         if not stations:
             raise HTTPException(status_code=404, detail="No stations found for this site")
         from datetime import datetime, timedelta
@@ -50,34 +52,30 @@ async def get_stations_and_parameters(
             exp = station.calibration_expiry_date
             is_exp = bool(exp and exp < now_utc)
 
-            rows = (
-                db.query(Parameter, MonitoringType, Analyser, stationParameter)
-                  .join(AnalyserParameter, AnalyserParameter.parameter_id == Parameter.id)
-                  .join(stationParameter,  stationParameter.analyser_param_id == AnalyserParameter.id)
-                  .join(MonitoringType,    MonitoringType.id == Parameter.monitoring_type_id)
-                  .join(Analyser,          Analyser.id == AnalyserParameter.analyser_id)
-                  .filter(stationParameter.station_id == station.id)
-                  .all()
-            )
+            # parameters linked to a parameter, analyser and monitoring type
+            rows = [
+                p for p in topo.params_by_station.get(station.id, ())
+                if p.monitoring_type_id is not None and p.analyser_id is not None
+            ]
             if not rows:
                 continue
 
             monitoring_map = {}
-            for param, mtype, analyser, sp in rows:
-                all_spids.add(sp.id)
-                spid_expired[sp.id] = is_exp
+            for sp in rows:
+                all_spids.add(sp.station_param_id)
+                spid_expired[sp.station_param_id] = is_exp
 
-                block = monitoring_map.setdefault(mtype.id, {
-                    "monitoringLabel": mtype.monitoring_type,
-                    "monitoringId":    mtype.id,
+                block = monitoring_map.setdefault(sp.monitoring_type_id, {
+                    "monitoringLabel": sp.monitoring_type,
+                    "monitoringId":    sp.monitoring_type_id,
                     "parameters":      []
                 })
                 block["parameters"].append({
-                    "id":               param.id,
-                    "parameter_name":   param.name,
-                    "analyser_name":    analyser.analyser_name,
-                    "station_param_id": sp.id,
-                    "unit":             sp.para_unit,
+                    "id":               sp.parameter_id,
+                    "parameter_name":   sp.parameter_name,
+                    "analyser_name":    sp.analyser_name,
+                    "station_param_id": sp.station_param_id,
+                    "unit":             sp.unit,
                     "is_editable":      sp.is_editable,
                     "15m_avg":          0.00,   # start at 0.00
                     "15m_avg_time":     "-",    # time dash
@@ -92,26 +90,27 @@ async def get_stations_and_parameters(
                 "monitoring_types": []
             })
 
-        # 5) Aggregate real averages
+        # 5) Latest 15-minute average: the bucket holding each parameter's
+        #    latest reading (latest_sensor_data), averaged by sensor_agg_15min;
+        #    falls back to the reading itself until the bucket is materialised
         if all_spids:
-            ids_csv = ",".join(map(str, all_spids))
-            sql = text(f"""
+            sql = text("""
                 SELECT
-                  sd.station_param_id,
-                  time_bucket('15 minutes', sd.time, 'Asia/Kolkata') AS interval_start,
-                  AVG(sd.value) AS avg_value
-                FROM sensor_data sd
-                WHERE sd.station_param_id IN ({ids_csv})
-                  AND sd.time BETWEEN :past_24hr AND :now
-                GROUP BY sd.station_param_id, interval_start
-                ORDER BY interval_start DESC
+                  l.station_param_id,
+                  time_bucket('15 minutes', l.time) AS interval_start,
+                  COALESCE(a.avg_value, l.value)    AS avg_value
+                FROM latest_sensor_data l
+                LEFT JOIN sensor_agg_15min a
+                  ON a.station_param_id = l.station_param_id
+                 AND a.bucket = time_bucket('15 minutes', l.time)
+                WHERE l.station_param_id = ANY(:spids)
+                  AND l.time BETWEEN :past_24hr AND :now
             """)
-            rows = db.execute(sql, {"past_24hr": past_24hr_utc, "now": now_utc}).fetchall()
+            rows = db.execute(sql, {"spids": list(all_spids), "past_24hr": past_24hr_utc, "now": now_utc}).fetchall()
 
             latest_avg = {}
             for r in rows:
                 spid = r.station_param_id
-                # only take the most recent bucket per spid
                 if spid not in latest_avg:
                     latest_avg[spid] = {
                         "15m_avg":      float(r.avg_value),
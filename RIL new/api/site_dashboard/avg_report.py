@@ -8,14 +8,18 @@ from ...modals.masters import *
 from ...database.session import getdb
 from ...utils.utils import *
 from dateutil import parser
-import io, csv, gzip
 import pytz
 from datetime import datetime, timedelta, timezone
 from fastapi import Query
-import math
 router = APIRouter()
 from ..auth.authentication import user_dependency
 from ...utils.permissions import enforce_site_access
+from ...utils.exceedance import RULE_THRESHOLD, daily_exceedance_counts
+from ...utils.streaming import csv_chunks, gzip_stream
+from ...utils.arrow_export import arrow_stream, check_format, extension, is_columnar, media_type
+from ...utils.result_cache import result_cache
+from ...utils.topology import topology
+from ...utils.moments import window_moments
 
 @router.post("/api/sensor-data-report/export-csv-gz/{site_id}")
 async def export_sensor_data_csv_gz(
@@ -27,12 +31,14 @@ async def export_sensor_data_csv_gz(
     station_param_id: Union[int, str] = Form("all"),
     monitoring_type_id: Union[int, str] = Form("all"),
     time_interval: str = Form("1hr"),
+    output_format: str = Form("csv"),
     db: Session = Depends(getdb),
 ):
     """
     📦 Exports gzipped CSV with averaged sensor data.
     ✅ Uses processed sensor tables or continuous aggregates.
     ✅ Time window strictly aligned to IST.
+    ✅ output_format "arrow" / "parquet": typed columns instead of CSV.
     """
 
     # 🕓 Parse and convert to IST
@@ -60,6 +66,8 @@ async def export_sensor_data_csv_gz(
 
     if time_interval not in VALID_TIME_INTERVALS:
         raise HTTPException(status_code=400, detail=f"Invalid interval: {time_interval}")
+    if output_format != "csv":
+        check_format(output_format)
 
     table_info = TIME_INTERVAL_TABLES[time_interval]
     table_name = table_info["table"]
@@ -86,6 +94,17 @@ async def export_sensor_data_csv_gz(
     where_clause = " AND ".join(filters)
     bucket_expr = f"agg.{bucket_col}"
 
+    # 📦 Closed windows (CAGG materialized, outside its refresh window) come from the result cache
+    cache_key = result_cache.key(
+        db, "sensor_data_export",
+        {**params, "time_interval": time_interval, "output_format": output_format},
+        table_name, ist_end, site_id,
+    )
+    if cache_key is not None:
+        cached = result_cache.stream(cache_key)
+        if cached is not None:
+            return _export_response(cached, site_id, ist_start, ist_end, output_format)
+
     # 🧠 SQL query
     if time_interval == "1hr":
         # 1-hour: use pre-aggregated CAGG directly
@@ -168,11 +187,6 @@ async def export_sensor_data_csv_gz(
             ORDER BY mt.monitoring_type, {bucket_expr};
         """
 
-    # 🚀 Execute query
-    rows = db.execute(text(sql), params).fetchall()
-    if not rows:
-        raise HTTPException(status_code=404, detail="No data found")
-
     # 🏷 Group name lookup
     group_name = (
         db.execute(
@@ -183,75 +197,106 @@ async def export_sensor_data_csv_gz(
         or "No group"
     )
 
-    # 🧾 Prepare export rows
-    data_rows = [
-        {
-            "time_interval": row.time_interval,
-            "avg_value": row.avg_value,
-            "stddev_value": getattr(row, "stddev_value", None),
-            "site_name": row.site_name,
-            "site_address": row.site_address,
-            "parameter_name": row.parameter_name,
-            "analyser_name": row.analyser_name,
-            "station_name": row.station_name,
-            "monitoring_type_name": row.monitoring_type_name,
-        }
-        for row in rows
+    # 🚀 Execute query on a server-side cursor; rows are encoded and
+    #    compressed as they arrive, never held as a whole
+    conn = db.get_bind().connect().execution_options(stream_results=True)
+    try:
+        result = conn.execute(text(sql), params)
+        first = result.fetchone()
+    except Exception:
+        conn.close()
+        raise
+    if first is None:
+        conn.close()
+        raise HTTPException(status_code=404, detail="No data found")
+
+    with_stddev = time_interval in ["1hr", "1day"]
+    headers = [
+        "time_interval",
+        "avg_value",
+        "site_name",
+        "site_address",
+        "group_name",
+        "parameter_name",
+        "analyser_name",
+        "station_name",
+        "monitoring_type_name",
     ]
+    if with_stddev:
+        headers.insert(2, "stddev_value")
+
+    def csv_rows():
+        yield first
+        yield from result
+
+    def export_rows():
+        for r in csv_rows():
+            ti_ist = r.time_interval.astimezone(ist)
+            row = [
+                ti_ist.strftime("%Y-%m-%d %H:%M:%S"),
+                round(float(r.avg_value or 0), 2),
+            ]
+            if with_stddev:
+                row.append(round(float(r.stddev_value or 0), 2))
+            row.extend([
+                r.site_name,
+                r.site_address,
+                group_name,
+                r.parameter_name,
+                r.analyser_name,
+                r.station_name,
+                r.monitoring_type_name,
+            ])
+            yield row
+
+    # 📊 Typed columns (unrounded values, nulls kept) for Arrow / Parquet
+    def columnar_rows():
+        for r in csv_rows():
+            row = [r.time_interval, r.avg_value]
+            if with_stddev:
+                row.append(r.stddev_value)
+            row.extend([
+                r.site_name, r.site_address, group_name, r.parameter_name,
+                r.analyser_name, r.station_name, r.monitoring_type_name,
+            ])
+            yield row
+
+    # 📦 Gzip stream generator (first chunk at once, then ~64KB chunks)
+    if is_columnar(output_format):
+        kinds = {"time_interval": "timestamp", "avg_value": "float64", "stddev_value": "float64"}
+        columns = [(h, kinds.get(h, "dictionary")) for h in headers]
+        body = arrow_stream(columnar_rows(), columns, output_format)
+    else:
+        body = gzip_stream(csv_chunks(headers, export_rows()))
 
-    # 📦 Gzip stream generator
     def gz_stream():
-        buffer = io.BytesIO()
-        with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
-            text_wrapper = io.TextIOWrapper(gz, encoding="utf-8", newline="")
-            writer = csv.writer(text_wrapper)
-            headers = [
-                "time_interval",
-                "avg_value",
-                "site_name",
-                "site_address",
-                "group_name",
-                "parameter_name",
-                "analyser_name",
-                "station_name",
-                "monitoring_type_name",
-            ]
-            if time_interval in ["1hr", "1day"]:
-                headers.insert(2, "stddev_value")
-            writer.writerow(headers)
-
-            for row_data in data_rows:
-                ti_ist = row_data["time_interval"].astimezone(ist)
-                row = [
-                    ti_ist.strftime("%Y-%m-%d %H:%M:%S"),
-                    round(float(row_data["avg_value"] or 0), 2),
-                ]
-                if time_interval in ["1hr", "1day"]:
-                    row.append(round(float(row_data["stddev_value"] or 0), 2))
-                row.extend([
-                    row_data["site_name"],
-                    row_data["site_address"],
-                    group_name,
-                    row_data["parameter_name"],
-                    row_data["analyser_name"],
-                    row_data["station_name"],
-                    row_data["monitoring_type_name"],
-                ])
-                writer.writerow(row)
-            text_wrapper.flush()
-        buffer.seek(0)
-        yield buffer.read()
+        try:
+            yield from body
+        finally:
+            conn.close()
+
+    body_out = gz_stream() if cache_key is None else result_cache.tee(cache_key, gz_stream())
+    return _export_response(body_out, site_id, ist_start, ist_end, output_format)
+
+
+def _export_response(body, site_id, ist_start, ist_end, output_format):
+    if is_columnar(output_format):
+        content_type = media_type(output_format)
+        suffix = extension(output_format)
+    else:
+        content_type = "application/gzip"
+        suffix = "csv.gz"
 
     # 🧾 Filename
     filename = (
         f"sensor_data_site_{site_id}_{ist_start:%Y%m%d_%H%M%S}_"
-        f"{ist_end:%Y%m%d_%H%M%S}.csv.gz"
+        f"{ist_end:%Y%m%d_%H%M%S}.{suffix}"
     )
 
     # ✅ Stream response
     return StreamingResponse(
-        gz_stream(),
-        media_type="application/gzip",
+        body,
+        media_type=content_type,
         headers={
             "Content-Disposition": f'attachment; filename="{filename}"',
             "X-Accel-Buffering": "no",
@@ -277,10 +322,13 @@ async def get_exceedance_report_daily(
     ✅ Daily exceedance report using:
         • Raw `sensor_data`
         • 15-minute averages from `sensor_agg_15min`
+        • 15-min exceedance counts from `exceedance_events`
     Threshold source: `station_parameters.para_threshold`
     Exceedance rule:
         • Raw exceedance: value > threshold
         • 15-min exceedance: avg_value > threshold * 1.10
+    Every figure covers [from_date, to_date) per IST day; the reading-level
+    statistics (min / max / readings above the threshold) have no aggregate.
     """
 
     enforce_site_access(user, site_id)
@@ -315,7 +363,7 @@ async def get_exceedance_report_daily(
             WHERE sd.station_param_id = :station_param_id
               AND stn.id = :station_id
               AND st.id = :site_id
-              AND sd.time BETWEEN :start_date AND :end_date
+              AND sd.time >= :start_date AND sd.time < :end_date
             GROUP BY DATE(sd.time AT TIME ZONE 'Asia/Kolkata'),
                      p.name, spm.para_threshold, spm.para_unit, st.site_name, stn.name
             ORDER BY DATE(sd.time AT TIME ZONE 'Asia/Kolkata');
@@ -348,16 +396,14 @@ async def get_exceedance_report_daily(
                 "daily_data": []
             }
 
-        # ---------- 15-MINUTE EXCEEDANCE AGGREGATION ----------
+        # ---------- 15-MINUTE BUCKETS PER DAY ----------
         exceed_15_query = text("""
             SELECT 
                 DATE(sa.bucket AT TIME ZONE 'Asia/Kolkata') AS date_ist,
-                COUNT(*) AS total_15min_records,
-                SUM(CASE WHEN sa.avg_value > spm.para_threshold * 1.10 THEN 1 ELSE 0 END) AS exceed_count_15min
+                COUNT(*) AS total_15min_records
             FROM sensor_agg_15min sa
-            JOIN station_parameters spm ON sa.station_param_id = spm.id
             WHERE sa.station_param_id = :station_param_id
-              AND sa.bucket BETWEEN :start_date AND :end_date
+              AND sa.bucket >= :start_date AND sa.bucket < :end_date
             GROUP BY DATE(sa.bucket AT TIME ZONE 'Asia/Kolkata')
             ORDER BY DATE(sa.bucket AT TIME ZONE 'Asia/Kolkata');
         """)
@@ -374,6 +420,12 @@ async def get_exceedance_report_daily(
         # ✅ DATE() returns date, so don't call .date()
         exceed_15_map = {row.date_ist: row for row in exceed_15_result}
 
+        # Exceeding buckets per day (maintained at ingest), over the same
+        # [start, end) as the bucket totals above
+        exceed_15_counts = daily_exceedance_counts(
+            db, station_param_id, start_date, end_date, RULE_THRESHOLD
+        )
+
         # ---------- GROUP NAME LOOKUP ----------
         group_query = (
             select(Group.group_name)
@@ -389,7 +441,7 @@ async def get_exceedance_report_daily(
             date_key = row.date_ist
 
             exceed15 = exceed_15_map.get(date_key)
-            exceed15_count = exceed15.exceed_count_15min if exceed15 else 0
+            exceed15_count = exceed_15_counts.get(date_key, 0)
             exceed15_total = exceed15.total_15min_records if exceed15 else 0
 
             exceed_percent_raw = round(
@@ -432,7 +484,7 @@ async def get_exceedance_report_daily(
                 "from_date": start_date.isoformat(),
                 "to_date": end_date.isoformat(),
                 "records_fetched": len(daily_data),
-                "source_tables": ["sensor_data", "sensor_agg_15min"],
+                "source_tables": ["sensor_data", "sensor_agg_15min", "exceedance_events"],
                 "threshold_source": "station_parameters.para_threshold",
                 "15min_exceed_logic": "avg_value > threshold * 1.10"
             },
@@ -456,6 +508,65 @@ async def get_exceedance_report_daily(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def _stddev_window(db, site_id: int, days: int, station_param_id: int = None):
+    """
+    Moments of the site's station parameters (or just `station_param_id`)
+    from IST midnight `days - 1` days ago until now, per IST day when
+    days > 1: the topology snapshot and one query (utils/moments.py).
+    """
+    ist = pytz.timezone("Asia/Kolkata")
+    now_ist = datetime.now(ist)
+    from_date = now_ist.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+
+    topo = topology.site(db, site_id)
+    if topo is None:
+        params = []
+    elif station_param_id is None:
+        params = list(topo.params)
+    else:
+        params = [topo.param_by_id[station_param_id]] if station_param_id in topo.param_by_id else []
+
+    m = window_moments(db, [p.station_param_id for p in params], from_date, now_ist, by_day=days > 1)
+    return topo, params, m, from_date, now_ist
+
+
+def _stddev_by_param(topo, params, m) -> list:
+    """Per station parameter with readings, ordered by station and parameter name."""
+    data = []
+    for p in sorted(params, key=lambda p: (topo.station_by_id[p.station_id].name, p.parameter_name or "")):
+        stats = m.get(p.station_param_id)
+        if stats is None or stats[0] == 0:
+            continue
+        n, _, stddev = stats
+        station = topo.station_by_id[p.station_id]
+        data.append({
+            "station_id": station.id,
+            "station_name": station.name,
+            "station_param_id": p.station_param_id,
+            "parameter_name": p.parameter_name,
+            "unit": p.unit,
+            "monitoring_type_id": p.monitoring_type_id,
+            "monitoring_type_name": p.monitoring_type,
+            "stddev_value": round(stddev, 3),
+            "total_samples": n
+        })
+    return data
+
+
+def _stddev_by_day(m, station_param_id: int, from_date, to_date, include_today: bool) -> list:
+    """Per IST day with readings (today always with `include_today`), oldest first."""
+    data = []
+    day = from_date.date()
+    while day <= to_date.date():
+        stats = m.get((station_param_id, day))
+        if stats is not None and stats[0] > 0:
+            data.append({"date": day.strftime("%Y-%m-%d"), "stddev_value": round(stats[2], 3)})
+        elif include_today and day == to_date.date():
+            data.append({"date": day.strftime("%Y-%m-%d"), "stddev_value": 0})
+        day += timedelta(days=1)
+    return data
+
+
 @router.get(
     "/api/site-station-parameter-stddev-today/{site_id}",
     tags=["sensor stats"]
@@ -466,69 +577,19 @@ async def get_site_station_parameter_stddev_today(
     db: Session = Depends(getdb),
 ):
     """
-    Returns TRUE full-day (00:00 to now) weighted standard deviation
-    computed from hourly buckets in sensor_stddev_1hr.
+    Returns TRUE full-day (00:00 to now) standard deviation of the raw
+    readings of every station parameter of the site, merged exactly from
+    n / Σx / Σx² of the hourly aggregates and the raw tail.
 
-    Uses:
-        n, sum_x, sum_x2
-    to compute:
-        stddev = sqrt( (Σx2 / N) - (mean^2) )
-    
     Timezone: Asia/Kolkata
     """
 
     enforce_site_access(user, site_id)
     try:
-        # ---------- Time window (IST) ----------
-        ist = pytz.timezone("Asia/Kolkata")
-        now_ist = datetime.now(ist)
+        topo, params, m, from_date, to_date = _stddev_window(db, site_id, days=1)
+        data = _stddev_by_param(topo, params, m)
 
-        from_date = now_ist.replace(hour=0, minute=0, second=0, microsecond=0)
-        to_date = now_ist
-
-        # ---------- SQL QUERY ----------
-        # We use SUM(n), SUM(sum_x), SUM(sum_x2) per parameter
-        query = text("""
-            SELECT
-                si.id AS site_id,
-                si.site_name,
-                st.id AS station_id,
-                st.name AS station_name,
-                sp.id AS station_param_id,
-                p.name AS parameter_name,
-                sp.para_unit AS unit,
-                p.monitoring_type_id AS monitoring_type_id,
-                mt.monitoring_type AS monitoring_type_name,
-                
-                SUM(sdv.n) AS total_n,
-                SUM(sdv.sum_x) AS total_sum_x,
-                SUM(sdv.sum_x2) AS total_sum_x2
-
-            FROM sensor_stddev_1hr sdv
-            JOIN station_parameters sp ON sp.id = sdv.station_param_id
-            JOIN stations st ON st.id = sp.station_id
-            JOIN site si ON si.id = st.site_id
-            JOIN analyser_parameter ap ON sp.analyser_param_id = ap.id
-            JOIN parameters p ON ap.parameter_id = p.id
-            JOIN monitoring_types mt ON p.monitoring_type_id = mt.id
-
-            WHERE si.id = :site_id
-              AND sdv.bucket_ist BETWEEN :from_date AND :to_date
-
-            GROUP BY
-                si.id, si.site_name, st.id, st.name,
-                sp.id, p.name, sp.para_unit,
-                p.monitoring_type_id, mt.monitoring_type
-
-            ORDER BY st.name, p.name;
-        """)
-
-        rows = db.execute(
-            query,
-            {"site_id": site_id, "from_date": from_date, "to_date": to_date}
-        ).fetchall()
-
-        if not rows:
+        if not data:
             return {
                 "site_id": site_id,
                 "site_name": None,
@@ -537,36 +598,9 @@ async def get_site_station_parameter_stddev_today(
                 "data": []
             }
 
-        # ---------- Calculate weighted stddev ----------
-        data = []
-
-        for r in rows:
-            N = float(r.total_n or 0)
-            sum_x = float(r.total_sum_x or 0)
-            sum_x2 = float(r.total_sum_x2 or 0)
-
-            if N > 0:
-                mean = sum_x / N
-                variance = (sum_x2 / N) - (mean * mean)
-                stddev_today = math.sqrt(variance) if variance > 0 else 0
-            else:
-                stddev_today = 0
-
-            data.append({
-                "station_id": r.station_id,
-                "station_name": r.station_name,
-                "station_param_id": r.station_param_id,
-                "parameter_name": r.parameter_name,
-                "unit": r.unit,
-                "monitoring_type_id": r.monitoring_type_id,
-                "monitoring_type_name": r.monitoring_type_name,
-                "stddev_value": round(stddev_today, 3),
-                "total_samples": int(N)
-            })
-
         return {
-            "site_id": rows[0].site_id,
-            "site_name": rows[0].site_name,
+            "site_id": site_id,
+            "site_name": topo.site.site_name,
             "from_date": from_date.isoformat(),
             "to_date": to_date.isoformat(),
             "records_found": len(data),
@@ -592,61 +626,17 @@ async def get_site_station_parameter_stddev(
     db: Session = Depends(getdb),
 ):
     """
-    Returns last 7 days (today + previous 6 days)
-    weighted standard deviation of raw sensor readings,
-    computed using hourly buckets from sensor_stddev_1hr.
+    Returns last 7 days (today + previous 6 days, IST)
+    standard deviation of raw sensor readings per day.
     """
 
     enforce_site_access(user, site_id)
     try:
-        # ---------- SQL Query Using sensor_stddev_1hr ----------
-        query = text("""
-            SELECT
-                si.id AS site_id,
-                si.site_name,
-                st.id AS station_id,
-                st.name AS station_name,
-                sp.id AS station_param_id,
-                p.name AS parameter_name,
-                sp.para_unit AS unit,
-
-                DATE(sdv.bucket_ist) AS reading_date,
+        topo, params, m, from_date, to_date = _stddev_window(db, site_id, days=7, station_param_id=station_param_id)
+        p = params[0] if params and params[0].station_id == station_id else None
+        data = _stddev_by_day(m, station_param_id, from_date, to_date, include_today=False) if p else []
 
-                SUM(sdv.n) AS total_n,
-                SUM(sdv.sum_x) AS total_sum_x,
-                SUM(sdv.sum_x2) AS total_sum_x2
-
-            FROM sensor_stddev_1hr sdv
-            JOIN station_parameters sp ON sp.id = sdv.station_param_id
-            JOIN stations st ON st.id = sp.station_id
-            JOIN site si ON si.id = st.site_id
-            JOIN analyser_parameter ap ON sp.analyser_param_id = ap.id
-            JOIN parameters p ON ap.parameter_id = p.id
-
-            WHERE si.id = :site_id
-              AND st.id = :station_id
-              AND sp.id = :station_param_id
-              AND DATE(sdv.bucket_ist) >= CURRENT_DATE - INTERVAL '6 days'
-              AND DATE(sdv.bucket_ist) <= CURRENT_DATE
-
-            GROUP BY
-                si.id, si.site_name, st.id, st.name,
-                sp.id, p.name, sp.para_unit,
-                DATE(sdv.bucket_ist)
-
-            ORDER BY reading_date;
-        """)
-
-        rows = db.execute(
-            query,
-            {
-                "site_id": site_id,
-                "station_id": station_id,
-                "station_param_id": station_param_id,
-            }
-        ).fetchall()
-
-        if not rows:
+        if not data:
             return {
                 "site_id": site_id,
                 "station_id": station_id,
@@ -656,34 +646,14 @@ async def get_site_station_parameter_stddev(
                 "data": []
             }
 
-        # ---------- Compute Weighted Stddev per Day ----------
-        data = []
-
-        for r in rows:
-            N = float(r.total_n or 0)
-            sum_x = float(r.total_sum_x or 0)
-            sum_x2 = float(r.total_sum_x2 or 0)
-
-            if N > 0:
-                mean = sum_x / N
-                variance = (sum_x2 / N) - (mean * mean)
-                stddev = math.sqrt(variance) if variance > 0 else 0
-            else:
-                stddev = 0
-
-            data.append({
-                "date": r.reading_date.strftime("%Y-%m-%d"),
-                "stddev_value": round(stddev, 3)    # FE expects this name
-            })
-
         return {
-            "site_id": rows[0].site_id,
-            "site_name": rows[0].site_name,
-            "station_id": rows[0].station_id,
-            "station_name": rows[0].station_name,
-            "station_param_id": rows[0].station_param_id,
-            "parameter_name": rows[0].parameter_name,
-            "unit": rows[0].unit,
+            "site_id": site_id,
+            "site_name": topo.site.site_name,
+            "station_id": station_id,
+            "station_name": topo.station_by_id[station_id].name,
+            "station_param_id": station_param_id,
+            "parameter_name": p.parameter_name,
+            "unit": p.unit,
             "records_found": len(data),
             "data": data
         }
@@ -707,143 +677,19 @@ async def get_site_station_parameter_stddev_today_v2(
     db: Session = Depends(getdb),
 ):
     """
-    EXACT v1 STDDEV match:
-      • Use CAGG buckets only for fully completed UTC hours today
-      • Use raw sensor_data for the last incomplete UTC hour
-      • Combine using weighted stddev formula
+    Same window and values as /site-station-parameter-stddev-today
+    (aggregated buckets + raw tail up to now), without the site name.
     """
 
     enforce_site_access(user, site_id)
     try:
-        ist = pytz.timezone("Asia/Kolkata")
-        utc = pytz.utc
-
-        now_utc = datetime.utcnow().replace(tzinfo=utc)
-        now_ist = now_utc.astimezone(ist)
-
-        # Today's start in IST → convert to UTC for querying sensor_data
-        day_start_ist = now_ist.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_start_utc = day_start_ist.astimezone(utc)
-
-        # CAGG hourly bucket boundaries are UTC-aligned
-        last_full_hour_utc = now_utc.replace(minute=0, second=0, microsecond=0)
-
-        # --------------------------------------------------------
-        # A) FULL UTC HOURS TODAY FROM CAGG
-        # --------------------------------------------------------
-        query_hours = text("""
-            SELECT
-                st.id AS station_id,
-                st.name AS station_name,
-                sp.id AS station_param_id,
-                p.name AS parameter_name,
-                sp.para_unit AS unit,
-                p.monitoring_type_id,
-                mt.monitoring_type,
-
-                SUM(sdv.n) AS n_hours,
-                SUM(sdv.sum_x) AS sum_x_hours,
-                SUM(sdv.sum_x2) AS sum_x2_hours
-
-            FROM sensor_stddev_1hr sdv
-            JOIN station_parameters sp ON sp.id = sdv.station_param_id
-            JOIN stations st ON st.id = sp.station_id
-            JOIN site si ON si.id = st.site_id
-            JOIN analyser_parameter ap ON sp.analyser_param_id = ap.id
-            JOIN parameters p ON ap.parameter_id = p.id
-            JOIN monitoring_types mt ON p.monitoring_type_id = mt.id
-
-            WHERE si.id = :site_id
-              AND sdv.bucket_utc >= :day_start_utc
-              AND sdv.bucket_utc < :last_full_hour_utc
-
-            GROUP BY st.id, st.name, sp.id, p.name, sp.para_unit,
-                     p.monitoring_type_id, mt.monitoring_type;
-        """)
-
-        rows_hours = db.execute(
-            query_hours,
-            {
-                "site_id": site_id,
-                "day_start_utc": day_start_utc,
-                "last_full_hour_utc": last_full_hour_utc
-            }
-        ).fetchall()
-
-        # --------------------------------------------------------
-        # B) LAST INCOMPLETE UTC HOUR FROM sensor_data
-        # --------------------------------------------------------
-        query_partial = text("""
-            SELECT
-                station_param_id,
-                COUNT(*) AS n_raw,
-                SUM(value) AS sum_x_raw,
-                SUM(value * value) AS sum_x2_raw
-            FROM sensor_data
-            WHERE time >= :last_full_hour_utc
-              AND time < :now_utc
-              AND station_param_id IN (
-                    SELECT sp.id
-                    FROM station_parameters sp
-                    JOIN stations st ON st.id = sp.station_id
-                    WHERE st.site_id = :site_id
-              )
-            GROUP BY station_param_id;
-        """)
-
-        rows_partial = db.execute(
-            query_partial,
-            {
-                "site_id": site_id,
-                "last_full_hour_utc": last_full_hour_utc,
-                "now_utc": now_utc
-            }
-        ).fetchall()
-
-        partial_map = {r.station_param_id: r for r in rows_partial}
-
-        # --------------------------------------------------------
-        # C) COMBINE EXACTLY LIKE RAW v1 (weighted stddev)
-        # --------------------------------------------------------
-        final_data = []
-
-        for h in rows_hours:
-            n_hours = float(h.n_hours or 0)
-            sum_x_hours = float(h.sum_x_hours or 0)
-            sum_x2_hours = float(h.sum_x2_hours or 0)
-
-            p = partial_map.get(h.station_param_id)
-            n_raw = float(p.n_raw or 0) if p else 0
-            sum_x_raw = float(p.sum_x_raw or 0) if p else 0
-            sum_x2_raw = float(p.sum_x2_raw or 0) if p else 0
-
-            N = n_hours + n_raw
-            sum_x = sum_x_hours + sum_x_raw
-            sum_x2 = sum_x2_hours + sum_x2_raw
-
-            if N > 0:
-                mean = sum_x / N
-                variance = max((sum_x2 / N) - (mean * mean), 0)
-                stddev = math.sqrt(variance)
-            else:
-                stddev = 0
-
-            final_data.append({
-                "station_id": h.station_id,
-                "station_name": h.station_name,
-                "station_param_id": h.station_param_id,
-                "parameter_name": h.parameter_name,
-                "unit": h.unit,
-                "monitoring_type_id": h.monitoring_type_id,
-                "monitoring_type_name": h.monitoring_type,
-                "stddev_value": round(stddev, 3),
-                "total_samples": int(N)
-            })
+        topo, params, m, from_date, to_date = _stddev_window(db, site_id, days=1)
+        final_data = _stddev_by_param(topo, params, m)
 
         return {
             "site_id": site_id,
-            "from_date": day_start_ist.isoformat(),
-            "to_date": now_ist.isoformat(),
+            "from_date": from_date.isoformat(),
+            "to_date": to_date.isoformat(),
             "records_found": len(final_data),
             "data": final_data
         }
@@ -866,120 +712,15 @@ async def get_site_station_parameter_stddev(
     db: Session = Depends(getdb),
 ):
     """
-    FINAL VERSION:
-    ✔ Last 7 days stddev (today + prev 6)
-    ✔ TODAY = CAGG full-hours + RAW for incomplete hour
-    ✔ EXACT match to stddev_today realtime API
+    Last 7 days stddev (today + prev 6, IST), today always included and
+    computed up to now like the stddev-today endpoints.
     """
 
     enforce_site_access(user, site_id)
     try:
-        ist = pytz.timezone("Asia/Kolkata")
-        utc = pytz.utc
-
-        now_utc = datetime.utcnow().replace(tzinfo=utc)
-        now_ist = now_utc.astimezone(ist)
-
-        today_ist = now_ist.date()
-        last_full_hour_utc = now_utc.replace(minute=0, second=0, microsecond=0)
-
-        # --------------------------------------------------------
-        # 1) CAGG FULL HOURS ONLY (EXCLUDING CURRENT INCOMPLETE HOUR)
-        # --------------------------------------------------------
-        query_cagg = text("""
-            SELECT
-                DATE(sdv.bucket_ist) AS reading_date,
-                SUM(sdv.n) AS total_n,
-                SUM(sdv.sum_x) AS total_sum_x,
-                SUM(sdv.sum_x2) AS total_sum_x2
-            FROM sensor_stddev_1hr sdv
-            JOIN station_parameters sp ON sp.id = sdv.station_param_id
-            JOIN stations st ON st.id = sp.station_id
-            JOIN site si ON si.id = st.site_id
-            WHERE si.id = :site_id
-              AND st.id = :station_id
-              AND sp.id = :station_param_id
-              AND sdv.bucket_utc < :last_full_hour_utc   -- ⬅️ KEY FIX
-              AND DATE(sdv.bucket_ist) >= CURRENT_DATE - INTERVAL '6 days'
-              AND DATE(sdv.bucket_ist) <= CURRENT_DATE
-            GROUP BY DATE(sdv.bucket_ist)
-            ORDER BY DATE(sdv.bucket_ist);
-        """)
-
-        cagg_rows = db.execute(
-            query_cagg,
-            {
-                "site_id": site_id,
-                "station_id": station_id,
-                "station_param_id": station_param_id,
-                "last_full_hour_utc": last_full_hour_utc
-            }
-        ).fetchall()
-
-        day_map = {}
-        for r in cagg_rows:
-            day_map[r.reading_date] = {
-                "n": float(r.total_n or 0),
-                "sum_x": float(r.total_sum_x or 0),
-                "sum_x2": float(r.total_sum_x2 or 0)
-            }
-
-        # Ensure today exists
-        if today_ist not in day_map:
-            day_map[today_ist] = {"n": 0, "sum_x": 0, "sum_x2": 0}
-
-        # --------------------------------------------------------
-        # 2) RAW DATA FOR TODAY’S INCOMPLETE HOUR (MATCH REALTIME)
-        # --------------------------------------------------------
-        query_raw = text("""
-            SELECT
-                COUNT(*) AS n_raw,
-                SUM(value) AS sum_x_raw,
-                SUM(value * value) AS sum_x2_raw
-            FROM sensor_data
-            WHERE station_param_id = :station_param_id
-              AND time >= :last_full_hour_utc
-              AND time < :now_utc
-        """)
-
-        raw = db.execute(
-            query_raw,
-            {
-                "station_param_id": station_param_id,
-                "last_full_hour_utc": last_full_hour_utc,
-                "now_utc": now_utc
-            }
-        ).fetchone()
-
-        raw_n = float(raw.n_raw or 0)
-        raw_sum_x = float(raw.sum_x_raw or 0)
-        raw_sum_x2 = float(raw.sum_x2_raw or 0)
-
-        # Add partial-hour RAW to TODAY
-        day_map[today_ist]["n"] += raw_n
-        day_map[today_ist]["sum_x"] += raw_sum_x
-        day_map[today_ist]["sum_x2"] += raw_sum_x2
-
-        # --------------------------------------------------------
-        # 3) FINAL STDDEV CALCULATION
-        # --------------------------------------------------------
-        data = []
-        for d in sorted(day_map.keys()):
-            N = day_map[d]["n"]
-            sx = day_map[d]["sum_x"]
-            sx2 = day_map[d]["sum_x2"]
-
-            if N > 0:
-                mean = sx / N
-                variance = (sx2 / N) - (mean * mean)
-                stddev = math.sqrt(variance) if variance > 0 else 0
-            else:
-                stddev = 0
-
-            data.append({
-                "date": d.strftime("%Y-%m-%d"),
-                "stddev_value": round(stddev, 3)
-            })
+        topo, params, m, from_date, to_date = _stddev_window(db, site_id, days=7, station_param_id=station_param_id)
+        valid = bool(params) and params[0].station_id == station_id
+        data = _stddev_by_day(m, station_param_id, from_date, to_date, include_today=True) if valid else []
 
         return {
             "site_id": site_id,
@@ -994,4 +735,3 @@ async def get_site_station_parameter_stddev(
     except Exception as e:
         print("❌ Error in stddev 7-day API:", e)
         raise HTTPException(status_code=500, detail='Internal server error')
-
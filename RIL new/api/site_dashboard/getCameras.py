@@ -3,10 +3,11 @@ from sqlalchemy.orm import Session
 from sqlalchemy.sql import func
 from ...database.session import getdb
 from ...modals.masters import *
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from ...utils.utils import response_strct
 from collections import defaultdict
 from ..auth.authentication import user_dependency
+from ...utils.series import fetch_series
 
 router = APIRouter()
 
@@ -95,10 +96,10 @@ async def get_cameras_by_site_id(
     if site and site.group_id:
         group = db.query(Group).filter(Group.id == site.group_id).first()
 
-    now = datetime.utcnow()
+    now = datetime.now(timezone.utc)
     start_time = now - timedelta(hours=24)
 
-    # Fetch all parameter IDs for the camera
+    # Fetch all station parameter IDs for the camera
     param_ids = db.query(CameraParameter.station_parameter_id).filter(CameraParameter.camera_id == camera.id).all()
     param_ids = [p[0] for p in param_ids if p[0] is not None]
 
@@ -106,24 +107,15 @@ async def get_cameras_by_site_id(
         spark_list = []
         spark_list_time = []
     else:
-        sensor_data = (
-            db.query(
-                func.date_trunc('hour', SensorData.time).label("hour_time"),
-                func.avg(SensorData.value).label("avg_value")
-            )
-            .filter(
-                SensorData.station_id == camera.station_id,
-                SensorData.parameter_id.in_(param_ids),
-                SensorData.time >= start_time,
-                SensorData.time <= now
-            )
-            .group_by(func.date_trunc('hour', SensorData.time))
-            .order_by(func.date_trunc('hour', SensorData.time))
-            .all()
-        )
-
-        spark_list = [str(row.avg_value) if row.avg_value is not None else "0" for row in sensor_data]
-        spark_list_time = [row.hour_time.strftime("%Y-%m-%d %H:%M:%S") for row in sensor_data]
+        # hourly means of each station parameter, averaged over the camera's parameters
+        hours = defaultdict(list)
+        for ts, _, value in fetch_series(db, param_ids, start_time, now, "1 hour"):
+            values = hours[ts]
+            if value is not None:
+                values.append(value)
+
+        spark_list = [str(sum(v) / len(v)) if v else "0" for v in hours.values()]
+        spark_list_time = [ts.strftime("%Y-%m-%d %H:%M:%S") for ts in hours]
 
     return {
         "camersDetails": {
@@ -13,6 +13,10 @@ from zoneinfo import ZoneInfo
 import datetime as dt
 from dateutil import parser
 from ...utils.permissions import enforce_site_access
+from ...utils.arrow_export import arrow_stream, check_format, extension, media_type
+from ...utils.result_cache import result_cache
+from fastapi.responses import Response, StreamingResponse
+import orjson
 
 router = APIRouter()
 
@@ -36,9 +40,12 @@ async def get_sensor_data_report(
     station_param_id: Union[int, str]  = Form("all"),
     monitoring_type_id: Union[int, str]= Form("all"),
     time_interval: str                 = Form("1hr"),
+    output_format: str                 = Form("json"),
     db: Session                        = Depends(getdb),
 ):
     enforce_site_access(user, site_id)
+    if output_format != "json":
+        check_format(output_format)
     # Parse timezone-aware datetime inputs
     start_date = parser.isoparse(from_date)
     end_date   = parser.isoparse(to_date)
@@ -92,6 +99,22 @@ async def get_sensor_data_report(
 
     where_clause = " AND ".join(filters)
 
+    # Closed windows (CAGG materialized, outside its refresh window) are served from the result cache
+    cache_key = result_cache.key(
+        db, "sensor_data_report",
+        {**params, "time_interval": time_interval, "output_format": output_format},
+        table_name, ist_end, site_id,
+    )
+    if cache_key is not None:
+        if output_format == "json":
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                return Response(cached, media_type="application/json")
+        else:
+            chunks = result_cache.stream(cache_key)
+            if chunks is not None:
+                return _columnar_response(chunks, output_format, site_id)
+
     # Adjust bucket expression for 1day grouping
     if time_interval == "1day":
         bucket_expr = f"date_trunc('day', agg.{bucket_col})"
@@ -123,16 +146,19 @@ async def get_sensor_data_report(
         ORDER BY mt.monitoring_type, {bucket_expr};
     """
 
-    rows = db.execute(text(sql), params).fetchall()
-    if not rows:
-        raise HTTPException(status_code=404, detail="No data found")
-
     group_name = db.execute(
         select(Group.group_name)
         .join(Site, Site.group_id == Group.id)
         .where(Site.id == site_id)
     ).scalar() or "No group"
 
+    if output_format != "json":
+        return _columnar_report(db, text(sql), params, group_name, output_format, site_id, cache_key)
+
+    rows = db.execute(text(sql), params).fetchall()
+    if not rows:
+        raise HTTPException(status_code=404, detail="No data found")
+
     response = {}
     for ti, avg, site_nm, param_nm, analyser_nm, station_nm, mon_type, site_addr in rows:
         bucket = response.setdefault(mon_type, {
@@ -150,7 +176,70 @@ async def get_sensor_data_report(
             "station_name": station_nm
         })
 
-    return {"sensor_data": list(response.values())}
+    result = {"sensor_data": list(response.values())}
+    if cache_key is None:
+        return result
+    body = orjson.dumps(result)
+    result_cache.put(cache_key, body)
+    return Response(body, media_type="application/json")
+
+
+REPORT_COLUMNS = [
+    ("time_interval", "timestamp"),
+    ("avg_value", "float64"),
+    ("site_name", "dictionary"),
+    ("parameter_name", "dictionary"),
+    ("analyser_name", "dictionary"),
+    ("station_name", "dictionary"),
+    ("monitoring_type_name", "dictionary"),
+    ("site_address", "dictionary"),
+    ("group_name", "dictionary"),
+]
+
+
+def _columnar_report(db, sql, params, group_name, output_format, site_id, cache_key=None):
+    """
+    The report rows as an Arrow IPC stream / Parquet file, read from a
+    server-side cursor (and kept in the result cache under `cache_key`).
+    """
+    conn = db.get_bind().connect().execution_options(stream_results=True)
+    try:
+        result = conn.execute(sql, params)
+        first = result.fetchone()
+    except Exception:
+        conn.close()
+        raise
+    if first is None:
+        conn.close()
+        raise HTTPException(status_code=404, detail="No data found")
+
+    def rows():
+        yield (*first, group_name)
+        for r in result:
+            yield (*r, group_name)
+
+    body = arrow_stream(rows(), REPORT_COLUMNS, output_format)
+
+    def body_iter():
+        try:
+            yield from body
+        finally:
+            conn.close()
+
+    body_out = body_iter() if cache_key is None else result_cache.tee(cache_key, body_iter())
+    return _columnar_response(body_out, output_format, site_id)
+
+
+def _columnar_response(body, output_format, site_id):
+    filename = f"sensor_report_site_{site_id}.{extension(output_format)}"
+    return StreamingResponse(
+        body,
+        media_type=media_type(output_format),
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
 
 
 
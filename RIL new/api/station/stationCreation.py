@@ -13,6 +13,8 @@ from ...database.session import getdb
 from ...utils.utils import response_strct
 
 from ..auth.authentication import user_dependency
+from ...utils.topology import bump
+from ...ingestion.resolution_index import invalidate
 
 router = APIRouter()
 
@@ -55,6 +57,7 @@ def create_station(
         updated_by=1,
     )
     db.add(station)
+    bump(db, site_ids=[site_id])
     db.commit()
     db.refresh(station)
 
@@ -171,6 +174,8 @@ def update_station(
                 status_code=400, detail="A station with the same name already exists for this site"
             )
 
+    old_site_id = station.site_id
+
     # Update fields if provided
     if name is not None:
         station.name = name
@@ -186,6 +191,10 @@ def update_station(
     station.updated_by = 1  # Hardcoded for now
     station.updated_at = datetime.datetime.utcnow()
 
+    # ingest resolves the station's devices to its site (and site authkey)
+    invalidate(db, station_ids=[station_id])
+    # old site (held the station) and new site
+    bump(db, station_ids=[station_id], site_ids={old_site_id, station.site_id})
     db.commit()
     db.refresh(station)
 
@@ -209,6 +218,8 @@ def delete_station(user : user_dependency , station_id: int, db: Session = Depen
         raise HTTPException(status_code=404, detail="Station not found")
 
     db.delete(station)
+    invalidate(db, station_ids=[station_id])
+    bump(db, station_ids=[station_id])
     db.commit()
 
     return response_strct(
@@ -6,6 +6,8 @@ from starlette import status
 from ...utils.utils import *
 from ...schemas.masterSchema import StationParameterUpdateRequest
 from ..auth.authentication import user_dependency
+from ...ingestion.resolution_index import invalidate
+from ...utils.topology import bump
 
 router = APIRouter()
 
@@ -99,6 +101,9 @@ def create_station_parameters(
             "param_interval": param_interval,  # ✅ NEW FIELD
         })
 
+    if inserted_count:
+        invalidate(db, station_ids=[station_id])
+        bump(db, station_ids=[station_id])
     db.commit()
 
     return response_strct(
@@ -233,6 +238,7 @@ def update_station_parameter(
 
     station_param.updated_by = user["id"] if user and "id" in user else 1
 
+    bump(db, station_ids=[station_id])
     db.commit()
     db.refresh(station_param)
 
@@ -284,6 +290,8 @@ def delete_station_parameter(
         raise HTTPException(status_code=404, detail="Station Parameter not found")
 
     db.delete(station_param)
+    invalidate(db, station_ids=[station_id])
+    bump(db, station_ids=[station_id])
     db.commit()
 
     return response_strct(
@@ -345,6 +353,7 @@ def update_station_param_threshold(
 
     sp.para_threshold = para_threshold
     sp.updated_by = None
+    bump(db, station_ids=[sp.station_id])
     db.commit()
     db.refresh(sp)
 
@@ -1,13 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Query,Body
-from sqlalchemy.orm import Session, aliased
-from sqlalchemy import func, and_
-from ...modals.masters import DashboardPageFormulas, SensorData, TotaliserData,Station,stationParameter
+from sqlalchemy.orm import Session
+from ...modals.masters import DashboardPageFormulas, TotaliserData,Station,stationParameter,LatestSensorData
 from ...database.session import getdb
 import re
 import json
 from typing import Dict, List, Literal,Any,Optional
-from collections import defaultdict
 from ...schemas.masterSchema import *
+from ...utils.formula_engine import compile_formula, compile_table
 from ..auth.authentication import user_dependency
 import pytz
 router = APIRouter(
@@ -18,32 +17,24 @@ router = APIRouter(
 
 def evaluate_formula(expression: str, param_map: Dict[str, float]) -> float:
     try:
-        for param, value in param_map.items():
-            expression = re.sub(rf"\b{re.escape(param)}\b", str(value), expression)
-        return round(eval(expression), 2)
+        return round(compile_formula(expression).evaluate(param_map), 2)
     except Exception:
         return None
 
 
 def get_latest_sensor_values(db: Session, site_id: int, param_labels: List[str]) -> Dict[str, float]:
-    subquery = (
-        db.query(
-            SensorData.param_label,
-            func.max(SensorData.time).label("max_time")
-        )
-        .filter(SensorData.site_id == site_id, SensorData.param_label.in_(param_labels))
-        .group_by(SensorData.param_label)
-        .subquery()
-    )
-    s1 = aliased(SensorData)
-    s2 = aliased(subquery)
-
     rows = (
-        db.query(s1.param_label, s1.value)
-        .join(s2, and_(s1.param_label == s2.c.param_label, s1.time == s2.c.max_time))
+        db.query(stationParameter.pram_lable, LatestSensorData.value)
+        .join(stationParameter, stationParameter.id == LatestSensorData.station_param_id)
+        .filter(
+            LatestSensorData.site_id == site_id,
+            stationParameter.pram_lable.in_(param_labels),
+            LatestSensorData.value.isnot(None),
+        )
+        .order_by(LatestSensorData.time)   # newest wins if a label repeats
         .all()
     )
-    return {row.param_label: float(row.value) for row in rows}
+    return {row.pram_lable: float(row.value) for row in rows}
 
 
 def compute_totalizer_deltas(
@@ -69,39 +60,8 @@ def compute_totalizer_deltas(
 
 
 def evaluate_table_formula(table_formula: dict, param_map: dict) -> dict:
-    from collections import defaultdict
-
-    result = defaultdict(dict)
-
-    def resolve(expr: str, current_section: str) -> float:
-        if not expr or not isinstance(expr, str):
-            return 0.0  # default if expression is missing
-
-        # Replace sensor param values like F84, F6, etc.
-        for k, v in param_map.items():
-            expr = re.sub(rf"\b{re.escape(k)}\b", str(v if v is not None else 0), expr)
-
-        # Replace section-scoped values (e.g. Domestic.Fresh Water)
-        for sec, cols in result.items():
-            for label, val in cols.items():
-                scoped = f"{sec}.{label}"
-                expr = expr.replace(scoped, str(val if val is not None else 0))
-
-        # Replace same-section unscoped labels (e.g. Fresh Water)
-        for label, val in result[current_section].items():
-            expr = re.sub(rf"\b{re.escape(label)}\b", str(val if val is not None else 0), expr)
-
-        try:
-            return round(eval(expr), 2)
-        except:
-            return 0.0  # fallback to 0 if evaluation fails
-
-    for section, columns in table_formula.items():
-        for label, expr in columns.items():
-            value = resolve(expr, section)
-            result[section][label] = value
-
-    return result
+    # cells referencing a missing parameter or failing to evaluate fall back to 0
+    return compile_table(table_formula).evaluate(param_map, ndigits=2, on_error=0.0)
 
 
 @router.get("/dashboard/formulas/evaluate")
@@ -216,24 +176,18 @@ def list_dashboard_pages(
     return {"pages": pages}
 
 def get_latest_sensor_values(db: Session, site_id: int, param_labels: List[str]) -> Dict[str, float]:
-    subquery = (
-        db.query(
-            SensorData.param_label,
-            func.max(SensorData.time).label("max_time")
-        )
-        .filter(SensorData.site_id == site_id, SensorData.param_label.in_(param_labels))
-        .group_by(SensorData.param_label)
-        .subquery()
-    )
-    s1 = aliased(SensorData)
-    s2 = aliased(subquery)
-
     rows = (
-        db.query(s1.param_label, s1.value)
-        .join(s2, and_(s1.param_label == s2.c.param_label, s1.time == s2.c.max_time))
+        db.query(stationParameter.pram_lable, LatestSensorData.value)
+        .join(stationParameter, stationParameter.id == LatestSensorData.station_param_id)
+        .filter(
+            LatestSensorData.site_id == site_id,
+            stationParameter.pram_lable.in_(param_labels),
+            LatestSensorData.value.isnot(None),
+        )
+        .order_by(LatestSensorData.time)   # newest wins if a label repeats
         .all()
     )
-    return {row.param_label: float(row.value) for row in rows}
+    return {row.pram_lable: float(row.value) for row in rows}
 
 def get_totalizer_deltas(
     db: Session, 
@@ -261,36 +215,8 @@ def get_totalizer_deltas(
 
 
 def evaluate_table_formula(table_formula: dict, param_map: dict) -> dict:
-    result = defaultdict(dict)
-
-    def resolve(expr: str, current_section: str) -> float:
-        if not expr or not isinstance(expr, str):
-            return 0.0
-
-        # Replace sensor param values
-        for k, v in param_map.items():
-            expr = re.sub(rf"\b{re.escape(k)}\b", str(v if v is not None else 0), expr)
-
-        # Replace section-scoped references
-        for sec, cols in result.items():
-            for label, val in cols.items():
-                expr = expr.replace(f"{sec}.{label}", str(val if val is not None else 0))
-
-        # Replace same-section labels
-        for label, val in result[current_section].items():
-            expr = re.sub(rf"\b{re.escape(label)}\b", str(val if val is not None else 0), expr)
-
-        try:
-            return round(eval(expr), 2)
-        except:
-            return 0.0
-
-    for section, columns in table_formula.items():
-        for label, expr in columns.items():
-            value = resolve(expr, section)
-            result[section][label] = value
-
-    return result
+    # cells referencing a missing parameter or failing to evaluate fall back to 0
+    return compile_table(table_formula).evaluate(param_map, ndigits=2, on_error=0.0)
 
 @router.get(
     "/dashboard/formulas/deltas/manual",
@@ -418,12 +344,8 @@ def evaluate_dashboard_blocks_manual(
     for blk in blocks:
         tc = blk.get("totalizerCalculation") or ""
         if tc:
-            expr = tc
-            # substitute every Txx in the formula with its delta
-            for t_label, dval in deltas.items():
-                expr = re.sub(rf"\b{re.escape(t_label)}\b", str(dval), expr)
             try:
-                raw = eval(expr)
+                raw = compile_formula(tc).evaluate(deltas)
                 blk["totalizerValue"] = round(abs(raw), 2)
             except Exception:
                 blk["totalizerValue"] = None
@@ -527,33 +449,38 @@ def get_latest_sensors_values(
     tags: List[str],
 ) -> Dict[str, Dict[str, Optional[str]]]:
     """
-    For each tag T1…T90, return the most recent reading,
-    the exact India‑time `time` column value, and the
-    station name (via SensorData.station_id → Station.name).
+    For each tag T1…T90, return the most recent reading
+    (latest_sensor_data, one query for all tags), the
+    India‑time `time` value, and the station name.
     """
-    out: Dict[str, Dict[str, Optional[str]]] = {}
-    for tag in tags:
-        # join SensorData → Station to fetch station.name
-        row = (
-            db.query(SensorData, Station.name.label("station_name"))
-              .join(Station, SensorData.station_id == Station.id)
-              .filter(
-                  SensorData.site_id == site_id,
-                  SensorData.param_label == tag,
-              )
-              .order_by(SensorData.time.desc())
-              .limit(1)
-              .first()
+    rows = (
+        db.query(
+            stationParameter.pram_lable,
+            LatestSensorData.value,
+            LatestSensorData.time,
+            Station.name.label("station_name"),
+        )
+        .join(stationParameter, stationParameter.id == LatestSensorData.station_param_id)
+        .join(Station, stationParameter.station_id == Station.id)
+        .filter(
+            LatestSensorData.site_id == site_id,
+            stationParameter.pram_lable.in_(tags),
         )
+        .order_by(LatestSensorData.time)   # newest wins if a label repeats
+        .all()
+    )
+    latest = {r.pram_lable: r for r in rows}
 
-        if row:
-            sensor, station_name = row
+    out: Dict[str, Dict[str, Optional[str]]] = {}
+    for tag in tags:
+        row = latest.get(tag)
+        if row and row.value is not None:
             # preserve IST from the original timezone:
-            local_dt = sensor.time.astimezone(IST)
+            local_dt = row.time.astimezone(IST)
             out[tag] = {
-                "value":       float(sensor.value),
+                "value":       float(row.value),
                 "time":        local_dt.isoformat(),         # e.g. "2025-07-28T10:27:54+05:30"
-                "stationName": station_name,
+                "stationName": row.station_name,
             }
         else:
             out[tag] = {"value": None, "time": None, "stationName": None}
@@ -797,28 +724,4 @@ def evaluate_dashboard_table_manual(
 
 
 def evaluate_table_formulassss(table_formula: dict, param_map: dict) -> dict:
-    from collections import defaultdict
-    result = defaultdict(dict)
-
-    def resolve(expr: str, section: str) -> float:
-        if not expr or not isinstance(expr, str):
-            return 0.0
-        # substitute every Txx in the expression
-        for k, v in param_map.items():
-            expr = re.sub(rf"\b{re.escape(k)}\b", str(v), expr)
-        # substitute any section‑scoped or same‑section references...
-        for sec, cols in result.items():
-            for label, val in cols.items():
-                expr = expr.replace(f"{sec}.{label}", str(val))
-        for label, val in result[section].items():
-            expr = re.sub(rf"\b{re.escape(label)}\b", str(val), expr)
-        try:
-            return float(eval(expr))
-        except:
-            return 0.0
-
-    for section, cols in table_formula.items():
-        for label, formula in cols.items():
-            result[section][label] = resolve(formula, section)
-
-    return result
\ No newline at end of file
+    return compile_table(table_formula).evaluate(param_map, ndigits=None, on_error=0.0)
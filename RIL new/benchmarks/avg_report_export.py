@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Peak RSS and time-to-first-byte of the averaged sensor report export
+(`/api/sensor-data-report/export-csv-gz`), buffered vs streaming.
+
+    python -m app.benchmarks.avg_report_export --rows 2000000
+
+Rows are synthesised in the shape the report query returns (a year of
+15-minute data for ~60 parameters is ~2.1M rows), so no database is needed:
+
+    buffered   fetchall() -> list of dicts -> whole gzip in one BytesIO
+    streaming  cursor rows -> csv_chunks -> gzip_stream (64 KB chunks)
+
+Each mode runs in its own process so peak RSS is not shared.
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import multiprocessing
+import resource
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from ..utils.streaming import csv_chunks, gzip_stream
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+Row = namedtuple("Row", [
+    "time_interval", "avg_value", "stddev_value", "site_name", "parameter_name",
+    "analyser_name", "station_name", "monitoring_type_name", "site_address",
+])
+
+HEADERS = [
+    "time_interval", "avg_value", "stddev_value", "site_name", "site_address", "group_name",
+    "parameter_name", "analyser_name", "station_name", "monitoring_type_name",
+]
+
+
+def fake_cursor(n: int, params: int = 60):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(n):
+        yield Row(
+            start + timedelta(minutes=15 * (i // params)),
+            20.0 + (i % 97) * 0.37,
+            1.0 + (i % 13) * 0.11,
+            "Benchmark Site",
+            f"Parameter {i % params}",
+            f"Analyser {i % 7}",
+            f"Station {i % 5}",
+            "Effluent",
+            "Plot 1, MIDC, Mumbai, Maharashtra",
+        )
+
+
+def _csv_row(r):
+    return [
+        r.time_interval.astimezone(IST).strftime("%Y-%m-%d %H:%M:%S"),
+        round(float(r.avg_value or 0), 2),
+        round(float(r.stddev_value or 0), 2),
+        r.site_name, r.site_address, "Benchmark Group",
+        r.parameter_name, r.analyser_name, r.station_name, r.monitoring_type_name,
+    ]
+
+
+def buffered(n: int):
+    rows = list(fake_cursor(n))                      # fetchall()
+    data_rows = [r._asdict() for r in rows]          # list of dicts
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
+        text_wrapper = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        writer = csv.writer(text_wrapper)
+        writer.writerow(HEADERS)
+        for d in data_rows:
+            writer.writerow(_csv_row(Row(**d)))
+        text_wrapper.flush()
+    buffer.seek(0)
+    yield buffer.read()
+
+
+def streaming(n: int):
+    yield from gzip_stream(csv_chunks(HEADERS, (_csv_row(r) for r in fake_cursor(n))))
+
+
+def _run(mode: str, n: int, out):
+    body = {"buffered": buffered, "streaming": streaming}[mode](n)
+    t0 = time.perf_counter()
+    ttfb = None
+    size = chunks = 0
+    for chunk in body:
+        if ttfb is None:
+            ttfb = time.perf_counter() - t0
+        size += len(chunk)
+        chunks += 1
+    total = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    out.send((ttfb, total, size, chunks, rss / 1024))
+
+
+def measure(mode: str, n: int):
+    recv, send = multiprocessing.Pipe(duplex=False)
+    p = multiprocessing.Process(target=_run, args=(mode, n, send))
+    p.start()
+    result = recv.recv()
+    p.join()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = ap.parse_args()
+
+    print(f"{'rows':>10} {'mode':>10} {'ttfb ms':>10} {'total s':>9} {'gz MB':>8} {'chunks':>7} {'peak RSS MB':>12}")
+    for n in args.rows:
+        for mode in ("buffered", "streaming"):
+            ttfb, total, size, chunks, rss = measure(mode, n)
+            print(f"{n:>10} {mode:>10} {ttfb * 1000:>10.1f} {total:>9.2f} {size / 1e6:>8.2f} {chunks:>7} {rss:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
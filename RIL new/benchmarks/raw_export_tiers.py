@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Month-range raw-data export queries (`/api/raw-data/export-gz…`), read from
+sensor_data only ("before") vs the CAGG tiers picked by utils/series.py
+("after"), against a real database:
+
+    python -m app.benchmarks.raw_export_tiers --station-param-id 42 --days 30
+
+For each bucket both plans run REPEAT times (the best run is reported) and
+once under EXPLAIN (ANALYZE, BUFFERS) for the pages touched; the results
+are compared, so a tier that is not an exact re-aggregation shows up as a
+non-zero max difference (sensor_agg_15min is a mean of 15-minute means).
+"""
+
+import argparse
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from ..utils.db import db_session
+from ..utils.series import plan_series
+
+BUCKETS = ["1 minute", "5 minutes", "15 minutes", "60 minutes", "1440 minutes"]
+BUFFERS_RE = re.compile(r"Buffers: shared(?: hit=(\d+))?(?: read=(\d+))?")
+
+
+def _fetch(db, plan):
+    t0 = time.perf_counter()
+    rows = plan.execute(db).fetchall()
+    return time.perf_counter() - t0, rows
+
+
+def _buffers(db, plan) -> int:
+    lines = [r[0] for r in db.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + plan.sql), plan.params)]
+    for line in lines:
+        match = BUFFERS_RE.search(line)
+        if match:
+            return sum(int(g or 0) for g in match.groups())     # top node: the whole query
+    return 0
+
+
+def _max_diff(a, b) -> float:
+    values = {(r[0], r[1]): r[2] for r in a}
+    diff = 0.0
+    for ts, spid, value in b:
+        other = values.get((ts, spid))
+        if other is None or value is None:
+            continue
+        diff = max(diff, abs(other - value))
+    return diff
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--station-param-id", type=int, nargs="+", required=True)
+    ap.add_argument("--site-id", type=int, default=None)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--bucket", nargs="+", default=BUCKETS)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=args.days)
+
+    print(f"{'bucket':>13} {'plan':>7} {'rows':>8} {'best s':>8} {'buffers':>10} {'max diff':>10}  segments")
+    with db_session() as db:
+        for bucket in args.bucket:
+            results = {}
+            for name, tiers in (("before", ()), ("after", None)):
+                kwargs = {"site_id": args.site_id}
+                if tiers is not None:
+                    kwargs["tiers"] = tiers
+                plan = plan_series(db, args.station_param_id, start, end, bucket, **kwargs)
+                best = None
+                for _ in range(args.repeat):
+                    elapsed, rows = _fetch(db, plan)
+                    best = elapsed if best is None else min(best, elapsed)
+                results[name] = rows
+                diff = _max_diff(results["before"], rows) if name == "after" else 0.0
+                segments = " + ".join(s.source for s in plan.segments)
+                print(
+                    f"{bucket:>13} {name:>7} {len(rows):>8} {best:>8.3f} {_buffers(db, plan):>10} "
+                    f"{diff:>10.4g}  {segments}"
+                )
+            db.rollback()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Envelope decryption for device payloads.
+
+Format (simulator.encrypt_payload): `{"IV": hex, "Ciphertext": hex}`, AES-CBC
+with zero padding, key = ASCII `Device.device_authkey`.
+
+Key material is cached per `device_uid` in a bounded LRU.  Each entry holds a
+single AES-ECB context for the device, so the key schedule is expanded once
+per device instead of once per message; CBC is then one ECB pass over the
+whole ciphertext XOR-ed with the IV-shifted ciphertext.
+
+An entry is rebuilt whenever the auth key handed in differs from the cached
+one (the resolution index reloads devices on rotation) and dropped on
+`resolution_index` invalidations, see resolution_index.py for the
+Device.device_authkey / Site.authkey hooks.
+
+Microbenchmark (messages/sec on one core):
+    python -m app.ingestion.decrypt
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import orjson
+from Crypto.Cipher import AES
+
+KEY_CACHE_SIZE = int(os.getenv("INGEST_KEY_CACHE_SIZE", "20000"))
+
+
+class _KeyMaterial:
+    __slots__ = ("auth_key", "ecb")
+
+    def __init__(self, auth_key: str):
+        self.auth_key = auth_key
+        self.ecb = AES.new(auth_key.encode("utf-8"), AES.MODE_ECB)
+
+
+class KeyCache:
+    """Thread-safe LRU of per-device cipher contexts."""
+
+    def __init__(self, maxsize: int = KEY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, _KeyMaterial]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, device_uid: str, auth_key: str) -> _KeyMaterial:
+        with self._lock:
+            km = self._data.get(device_uid)
+            if km is not None and km.auth_key == auth_key:
+                self._data.move_to_end(device_uid)
+                self.hits += 1
+                return km
+        km = _KeyMaterial(auth_key)
+        with self._lock:
+            self.misses += 1
+            self._data[device_uid] = km
+            self._data.move_to_end(device_uid)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return km
+
+    def evict(self, device_uids: Iterable[str] = (), clear: bool = False):
+        with self._lock:
+            if clear:
+                self._data.clear()
+                return
+            for uid in device_uids:
+                self._data.pop(uid, None)
+
+    def apply_invalidation(self, msg: dict):
+        # device_ids / station_ids / site_ids are not known here; the auth key
+        # comparison in get() catches those once the index reloads the device
+        self.evict(msg.get("device_uids") or (), clear=bool(msg.get("all")))
+
+    def __len__(self):
+        return len(self._data)
+
+
+def cbc_decrypt(km: _KeyMaterial, iv: bytes, ct: bytes) -> bytes:
+    """AES-CBC decrypt with a reusable ECB context; strips the zero padding."""
+    if not ct or len(ct) % 16 or len(iv) != 16:
+        raise ValueError("ciphertext is not a whole number of AES blocks")
+    d = km.ecb.decrypt(ct)
+    prev = iv + ct[:-16]
+    pt = (int.from_bytes(d, "big") ^ int.from_bytes(prev, "big")).to_bytes(len(ct), "big")
+    return pt.rstrip(b"\x00")
+
+
+def parse_envelope(raw: bytes) -> Tuple[bytes, bytes]:
+    envelope = orjson.loads(raw)
+    return bytes.fromhex(envelope["IV"]), bytes.fromhex(envelope["Ciphertext"])
+
+
+def decrypt_one(cache: KeyCache, device_uid: str, auth_key: str, raw: bytes) -> dict:
+    iv, ct = parse_envelope(raw)
+    return orjson.loads(cbc_decrypt(cache.get(device_uid, auth_key), iv, ct))
+
+
+def decrypt_batch(cache: KeyCache, items: List[Tuple[str, str, bytes]]) -> List[Optional[dict]]:
+    """
+    `items` = [(device_uid, auth_key, raw_envelope), ...]
+
+    Returns the parsed payloads in the same order; an entry is None when the
+    envelope is malformed, the key is wrong or the plaintext is not JSON.
+    """
+    out: List[Optional[dict]] = []
+    append = out.append
+    for device_uid, auth_key, raw in items:
+        try:
+            append(decrypt_one(cache, device_uid, auth_key, raw))
+        except Exception:
+            append(None)
+    return out
+
+
+key_cache = KeyCache()
+
+
+def subscribe_invalidations(cache: KeyCache = key_cache):
+    from .resolution_index import CHANNEL
+    from ..utils import pubsub
+
+    pubsub.subscribe(CHANNEL, cache.apply_invalidation)
+
+
+# ─── Microbenchmark ──────────────────────────────────────────────────
+def _bench(n_devices: int = 2000, n_messages: int = 50000, batch: int = 1000):
+    import hashlib
+    import json
+    import time
+
+    from Crypto.Random import get_random_bytes
+
+    def encrypt(payload: dict, key: str) -> bytes:
+        pt = json.dumps(payload, separators=(",", ":")).encode()
+        pt += b"\x00" * (-len(pt) % 16)
+        iv = get_random_bytes(16)
+        ct = AES.new(key.encode(), AES.MODE_CBC, iv=iv).encrypt(pt)
+        return json.dumps({"IV": iv.hex().upper(), "Ciphertext": ct.hex().upper()}).encode()
+
+    devices = []
+    for i in range(n_devices):
+        uid = f"DEV{i:05d}"
+        devices.append((uid, hashlib.md5(f"{uid}_CHIP{i}".encode()).hexdigest()))
+
+    items = []
+    for i in range(n_messages):
+        uid, key = devices[i % n_devices]
+        payload = {
+            "site_uid": "SITE001", "chipid": "CHIP", "device_uid": uid, "QualityCode": "U",
+            "timestamp": "2025-07-28T10:27:54Z+0530",
+            "data": [
+                {"station_uid": "ST1", "analyser_id": "AN1", "parameter_id": f"P{j}", "value": "12.34"}
+                for j in range(6)
+            ],
+        }
+        items.append((uid, key, encrypt(payload, key)))
+
+    def naive(uid, key, raw):
+        env = json.loads(raw)
+        cipher = AES.new(key.encode(), AES.MODE_CBC, iv=bytes.fromhex(env["IV"]))
+        return json.loads(cipher.decrypt(bytes.fromhex(env["Ciphertext"])).rstrip(b"\x00"))
+
+    t0 = time.perf_counter()
+    for uid, key, raw in items:
+        naive(uid, key, raw)
+    naive_rate = n_messages / (time.perf_counter() - t0)
+
+    cache = KeyCache()
+    decrypt_batch(cache, items[:n_devices])  # warm key material
+    t0 = time.perf_counter()
+    for i in range(0, n_messages, batch):
+        decoded = decrypt_batch(cache, items[i:i + batch])
+    batch_rate = n_messages / (time.perf_counter() - t0)
+    assert decoded[-1]["device_uid"] == items[-1][0]
+
+    print(f"devices={n_devices} messages={n_messages} batch={batch}")
+    print(f"per-message AES.new + json : {naive_rate:>10,.0f} msg/s")
+    print(f"cached ECB ctx + orjson    : {batch_rate:>10,.0f} msg/s")
+
+
+if __name__ == "__main__":
+    _bench()
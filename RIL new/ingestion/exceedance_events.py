@@ -0,0 +1,373 @@
+"""
+Exceedance events maintained at ingest.
+
+Every flush of sensor_data rows goes through `bucket_rules.observe()` once
+the COPY has committed (write_buffer.announce_rows).  Readings are accumulated per station parameter into the
+open 15-minute bucket; a bucket is classified once data for a later bucket
+arrives (or CLOSE_GRACE seconds after it ended) against two rules:
+
+    threshold    15-min average > station_parameters.para_threshold * 1.10
+    site_level   any reading in the bucket (bucket max) >
+                 site_level_parameter_threshold for the site and parameter
+
+Runs of consecutive exceeding buckets become one `exceedance_events` row
+(start_bucket .. last_bucket, bucket_count, peak_value); the run's row stays
+`is_open` until a bucket passes or data stops (a bucket classified by the
+sweep, i.e. with no later bucket within CLOSE_GRACE, closes it), so
+"exceeding now" and "how many exceeding buckets per day" are index lookups.
+
+Readings that arrive after their bucket was classified (spill replay, late
+devices) are not re-evaluated; rebuild a window from sensor_data with
+
+    python -m app.ingestion.exceedance_events --days 7 [--site-id 12]
+
+The in-memory bucket state is only replaced once that transaction commits,
+so a failed update is not counted twice.
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, text
+
+from ..utils.exceedance import CLOSE_GRACE, EXCEEDANCE_FACTOR, RULE_SITE_LEVEL, RULE_THRESHOLD, SWEEP_INTERVAL
+from ..utils.latest_cache import BUCKET_SECONDS, bucket_of, current_bucket
+
+logger = logging.getLogger(__name__)
+
+THRESHOLDS_SQL = text("""
+    SELECT
+        sp.id AS station_param_id,
+        sp.para_threshold,
+        sl.site_level_threshold
+    FROM station_parameters sp
+    JOIN stations st ON st.id = sp.station_id
+    LEFT JOIN analyser_parameter ap ON ap.id = sp.analyser_param_id
+    LEFT JOIN site_level_parameter_threshold sl
+           ON sl.site_id = st.site_id
+          AND sl.parameter_id = ap.parameter_id
+    WHERE sp.id = ANY(:spids)
+""")
+
+# full-bucket aggregates for buckets this process only saw part of
+BUCKET_AGG_SQL = text("""
+    SELECT
+        station_param_id,
+        time_bucket('15 minutes', time) AS bucket,
+        AVG(value) AS avg_value,
+        MAX(value) AS max_value
+    FROM sensor_data
+    WHERE station_param_id = ANY(:spids)
+      AND time >= :start_utc
+      AND time <  :end_utc
+    GROUP BY 1, 2
+""")
+
+OPEN_EVENTS_SQL = text("""
+    SELECT id, station_param_id, rule, last_bucket, peak_value
+    FROM exceedance_events
+    WHERE is_open AND station_param_id = ANY(:spids)
+    FOR UPDATE
+""")
+
+INSERT_EVENT_SQL = text("""
+    INSERT INTO exceedance_events
+        (site_id, station_param_id, rule, start_bucket, last_bucket, bucket_count, peak_value, threshold, is_open)
+    VALUES
+        (:site_id, :station_param_id, :rule, :start_bucket, :last_bucket, :bucket_count, :peak_value, :threshold, :is_open)
+    RETURNING id
+""")
+
+EXTEND_EVENT_SQL = text("""
+    UPDATE exceedance_events
+       SET last_bucket  = :last_bucket,
+           bucket_count = bucket_count + 1,
+           peak_value   = GREATEST(peak_value, :value)
+     WHERE id = :id
+""")
+
+CLOSE_EVENT_SQL = text("UPDATE exceedance_events SET is_open = FALSE WHERE id = :id")
+
+
+def _ts(epoch: int) -> datetime:
+    return datetime.fromtimestamp(epoch, timezone.utc)
+
+
+def classify(avg_value: float, max_value: float, para_threshold, site_level_threshold):
+    """[(rule, exceeded, value, threshold)] for one bucket; rules without a threshold are skipped."""
+    out = []
+    if para_threshold is not None:
+        out.append((RULE_THRESHOLD, avg_value > para_threshold * EXCEEDANCE_FACTOR, avg_value, para_threshold))
+    if site_level_threshold is not None:
+        out.append((RULE_SITE_LEVEL, max_value > site_level_threshold, max_value, site_level_threshold))
+    return out
+
+
+class _Bucket:
+    __slots__ = ("site_id", "bucket", "sum", "n", "max", "partial")
+
+    def __init__(self, site_id: int, bucket: int, partial: bool):
+        self.site_id = site_id
+        self.bucket = bucket
+        self.sum = 0.0
+        self.n = 0
+        self.max = float("-inf")
+        self.partial = partial
+
+    def copy(self) -> "_Bucket":
+        b = _Bucket(self.site_id, self.bucket, self.partial)
+        b.sum, b.n, b.max = self.sum, self.n, self.max
+        return b
+
+    def add(self, value: float):
+        self.sum += value
+        self.n += 1
+        if value > self.max:
+            self.max = value
+
+
+class BucketRuleEvaluator:
+
+    def __init__(self, grace: float = CLOSE_GRACE, sweep_interval: float = SWEEP_INTERVAL):
+        self.grace = grace
+        self.sweep_interval = sweep_interval
+        self._open: Dict[int, _Bucket] = {}
+        self._last_sweep = 0.0
+        self.buckets_classified = 0
+
+    def observe(self, db, rows: List[dict]):
+        """Accumulate `rows`, classify the buckets they close (call inside the after-write transaction)."""
+        staged: Dict[int, Optional[_Bucket]] = {}
+        closed = []
+        stopped = set()
+        for r in rows:
+            spid = r["station_param_id"]
+            b = bucket_of(r["time"])
+            cur = staged[spid] if spid in staged else self._open.get(spid)
+            if cur is None:
+                # first bucket seen by this process: earlier readings may exist
+                cur = staged[spid] = _Bucket(r["site_id"], b, partial=True)
+            elif b > cur.bucket:
+                closed.append((spid, cur))
+                cur = staged[spid] = _Bucket(r["site_id"], b, partial=False)
+            elif b < cur.bucket:
+                continue
+            elif spid not in staged:
+                cur = staged[spid] = cur.copy()
+            cur.add(float(r["value"]))
+
+        now = time.time()
+        swept = now - self._last_sweep >= self.sweep_interval
+        if swept:
+            for spid, cur in self._open.items():
+                if spid not in staged and cur.bucket + BUCKET_SECONDS + self.grace <= now:
+                    closed.append((spid, cur))
+                    staged[spid] = None
+                    stopped.add(spid)
+
+        if closed:
+            self._classify(db, closed, stopped)
+
+        def _commit(_session):
+            for spid, cur in staged.items():
+                if cur is None:
+                    self._open.pop(spid, None)
+                else:
+                    self._open[spid] = cur
+            if swept:
+                self._last_sweep = now
+            self.buckets_classified += len(closed)
+
+        event.listen(db, "after_commit", _commit, once=True)
+
+    def _classify(self, db, closed, stopped=()):
+        """Apply the `closed` buckets; events of the `stopped` station parameters end with them."""
+        spids = sorted({spid for spid, _ in closed})
+        thresholds = {
+            r.station_param_id: (r.para_threshold, r.site_level_threshold)
+            for r in db.execute(THRESHOLDS_SQL, {"spids": spids})
+        }
+
+        full = {}
+        partial = [(spid, b) for spid, b in closed if b.partial]
+        if partial:
+            rows = db.execute(BUCKET_AGG_SQL, {
+                "spids": sorted({spid for spid, _ in partial}),
+                "start_utc": _ts(min(b.bucket for _, b in partial)),
+                "end_utc": _ts(max(b.bucket for _, b in partial) + BUCKET_SECONDS),
+            })
+            full = {(r.station_param_id, bucket_of(r.bucket)): (float(r.avg_value), float(r.max_value)) for r in rows}
+
+        open_events = {
+            (r.station_param_id, r.rule): r._asdict()
+            for r in db.execute(OPEN_EVENTS_SQL, {"spids": spids})
+        }
+
+        for spid, b in sorted(closed, key=lambda c: (c[0], c[1].bucket)):
+            if spid not in thresholds:
+                continue
+            avg_value, max_value = full.get((spid, b.bucket)) or (b.sum / b.n, b.max)
+            for rule, exceeded, value, threshold in classify(avg_value, max_value, *thresholds[spid]):
+                apply_bucket(db, open_events, b.site_id, spid, rule, b.bucket, exceeded, value, threshold)
+
+        # no later bucket arrived within the grace: the device stopped, so does the run
+        for key, ev in list(open_events.items()):
+            if key[0] in stopped:
+                db.execute(CLOSE_EVENT_SQL, {"id": ev["id"]})
+                del open_events[key]
+
+
+def apply_bucket(db, open_events: dict, site_id: int, spid: int, rule: str, bucket: int,
+                 exceeded: bool, value: float, threshold: float):
+    """Advance the (spid, rule) event state by one classified bucket."""
+    key = (spid, rule)
+    ev = open_events.get(key)
+    bucket_ts = _ts(bucket)
+    if ev is not None and bucket_ts <= ev["last_bucket"]:
+        return
+    if exceeded and ev is not None and ev["last_bucket"] == bucket_ts - timedelta(seconds=BUCKET_SECONDS):
+        db.execute(EXTEND_EVENT_SQL, {"id": ev["id"], "last_bucket": bucket_ts, "value": value})
+        ev["last_bucket"] = bucket_ts
+        return
+    if ev is not None:
+        db.execute(CLOSE_EVENT_SQL, {"id": ev["id"]})
+        del open_events[key]
+    if exceeded:
+        new_id = db.execute(INSERT_EVENT_SQL, {
+            "site_id": site_id, "station_param_id": spid, "rule": rule,
+            "start_bucket": bucket_ts, "last_bucket": bucket_ts, "bucket_count": 1,
+            "peak_value": value, "threshold": threshold, "is_open": True,
+        }).scalar()
+        open_events[key] = {"id": new_id, "station_param_id": spid, "rule": rule,
+                            "last_bucket": bucket_ts, "peak_value": value}
+
+
+# ─── Rebuild from sensor_data ────────────────────────────────────────
+REBUILD_BUCKETS_SQL = """
+    SELECT
+        sd.station_param_id,
+        st.site_id,
+        time_bucket('15 minutes', sd.time) AS bucket,
+        AVG(sd.value) AS avg_value,
+        MAX(sd.value) AS max_value
+    FROM sensor_data sd
+    JOIN station_parameters sp ON sp.id = sd.station_param_id
+    JOIN stations st           ON st.id = sp.station_id
+    WHERE sd.time >= :start_utc
+      AND sd.time <  :end_utc
+      {site_filter}
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 3
+"""
+
+
+def rebuild_events(db, since: datetime, site_id: Optional[int] = None) -> int:
+    """
+    Recompute events from `since` up to the last complete bucket.  Events
+    overlapping `since` are rebuilt from their start.  A run is left open,
+    as at ingest, only if it reaches the last complete bucket and its station
+    parameter has readings in the current bucket (or the grace has not run
+    out yet).  Returns events written.
+    """
+    params = {"since": since}
+    site_filter = ""
+    if site_id is not None:
+        site_filter = "AND site_id = :site_id"
+        params["site_id"] = site_id
+
+    earliest = db.execute(text(f"""
+        SELECT MIN(start_bucket) FROM exceedance_events
+        WHERE last_bucket >= :since {site_filter}
+    """), params).scalar()
+    start = min(since, earliest) if earliest else since
+    start = _ts(bucket_of(start))
+    now = time.time()
+    end = _ts(current_bucket())
+
+    db.execute(text(f"""
+        DELETE FROM exceedance_events
+        WHERE last_bucket >= :start {site_filter}
+    """), {**params, "start": start})
+
+    result = db.execute(
+        text(REBUILD_BUCKETS_SQL.format(site_filter="AND st.site_id = :site_id" if site_id is not None else "")),
+        {**params, "start_utc": start, "end_utc": _ts(now)},
+    )
+    rows = result.fetchall()
+    thresholds = {
+        r.station_param_id: (r.para_threshold, r.site_level_threshold)
+        for r in db.execute(THRESHOLDS_SQL, {"spids": sorted({r.station_param_id for r in rows})})
+    }
+
+    last_complete = bucket_of(end) - BUCKET_SECONDS
+    in_grace = now < bucket_of(end) + CLOSE_GRACE
+    live = set()                     # station parameters with readings in the current bucket
+    runs: Dict[tuple, dict] = {}
+    written = 0
+
+    def _flush_run(key):
+        nonlocal written
+        run = runs.pop(key)
+        run["is_open"] = run["last"] == last_complete and (key[0] in live or in_grace)
+        db.execute(INSERT_EVENT_SQL, {
+            "site_id": run["site_id"], "station_param_id": key[0], "rule": key[1],
+            "start_bucket": _ts(run["start"]), "last_bucket": _ts(run["last"]),
+            "bucket_count": run["count"], "peak_value": run["peak"],
+            "threshold": run["threshold"], "is_open": run["is_open"],
+        })
+        written += 1
+
+    for r in rows:
+        if r.station_param_id not in thresholds:
+            continue
+        b = bucket_of(r.bucket)
+        if b > last_complete:
+            live.add(r.station_param_id)
+            continue
+        for rule, exceeded, value, threshold in classify(
+            float(r.avg_value), float(r.max_value), *thresholds[r.station_param_id]
+        ):
+            key = (r.station_param_id, rule)
+            run = runs.get(key)
+            if run is not None and (not exceeded or b != run["last"] + BUCKET_SECONDS):
+                _flush_run(key)
+                run = None
+            if not exceeded:
+                continue
+            if run is None:
+                runs[key] = {"site_id": r.site_id, "start": b, "last": b, "count": 1,
+                             "peak": value, "threshold": threshold}
+            else:
+                run["last"] = b
+                run["count"] += 1
+                run["peak"] = max(run["peak"], value)
+
+    for key in list(runs):
+        _flush_run(key)
+    db.commit()
+    logger.info("exceedance_events rebuilt from %s: %s events", start.isoformat(), written)
+    return written
+
+
+def main():
+    from ..utils.db import db_session
+
+    parser = argparse.ArgumentParser(description="Rebuild exceedance_events from sensor_data")
+    parser.add_argument("--days", type=int, default=7, help="rebuild this many days back")
+    parser.add_argument("--site-id", type=int, default=None, help="only rebuild this site")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    since = datetime.now(timezone.utc) - timedelta(days=args.days)
+    with db_session() as db:
+        rebuild_events(db, since, args.site_id)
+
+
+bucket_rules = BucketRuleEvaluator()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+`latest_sensor_data` maintenance.
+
+Ingestion upserts the newest reading per station_param_id right after the
+sensor_data COPY commits (see write_buffer.announce_rows), so every
+"latest value" endpoint reads one row per parameter instead of scanning the
+hypertable.
+
+Rebuild / repair from sensor_data (e.g. after a backfill or a restore):
+    python -m app.ingestion.latest_values                 # all sites
+    python -m app.ingestion.latest_values --site-id 12
+"""
+
+import argparse
+import logging
+from typing import List, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Rows can arrive out of order (spill replay, late devices); never move the
+# latest value backwards.
+UPSERT_LATEST_SQL = text("""
+    INSERT INTO latest_sensor_data (site_id, station_param_id, value, time)
+    VALUES (:site_id, :station_param_id, :value, :time)
+    ON CONFLICT (station_param_id) DO UPDATE
+       SET site_id = EXCLUDED.site_id,
+           value   = EXCLUDED.value,
+           time    = EXCLUDED.time
+     WHERE latest_sensor_data.time IS NULL
+        OR latest_sensor_data.time <= EXCLUDED.time
+""")
+
+# One index probe per station parameter (ORDER BY time DESC LIMIT 1 on the
+# hypertable) instead of a DISTINCT ON over every row.
+REBUILD_LATEST_SQL = """
+    INSERT INTO latest_sensor_data (site_id, station_param_id, value, time)
+    SELECT l.site_id, sp.id, l.value, l.time
+    FROM station_parameters sp
+    JOIN stations st ON st.id = sp.station_id
+    CROSS JOIN LATERAL (
+        SELECT sd.site_id, sd.value, sd.time
+        FROM sensor_data sd
+        WHERE sd.station_param_id = sp.id
+        ORDER BY sd.time DESC
+        LIMIT 1
+    ) l
+    WHERE {where}
+    ON CONFLICT (station_param_id) DO UPDATE
+       SET site_id = EXCLUDED.site_id,
+           value   = EXCLUDED.value,
+           time    = EXCLUDED.time
+"""
+
+PRUNE_LATEST_SQL = """
+    DELETE FROM latest_sensor_data l
+    WHERE NOT EXISTS (SELECT 1 FROM station_parameters sp WHERE sp.id = l.station_param_id)
+      {site_filter}
+"""
+
+
+def upsert_latest(db, rows: List[dict]):
+    """Reduce a batch of sensor_data rows to one per station_param_id and upsert."""
+    latest = {}
+    for r in rows:
+        spid = r["station_param_id"]
+        cur = latest.get(spid)
+        if cur is None or r["time"] >= cur["time"]:
+            latest[spid] = r
+    if not latest:
+        return
+    # fixed lock order so concurrent writers cannot deadlock on the same keys
+    params = [
+        {
+            "site_id": r["site_id"],
+            "station_param_id": spid,
+            "value": r["value"],
+            "time": r["time"],
+        }
+        for spid, r in sorted(latest.items())
+    ]
+    db.execute(UPSERT_LATEST_SQL, params)
+
+
+def rebuild_latest(db, site_id: Optional[int] = None) -> int:
+    """Recompute latest_sensor_data from sensor_data; returns rows written."""
+    params = {}
+    where = "TRUE"
+    site_filter = ""
+    if site_id is not None:
+        where = "st.site_id = :site_id"
+        site_filter = "AND l.site_id = :site_id"
+        params["site_id"] = site_id
+
+    pruned = db.execute(text(PRUNE_LATEST_SQL.format(site_filter=site_filter)), params).rowcount
+    written = db.execute(text(REBUILD_LATEST_SQL.format(where=where)), params).rowcount
+    db.commit()
+    logger.info("latest_sensor_data rebuilt: %s rows written, %s orphans removed", written, pruned)
+    return written
+
+
+def main():
+    from ..utils.db import db_session
+
+    parser = argparse.ArgumentParser(description="Rebuild latest_sensor_data from sensor_data")
+    parser.add_argument("--site-id", type=int, default=None, help="only rebuild this site")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with db_session() as db:
+        rebuild_latest(db, args.site_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# OM VIGHNHARTAYE NAMO NAMAH :
+"""
+MQTT ingestion worker for the encrypted device envelopes.
+
+Devices (see simulator.py) publish `{"IV": <hex>, "Ciphertext": <hex>}` on
+`<device_uid>_OUT`.  The ciphertext is AES-CBC with zero padding, keyed with
+the ASCII `Device.device_authkey`.  This worker decrypts every envelope
+(decrypt.py), resolves each `station_uid / analyser_id / parameter_id` item
+to `station_parameters.id` (resolution_index.py) and writes `sensor_data`
+rows through the COPY write-behind buffer (write_buffer.py), never one
+commit per message.
+
+Run standalone:
+    python -m app.ingestion.mqtt_ingest
+
+or inside the API process by setting ENWISE_INGEST_IN_APP=1 (see main.py).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..utils.db import db_session
+from .decrypt import decrypt_batch, key_cache, subscribe_invalidations
+from .resolution_index import DeviceEntry, resolution_index
+from .write_buffer import WriteBuffer
+
+logger = logging.getLogger(__name__)
+
+# ─── Config ──────────────────────────────────────────────────────────
+MQTT_BROKER = os.getenv("MQTT_BROKER", "116.50.93.126")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+
+# Device topics are single-level (`<device_uid>_OUT`), so `+` sees all of
+# them; MQTT has no suffix wildcard, the `_OUT` filter is applied here.
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "+")
+TOPIC_SUFFIX = "_OUT"
+
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))          # messages
+BATCH_INTERVAL = float(os.getenv("INGEST_BATCH_INTERVAL", "0.5"))  # seconds
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "50000"))          # messages
+
+
+# ─── Transports ──────────────────────────────────────────────────────
+def topic_matches(pattern: str, topic: str) -> bool:
+    """MQTT subscription match supporting `+` and `#`."""
+    p_parts = pattern.split("/")
+    t_parts = topic.split("/")
+    for i, p in enumerate(p_parts):
+        if p == "#":
+            return True
+        if i >= len(t_parts):
+            return False
+        if p != "+" and p != t_parts[i]:
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+class InProcessBroker:
+    """
+    Minimal in-process stand-in for an MQTT broker.
+
+    Same surface as PahoTransport (`subscribe`, `start`, `stop`) plus
+    `publish`, so the ingestion service can be driven without Mosquitto.
+    """
+
+    def __init__(self):
+        self._subs: List[Tuple[str, Callable[[str, bytes], None]]] = []
+
+    def subscribe(self, pattern: str, callback: Callable[[str, bytes], None]):
+        self._subs.append((pattern, callback))
+
+    def publish(self, topic: str, payload):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        for pattern, callback in list(self._subs):
+            if topic_matches(pattern, topic):
+                callback(topic, payload)
+
+    def start(self):
+        return
+
+    def stop(self):
+        return
+
+
+class PahoTransport:
+    """paho-mqtt client running its network loop in a background thread."""
+
+    def __init__(self, host: str = MQTT_BROKER, port: int = MQTT_PORT, keepalive: int = 60):
+        import paho.mqtt.client as mqtt
+
+        # paho 2.x requires the callback API version to be explicit
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        else:
+            self._client = mqtt.Client()
+        self._host = host
+        self._port = port
+        self._keepalive = keepalive
+        self._subs: List[Tuple[str, Callable[[str, bytes], None]]] = []
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+
+    def subscribe(self, pattern: str, callback: Callable[[str, bytes], None]):
+        self._subs.append((pattern, callback))
+
+    def _on_connect(self, client, userdata, flags, rc):
+        logger.info("MQTT connected rc=%s", rc)
+        # (re)subscribe on every connect so broker restarts are transparent
+        for pattern, _ in self._subs:
+            client.subscribe(pattern, qos=0)
+
+    def _on_message(self, client, userdata, msg):
+        for pattern, callback in self._subs:
+            if topic_matches(pattern, msg.topic):
+                callback(msg.topic, msg.payload)
+
+    def start(self):
+        self._client.connect_async(self._host, self._port, keepalive=self._keepalive)
+        self._client.loop_start()
+
+    def stop(self):
+        self._client.disconnect()
+        self._client.loop_stop()
+
+
+# ─── Decode ──────────────────────────────────────────────────────────
+def parse_device_timestamp(ts: Optional[str], fallback: datetime) -> datetime:
+    """
+    Device clocks send e.g. `2025-07-28T10:27:54Z+0530` (simulator) or an
+    ISO-8601 string with offset (generate-config).  Anything unparseable or
+    naive falls back to the broker receive time.
+    """
+    if not ts:
+        return fallback
+    for fmt in ("%Y-%m-%dT%H:%M:%SZ%z", "%Y-%m-%dT%H:%M:%S%z"):
+        try:
+            return datetime.strptime(ts, fmt)
+        except ValueError:
+            pass
+    try:
+        parsed = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        return fallback
+    return parsed if parsed.tzinfo else fallback
+
+
+# ─── Service ─────────────────────────────────────────────────────────
+class IngestionService:
+    """
+    asyncio ingestion loop.
+
+    Transport callbacks (paho network thread or in-process publish) only
+    enqueue `(topic, payload, received_at)`.  The loop drains the queue into
+    batches of up to `batch_size` messages or `batch_interval` seconds and
+    hands each batch to `process_batch` in a worker thread, so decrypt and DB
+    I/O never block the event loop.  Decoded rows go to the write buffer;
+    when it is full `process_batch` blocks, this loop stops draining and the
+    back-pressure reaches the MQTT queue.
+    """
+
+    def __init__(
+        self,
+        transport=None,
+        batch_size: int = BATCH_SIZE,
+        batch_interval: float = BATCH_INTERVAL,
+        queue_size: int = QUEUE_SIZE,
+        session_factory=db_session,
+        buffer: Optional[WriteBuffer] = None,
+    ):
+        self.transport = transport if transport is not None else PahoTransport()
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.session_factory = session_factory
+        self.buffer = buffer if buffer is not None else WriteBuffer(session_factory=session_factory)
+        self._queue: Optional[asyncio.Queue] = None
+        self._queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "dropped_queue_full": 0,
+            "rejected": 0,
+            "rows_decoded": 0,
+            "batches": 0,
+        }
+
+    def _bump(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def metrics(self) -> dict:
+        out = dict(self.stats)
+        out["mqtt_queue_depth"] = self._queue.qsize() if self._queue else 0
+        out["buffer"] = self.buffer.metrics()
+        return out
+
+    # — transport side —
+    def _on_message(self, topic: str, payload: bytes):
+        if not topic.endswith(TOPIC_SUFFIX):
+            return
+        item = (topic, payload, datetime.now(timezone.utc))
+        self._loop.call_soon_threadsafe(self._enqueue, item)
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+            self._bump("received")
+        except asyncio.QueueFull:
+            self._bump("dropped_queue_full")
+
+    # — lifecycle —
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._stopping = False
+        subscribe_invalidations()
+        self.buffer.start()
+        self.transport.subscribe(MQTT_TOPIC, self._on_message)
+        self.transport.start()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Ingestion started (batch_size=%s, interval=%ss)", self.batch_size, self.batch_interval)
+
+    async def stop(self):
+        self._stopping = True
+        self.transport.stop()
+        if self._task:
+            await self._task
+        await asyncio.to_thread(self.buffer.close)
+        logger.info("Ingestion stopped: %s", self.metrics())
+
+    async def _next_batch(self) -> list:
+        batch = []
+        deadline = self._loop.time() + self.batch_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while not (self._stopping and self._queue.empty()):
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                await asyncio.to_thread(self.process_batch, batch)
+            except Exception:
+                logger.exception("Ingestion batch of %s messages failed", len(batch))
+
+    # — batch processing (worker thread) —
+    def process_batch(self, batch: list) -> int:
+        device_uids = {topic[: -len(TOPIC_SUFFIX)] for topic, _, _ in batch}
+
+        with self.session_factory() as db:
+            devices = resolution_index.get_many(db, device_uids)
+        rows = self.decode_batch(batch, devices)
+        self.buffer.add(rows)
+
+        self._bump("rows_decoded", len(rows))
+        self._bump("batches")
+        return len(rows)
+
+    def decode_batch(self, batch: list, devices: Dict[str, DeviceEntry]) -> List[dict]:
+        rows: List[dict] = []
+        known = []
+        for topic, payload, received_at in batch:
+            device_uid = topic[: -len(TOPIC_SUFFIX)]
+            dev = devices.get(device_uid)
+            if dev is None or not dev.auth_key:
+                self._bump("rejected")
+                continue
+            known.append((dev, payload, received_at))
+
+        decoded = decrypt_batch(key_cache, [(dev.device_uid, dev.auth_key, payload) for dev, payload, _ in known])
+
+        for (dev, _, received_at), data in zip(known, decoded):
+            # None: wrong key, truncated ciphertext or garbage on the topic
+            if not isinstance(data, dict) or data.get("device_uid") not in (None, dev.device_uid):
+                self._bump("rejected")
+                continue
+
+            ts = parse_device_timestamp(data.get("timestamp"), received_at)
+            quality = data.get("QualityCode")
+            for item in data.get("data") or []:
+                target = dev.resolve(item.get("station_uid"), item.get("analyser_id"), item.get("parameter_id"))
+                if target is None:
+                    continue
+                try:
+                    value = float(item.get("value"))
+                except (TypeError, ValueError):
+                    continue
+                rows.append({
+                    "time": ts,
+                    "site_id": target.site_id,
+                    "station_id": target.station_id,
+                    "station_param_id": target.station_param_id,
+                    "device_id": target.device_id,
+                    "analyser_id": target.analyser_id,
+                    "parameter_id": target.parameter_id,
+                    "param_label": target.param_label,
+                    "qualityCode": quality,
+                    "value": value,
+                })
+        return rows
+
+
+# ─── Entrypoints ─────────────────────────────────────────────────────
+async def run_forever(transport=None):
+    service = IngestionService(transport=transport)
+    await service.start()
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info("Ingestion stats: %s", service.metrics())
+    finally:
+        await service.stop()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(run_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+In-memory UID → station_parameters resolution index.
+
+Keyed by `(device_uid, station_uid, analyser_uid, parameter_uuid)` — exactly
+the fields a decrypted payload item carries — and shared by the ingestion
+worker and `build_device_config`.  Devices are loaded lazily, all missing
+devices of a batch with one query, and kept until a CRUD endpoint that
+changes the mapping publishes an invalidation on the `resolution_index`
+channel:
+
+    {"device_ids": [..]}    device created / stations (re)assigned
+    {"device_uids": [..]}   device registered (drops a cached "unknown")
+    {"station_ids": [..]}   station parameter created / deleted, station moved / deleted
+    {"site_ids": [..]}      Site.authkey rotated
+    {"all": True}           listener reconnect, or anything broader
+
+Device.device_authkey / Site.authkey changes are caught by mapper events
+below, whichever endpoint makes them, so the cached key material in
+decrypt.py is never used after a rotation commits.
+
+A long TTL is kept only as a safety net for lost notifications.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect, text
+
+from ..modals.masters import Device, Site
+from ..utils import pubsub
+
+CHANNEL = "resolution_index"
+TTL_SECONDS = float(os.getenv("RESOLUTION_INDEX_TTL", "900"))
+
+ParamKey = Tuple[str, str, str]  # (station_uid, analyser_uid, parameter_uuid)
+
+RESOLVE_SQL = """
+    SELECT
+        d.id              AS device_id,
+        d.device_uid,
+        d.chip_id,
+        d.device_authkey  AS auth_key,
+        st.id             AS station_id,
+        st.station_uid,
+        st.site_id,
+        s.siteuid         AS site_uid,
+        sp.id             AS station_param_id,
+        sp.pram_lable     AS param_label,
+        a.id              AS analyser_id,
+        a.analyser_uid,
+        p.id              AS parameter_id,
+        p.uuid            AS parameter_uuid
+    FROM device d
+    LEFT JOIN device_station ds     ON ds.device_id = d.id
+    LEFT JOIN stations st           ON st.id = ds.station_id
+    LEFT JOIN site s                ON s.id = st.site_id
+    LEFT JOIN station_parameters sp ON sp.station_id = st.id
+    LEFT JOIN analyser_parameter ap ON ap.id = sp.analyser_param_id
+    LEFT JOIN analysers a           ON a.id = ap.analyser_id
+    LEFT JOIN parameters p          ON p.id = ap.parameter_id
+    WHERE {where}
+    ORDER BY st.id, sp.id
+"""
+
+
+class ParamTarget:
+    """What one payload item resolves to (the SensorData foreign keys)."""
+
+    __slots__ = (
+        "site_id", "station_id", "station_param_id", "device_id",
+        "analyser_id", "parameter_id", "param_label",
+    )
+
+    def __init__(self, site_id, station_id, station_param_id, device_id,
+                 analyser_id, parameter_id, param_label):
+        self.site_id = site_id
+        self.station_id = station_id
+        self.station_param_id = station_param_id
+        self.device_id = device_id
+        self.analyser_id = analyser_id
+        self.parameter_id = parameter_id
+        self.param_label = param_label
+
+
+class DeviceEntry:
+    __slots__ = (
+        "device_id", "device_uid", "chip_id", "auth_key",
+        "stations", "params", "loaded_at",
+    )
+
+    def __init__(self, device_id, device_uid, chip_id, auth_key):
+        self.device_id = device_id
+        self.device_uid = device_uid
+        self.chip_id = chip_id
+        self.auth_key = auth_key
+        # station_id -> {"station_uid", "site_id", "site_uid"} in station order
+        self.stations: Dict[int, dict] = {}
+        self.params: Dict[ParamKey, ParamTarget] = {}
+        self.loaded_at = time.monotonic()
+
+    def resolve(self, station_uid, analyser_uid, parameter_uuid) -> Optional[ParamTarget]:
+        return self.params.get((station_uid, analyser_uid, parameter_uuid))
+
+
+class ResolutionIndex:
+
+    def __init__(self, ttl: float = TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._by_uid: Dict[str, Optional[DeviceEntry]] = {}   # None = unknown device
+        self._uid_by_id: Dict[int, str] = {}
+        self._uids_by_station: Dict[int, set] = {}
+        self._subscribed = False
+        self.hits = 0
+        self.loads = 0
+
+    # — lookups —
+    def get_many(self, db, device_uids: Iterable[str]) -> Dict[str, DeviceEntry]:
+        """Entries for every known device in `device_uids`; unknown ones are omitted."""
+        self._ensure_subscribed()
+        device_uids = set(device_uids)
+        now = time.monotonic()
+        out: Dict[str, DeviceEntry] = {}
+        missing: List[str] = []
+        with self._lock:
+            for uid in device_uids:
+                if uid in self._by_uid:
+                    entry = self._by_uid[uid]
+                    if entry is None or now - entry.loaded_at < self.ttl:
+                        if entry is not None:
+                            out[uid] = entry
+                        self.hits += 1
+                        continue
+                missing.append(uid)
+        if missing:
+            loaded = self._load(db, "d.device_uid = ANY(:keys)", missing)
+            with self._lock:
+                for uid in missing:
+                    entry = loaded.get(uid)
+                    self._store(uid, entry)
+                    if entry is not None:
+                        out[uid] = entry
+        return out
+
+    def get(self, db, device_uid: str) -> Optional[DeviceEntry]:
+        return self.get_many(db, [device_uid]).get(device_uid)
+
+    def get_by_device_id(self, db, device_id: int) -> Optional[DeviceEntry]:
+        with self._lock:
+            uid = self._uid_by_id.get(device_id)
+        if uid is not None:
+            return self.get(db, uid)
+        loaded = self._load(db, "d.id = ANY(:keys)", [device_id])
+        entry = next(iter(loaded.values()), None)
+        if entry is not None:
+            with self._lock:
+                self._store(entry.device_uid, entry)
+        return entry
+
+    # — loading —
+    def _load(self, db, where: str, keys: list) -> Dict[str, DeviceEntry]:
+        self.loads += 1
+        entries: Dict[str, DeviceEntry] = {}
+        rows = db.execute(text(RESOLVE_SQL.format(where=where)), {"keys": keys}).mappings()
+        for r in rows:
+            entry = entries.get(r["device_uid"])
+            if entry is None:
+                entry = entries[r["device_uid"]] = DeviceEntry(
+                    r["device_id"], r["device_uid"], r["chip_id"], r["auth_key"]
+                )
+            if r["station_id"] is None:
+                continue
+            entry.stations.setdefault(r["station_id"], {
+                "station_uid": r["station_uid"],
+                "site_id": r["site_id"],
+                "site_uid": r["site_uid"],
+            })
+            if r["station_param_id"] is None or r["analyser_uid"] is None:
+                continue
+            entry.params[(r["station_uid"], r["analyser_uid"], r["parameter_uuid"])] = ParamTarget(
+                r["site_id"], r["station_id"], r["station_param_id"], r["device_id"],
+                r["analyser_id"], r["parameter_id"], r["param_label"],
+            )
+        return entries
+
+    def _store(self, uid: str, entry: Optional[DeviceEntry]):
+        self._drop(uid)
+        self._by_uid[uid] = entry
+        if entry is None:
+            return
+        self._uid_by_id[entry.device_id] = uid
+        for station_id in entry.stations:
+            self._uids_by_station.setdefault(station_id, set()).add(uid)
+
+    def _drop(self, uid: str):
+        entry = self._by_uid.pop(uid, None)
+        if entry is None:
+            return
+        self._uid_by_id.pop(entry.device_id, None)
+        for station_id in entry.stations:
+            uids = self._uids_by_station.get(station_id)
+            if uids:
+                uids.discard(uid)
+                if not uids:
+                    del self._uids_by_station[station_id]
+
+    # — invalidation —
+    def _ensure_subscribed(self):
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        pubsub.subscribe(CHANNEL, self.apply_invalidation)
+
+    def apply_invalidation(self, msg: dict):
+        with self._lock:
+            if msg.get("all"):
+                self._by_uid.clear()
+                self._uid_by_id.clear()
+                self._uids_by_station.clear()
+                return
+            uids = set(msg.get("device_uids") or ())
+            for device_id in msg.get("device_ids") or ():
+                uid = self._uid_by_id.get(device_id)
+                if uid is not None:
+                    uids.add(uid)
+            for station_id in msg.get("station_ids") or ():
+                uids |= self._uids_by_station.get(station_id, set())
+            site_ids = set(msg.get("site_ids") or ())
+            if site_ids:
+                for uid, entry in self._by_uid.items():
+                    if entry is not None and any(
+                        st["site_id"] in site_ids for st in entry.stations.values()
+                    ):
+                        uids.add(uid)
+            for uid in uids:
+                self._drop(uid)
+
+
+def invalidate(db, *, device_ids=(), device_uids=(), station_ids=(), site_ids=()):
+    """
+    Call from CRUD endpoints before `db.commit()`; every process drops the
+    affected devices once the write is committed.
+    """
+    pubsub.publish(db, CHANNEL, {
+        "device_ids": list(device_ids),
+        "device_uids": list(device_uids),
+        "station_ids": list(station_ids),
+        "site_ids": list(site_ids),
+    })
+
+
+@event.listens_for(Device, "after_update")
+def _device_key_rotated(mapper, connection, target):
+    if inspect(target).attrs.device_authkey.history.has_changes():
+        invalidate(connection, device_ids=[target.id], device_uids=[target.device_uid])
+
+
+@event.listens_for(Site, "after_update")
+def _site_key_rotated(mapper, connection, target):
+    if inspect(target).attrs.authkey.history.has_changes():
+        invalidate(connection, site_ids=[target.id])
+
+
+resolution_index = ResolutionIndex()
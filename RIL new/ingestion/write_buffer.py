@@ -0,0 +1,355 @@
+"""
+Write-behind buffer between envelope decode and `sensor_data`.
+
+Decoded rows are appended with `add()`; a flusher thread writes them with
+PostgreSQL COPY whenever `max_rows` are queued or the oldest row is
+`max_age` seconds old.  Each flush is sorted by time so a COPY lands in as
+few hypertable chunks as possible.
+
+Back-pressure: once `capacity` rows are queued, `add()` blocks the caller
+(the ingestion worker thread, which in turn stops draining the MQTT queue)
+for up to `block_timeout` seconds.  If the DB still has not caught up the
+rows go to the spill directory instead of memory.
+
+Durability: a flush that fails because the DB is unavailable (DB restart,
+failover) is written to a spill file (JSON lines, fsync'd) and replayed,
+oldest first, once flushes succeed again.  Spill files left by a previous
+process are replayed on start.
+
+Rows the DB rejects (DataError / IntegrityError: a bad value, a station
+parameter deleted meanwhile) are not retried: the batch is bisected down to
+the offending rows, which go to `<spill_dir>/quarantine` with the rest
+written normally, so one poison row never blocks later spill files.
+
+After each COPY commits, a second transaction upserts `latest_sensor_data`,
+announces the readings to the API workers' latest-value caches and advances
+the exceedance events (ingestion/exceedance_events).  A failure there is
+logged and counted, the readings themselves stay written.
+
+`metrics()` reports queue depth, flush latency and rows/sec.
+"""
+
+import csv
+import io
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import orjson
+from sqlalchemy import exc as sa_exc
+
+from ..utils.db import db_session
+from ..utils.latest_cache import publish_readings
+from .exceedance_events import bucket_rules
+from .latest_values import upsert_latest
+
+logger = logging.getLogger(__name__)
+
+FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "5000"))
+FLUSH_AGE = float(os.getenv("INGEST_FLUSH_AGE", "0.5"))          # seconds
+CAPACITY = int(os.getenv("INGEST_BUFFER_CAPACITY", "100000"))    # rows
+BLOCK_TIMEOUT = float(os.getenv("INGEST_BLOCK_TIMEOUT", "5"))    # seconds
+SPILL_DIR = os.getenv("INGEST_SPILL_DIR", "spill")
+
+COPY_SQL = 'COPY sensor_data (time, site_id, station_id, station_param_id, device_id, analyser_id, parameter_id, param_label, "qualityCode", value) FROM STDIN WITH (FORMAT csv)'
+
+
+def copy_rows(db, rows: List[dict]):
+    """COPY `rows` into sensor_data on the session's connection (caller commits)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for r in rows:
+        writer.writerow([
+            r["time"].isoformat(), r["site_id"], r["station_id"], r["station_param_id"],
+            r["device_id"], r["analyser_id"], r["parameter_id"], r["param_label"],
+            r["qualityCode"], r["value"],
+        ])
+    buf.seek(0)
+    cur = db.connection().connection.cursor()
+    try:
+        cur.copy_expert(COPY_SQL, buf)
+    finally:
+        cur.close()
+
+
+def announce_rows(db, rows: List[dict]):
+    """Side effects of committed rows: latest values, live caches, exceedance events (caller commits)."""
+    upsert_latest(db, rows)
+    publish_readings(db, rows)
+    bucket_rules.observe(db, rows)
+
+
+def is_rejected(error: BaseException) -> bool:
+    """The DB refused the rows themselves (retrying cannot succeed)."""
+    orig = getattr(error, "orig", None) or error
+    if isinstance(error, (sa_exc.DataError, sa_exc.IntegrityError)):
+        return True
+    # COPY runs on the raw DB-API cursor, so its errors are not wrapped;
+    # DB-API modules name the classes the same (psycopg2.DataError, ...)
+    return any(cls.__name__ in ("DataError", "IntegrityError") for cls in type(orig).__mro__)
+
+
+class _Rate:
+    """Rows/sec over a sliding window."""
+
+    def __init__(self, window: float = 10.0):
+        self.window = window
+        self._events = deque()
+
+    def add(self, n: int):
+        now = time.monotonic()
+        self._events.append((now, n))
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+
+    def rate(self) -> float:
+        now = time.monotonic()
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+        return sum(n for _, n in self._events) / self.window
+
+
+class WriteBuffer:
+
+    def __init__(
+        self,
+        max_rows: int = FLUSH_ROWS,
+        max_age: float = FLUSH_AGE,
+        capacity: int = CAPACITY,
+        block_timeout: float = BLOCK_TIMEOUT,
+        spill_dir: str = SPILL_DIR,
+        session_factory=db_session,
+        writer: Callable = copy_rows,
+        after_write: Optional[Callable] = announce_rows,
+    ):
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.capacity = capacity
+        self.block_timeout = block_timeout
+        self.spill_dir = Path(spill_dir)
+        self.quarantine_dir = self.spill_dir / "quarantine"
+        self.session_factory = session_factory
+        self.writer = writer
+        self.after_write = after_write
+
+        self._rows: deque = deque()
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+        self._spill_seq = itertools.count(1)     # next() is atomic: flusher and producers both spill
+        self._db_healthy = True
+
+        self._rate = _Rate()
+        self._stats = {
+            "rows_flushed": 0,
+            "flushes": 0,
+            "flush_failures": 0,
+            "rows_spilled": 0,
+            "rows_replayed": 0,
+            "rows_quarantined": 0,
+            "after_write_failures": 0,
+            "blocked_seconds": 0.0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "avg_flush_ms": 0.0,
+        }
+
+    # — producer side —
+    def add(self, rows: List[dict]):
+        if not rows:
+            return
+        with self._cond:
+            if len(self._rows) >= self.capacity:
+                started = time.monotonic()
+                deadline = started + self.block_timeout
+                while len(self._rows) >= self.capacity and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._stats["blocked_seconds"] += time.monotonic() - started
+                if len(self._rows) >= self.capacity:
+                    # DB is not keeping up; keep the readings on disk, not in RAM
+                    self._spill(rows)
+                    return
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            if len(self._rows) >= self.max_rows:
+                self._cond.notify_all()
+
+    # — lifecycle —
+    def start(self):
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="sensor-data-writer", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 30.0):
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    # — flusher thread —
+    def _take(self) -> List[dict]:
+        """Wait for a size/age trigger and pop up to `max_rows` rows."""
+        with self._cond:
+            while True:
+                if self._rows and (
+                    len(self._rows) >= self.max_rows
+                    or self._closing
+                    or time.monotonic() - self._oldest >= self.max_age
+                ):
+                    break
+                if self._closing:
+                    return []
+                wait = self.max_age if self._oldest is None else max(
+                    0.0, self.max_age - (time.monotonic() - self._oldest)
+                )
+                self._cond.wait(wait)
+            n = min(len(self._rows), self.max_rows)
+            batch = [self._rows.popleft() for _ in range(n)]
+            self._oldest = time.monotonic() if self._rows else None
+            self._cond.notify_all()  # wake blocked producers
+            return batch
+
+    def _run(self):
+        last_replay_check = time.monotonic()
+        self._replay_spill()
+        while True:
+            batch = self._take()
+            if not batch:
+                if self._closing:
+                    return
+                continue
+            was_healthy = self._db_healthy
+            unwritten = self._flush(batch)
+            if not unwritten:
+                if not was_healthy or time.monotonic() - last_replay_check > 5.0:
+                    last_replay_check = time.monotonic()
+                    self._replay_spill()
+            else:
+                self._spill(unwritten)
+
+    def _flush(self, batch: List[dict]) -> List[dict]:
+        """Write `batch`; returns the rows left unwritten because the DB is unavailable."""
+        batch.sort(key=lambda r: r["time"])
+        started = time.perf_counter()
+        try:
+            with self.session_factory() as db:
+                self.writer(db, batch)
+                db.commit()
+        except Exception as error:
+            if is_rejected(error):
+                self._db_healthy = True
+                return self._bisect(batch, error)
+            if self._db_healthy:
+                logger.exception("sensor_data flush of %s rows failed; spilling to disk", len(batch))
+            self._db_healthy = False
+            self._stats["flush_failures"] += 1
+            return batch
+        self._db_healthy = True
+
+        ms = (time.perf_counter() - started) * 1000.0
+        s = self._stats
+        s["flushes"] += 1
+        s["rows_flushed"] += len(batch)
+        s["last_flush_ms"] = ms
+        s["max_flush_ms"] = max(s["max_flush_ms"], ms)
+        s["avg_flush_ms"] = ms if s["flushes"] == 1 else 0.9 * s["avg_flush_ms"] + 0.1 * ms
+        self._rate.add(len(batch))
+
+        if self.after_write is not None:
+            try:
+                with self.session_factory() as db:
+                    self.after_write(db, batch)
+                    db.commit()
+            except Exception:
+                self._stats["after_write_failures"] += 1
+                logger.exception("latest values / exceedance update for %s rows failed", len(batch))
+        return []
+
+    def _bisect(self, batch: List[dict], error: BaseException) -> List[dict]:
+        """Write the halves of a rejected batch separately; quarantine single rejected rows."""
+        if len(batch) == 1:
+            self._quarantine(batch, error)
+            return []
+        mid = len(batch) // 2
+        head, tail = batch[:mid], batch[mid:]
+        unwritten = self._flush(head)
+        if unwritten:
+            return unwritten + tail     # DB went away meanwhile
+        return self._flush(tail)
+
+    # — spill —
+    def _spill_path(self, directory: Path) -> Path:
+        return directory / f"sensor_data-{time.time_ns()}-{next(self._spill_seq):06d}.jsonl"
+
+    def _spill(self, rows: List[dict]):
+        path = self._spill_path(self.spill_dir)
+        self._write_spill_file(path, rows)
+        self._stats["rows_spilled"] += len(rows)
+
+    def _quarantine(self, rows: List[dict], error: BaseException):
+        self.quarantine_dir.mkdir(parents=True, exist_ok=True)
+        path = self._spill_path(self.quarantine_dir)
+        self._write_spill_file(path, rows)
+        self._stats["rows_quarantined"] += len(rows)
+        logger.error("sensor_data rejected %s row(s), moved to %s: %s", len(rows), path, error)
+
+    def _replay_spill(self):
+        for path in sorted(self.spill_dir.glob("sensor_data-*.jsonl")):
+            rows = []
+            try:
+                with open(path, "rb") as fh:
+                    for line in fh:
+                        if not line.strip():
+                            continue
+                        r = orjson.loads(line)
+                        r["time"] = datetime.fromisoformat(r["time"])
+                        rows.append(r)
+            except (ValueError, KeyError, TypeError):
+                # unreadable file: set it aside, keep replaying the others
+                self.quarantine_dir.mkdir(parents=True, exist_ok=True)
+                os.replace(path, self.quarantine_dir / path.name)
+                logger.exception("unreadable spill file %s moved to %s", path, self.quarantine_dir)
+                continue
+            for i in range(0, len(rows), self.max_rows):
+                unwritten = self._flush(rows[i:i + self.max_rows])
+                if unwritten:
+                    # DB unavailable: keep the unflushed rows for the next attempt
+                    self._write_spill_file(path, unwritten + rows[i + self.max_rows:])
+                    return
+            self._stats["rows_replayed"] += len(rows)
+            path.unlink()
+
+    def _write_spill_file(self, path: Path, rows: List[dict]):
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as fh:
+            for r in rows:
+                fh.write(orjson.dumps(r, default=str))
+                fh.write(b"\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+
+    # — metrics —
+    def depth(self) -> int:
+        return len(self._rows)
+
+    def metrics(self) -> dict:
+        out = dict(self._stats)
+        out["queue_depth"] = self.depth()
+        out["rows_per_sec"] = round(self._rate.rate(), 1)
+        out["spill_files"] = len(list(self.spill_dir.glob("sensor_data-*.jsonl")))
+        out["db_healthy"] = self._db_healthy
+        return out
@@ -16,6 +16,7 @@ from app.api.site.site_dashboard import router as siteDashboardRouter
 from app.api.site_user.site_user_CRUD import router as siteUserRouter
 from app.api.aggrgatedData.chart import router as ChartRouter
 from app.api.realtime.realtimeData import router as realTimeRouter
+from app.api.realtime.liveStream import router as liveStreamRouter
 from app.api.site_dashboard.getCameras import router as dashCamRouter
 from app.api.site_dashboard.avg_report import router as avgReport
 from app.api.site_dashboard.site_report import router as siteReportRouter
@@ -37,6 +38,7 @@ from app.api.reportgenerator.data_availability import router as dataAvleportRout
 # from app.api.station_formula.station_formula import router as stationFormulaRouter
 from app.api.parameter.alerts_api import router as alertRouter
 from app.api.stationCalibration.station_calibration import router as stationCalibrationRouter
+from app.api.reportjobs.report_jobs import router as reportJobsRouter
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.gzip import GZipMiddleware
 
@@ -57,6 +59,7 @@ def include_routers(app):
     app.include_router(siteStatusRouter)
     app.include_router(siteReportRouter)
     app.include_router(realTimeRouter)
+    app.include_router(liveStreamRouter)
     app.include_router(dashCamRouter)
     app.include_router(ChartRouter)
     app.include_router(authRouter)
@@ -81,6 +84,7 @@ def include_routers(app):
     app.include_router(avgReport)
     app.include_router(dataAvleportRouter)
     app.include_router(stationCalibrationRouter)
+    app.include_router(reportJobsRouter)
     return
 
 def include_static_files(app):
@@ -90,6 +94,40 @@ def include_static_files(app):
     # Mount the 'uploads' directory to serve files at /uploads/
     app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+def include_background_services(app):
+    """
+    Optionally run the MQTT ingestion worker inside the API process.
+    Production runs it standalone: python -m app.ingestion.mqtt_ingest
+    """
+    if os.getenv("ENWISE_INGEST_IN_APP") != "1":
+        return
+
+    from app.ingestion.mqtt_ingest import IngestionService
+    service = IngestionService()
+
+    @app.on_event("startup")
+    async def start_ingestion():
+        await service.start()
+
+    @app.on_event("shutdown")
+    async def stop_ingestion():
+        await service.stop()
+
+def include_report_jobs(app):
+    """
+    Run background report jobs in the API process (ENWISE_REPORT_WORKERS=0
+    to leave them to a dedicated worker: python -m app.utils.report_jobs).
+    """
+    from app.utils.report_jobs import report_jobs
+
+    @app.on_event("startup")
+    async def start_report_jobs():
+        report_jobs.start()
+
+    @app.on_event("shutdown")
+    async def stop_report_jobs():
+        report_jobs.stop()
+
 def start_application():
     app = FastAPI(docs_url="/api/docs")
     
@@ -105,6 +143,8 @@ def start_application():
 
     include_routers(app)
     include_static_files(app)
+    include_background_services(app)
+    include_report_jobs(app)
     app.add_middleware(GZipMiddleware, minimum_size=512)
 
     return app
@@ -387,6 +387,45 @@ class LatestSensorData(Base):
     value = Column(Numeric(10, 2))
     time = Column(DateTime(timezone=True))
 
+class ExceedanceEvent(Base):
+    __tablename__ = "exceedance_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    site_id = Column(Integer, nullable=False)
+    station_param_id = Column(Integer, nullable=False)
+    rule = Column(String(20), nullable=False)                        # threshold | site_level
+    start_bucket = Column(DateTime(timezone=True), nullable=False)   # first exceeding 15-min bucket
+    last_bucket = Column(DateTime(timezone=True), nullable=False)    # last exceeding 15-min bucket
+    bucket_count = Column(Integer, nullable=False, default=1)
+    peak_value = Column(Float)
+    threshold = Column(Float)
+    is_open = Column(Boolean, nullable=False, default=True)
+
+class ReportJob(Base):
+    __tablename__ = "report_jobs"
+
+    id = Column(String(32), primary_key=True)                        # random token, also the result directory
+    spec_key = Column(String(64), nullable=False)                    # sha256 of kind + normalized spec
+    kind = Column(String(40), nullable=False)
+    site_id = Column(Integer)
+    scope = Column(String(120), nullable=False)                      # concurrency cap key: site:<id> | station:<name>
+    spec = Column(JSON, nullable=False)
+    submitted_by = Column(JSON, nullable=False)
+    status = Column(String(10), nullable=False, default="queued")    # queued | running | done | failed | expired
+    attempts = Column(Integer, nullable=False, default=0)
+    bytes_written = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    file_path = Column(Text)
+    file_name = Column(Text)
+    media_type = Column(String(100))
+    size = Column(Integer)
+    worker = Column(String(120))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    heartbeat_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    expires_at = Column(DateTime(timezone=True))
+
 class CalibrationHistory(Base):
     __tablename__ = "calib_history"
 
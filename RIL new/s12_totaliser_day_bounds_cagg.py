@@ -0,0 +1,81 @@
+from alembic import op
+from sqlalchemy import text
+
+# Revision identifiers
+revision = "s12_totaliser_day_bounds_cagg"
+down_revision = "s11_site_status_15min_fast_cagg"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ First / last totaliser reading per T-tag per totaliser day
+    #    (IST day starting 06:00, same as daily_totaliser_usage)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS public.totaliser_day_bounds
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket('1 day', time, 'Asia/Kolkata', "offset" => INTERVAL '6 hours') AS day,
+            site_id,
+            param_label,
+            first(value, time) AS first_value,
+            min(time)          AS first_time,
+            last(value, time)  AS last_value,
+            max(time)          AS last_time
+        FROM public.sensor_data
+        WHERE param_label ~ '^T[0-9]+$'
+        GROUP BY 1, site_id, param_label
+        WITH NO DATA;
+    """))
+
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_totaliser_day_bounds_site_label_day
+        ON public.totaliser_day_bounds (site_id, param_label, day);
+    """))
+
+    print("✔ totaliser_day_bounds continuous aggregate created")
+
+    # -------------------------------------------------------------
+    # 2️⃣ Incremental refresh: re-materialise the last few days
+    #    every 15 minutes; newer data is served in real time
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        SELECT add_continuous_aggregate_policy(
+            'public.totaliser_day_bounds',
+            start_offset      => INTERVAL '3 days',
+            end_offset        => INTERVAL '1 hour',
+            schedule_interval => INTERVAL '15 minutes',
+            if_not_exists     => TRUE
+        );
+    """))
+
+    print("✔ Refresh policy added (3 days back, every 15 minutes)")
+
+    # -------------------------------------------------------------
+    # 3️⃣ Backfill history once
+    # -------------------------------------------------------------
+    conn.execute(text("COMMIT"))
+    conn.execute(text("""
+        CALL refresh_continuous_aggregate('public.totaliser_day_bounds', NULL, now() - INTERVAL '1 hour');
+    """))
+
+    print("✔ totaliser_day_bounds backfilled")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Drop the continuous aggregate (its refresh job goes with it)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        DROP MATERIALIZED VIEW IF EXISTS public.totaliser_day_bounds CASCADE;
+    """))
+
+    print("✔ totaliser_day_bounds dropped (downgrade)")
@@ -0,0 +1,69 @@
+from alembic import op
+from sqlalchemy import text
+
+# Revision identifiers
+revision = "s13_exceedance_events"
+down_revision = "s12_totaliser_day_bounds_cagg"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Exceedance events: runs of consecutive exceeding 15-min
+    #    buckets per station parameter and rule, written at ingest
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS public.exceedance_events (
+            id               BIGSERIAL PRIMARY KEY,
+            site_id          INTEGER NOT NULL,
+            station_param_id INTEGER NOT NULL,
+            rule             VARCHAR(20) NOT NULL,
+            start_bucket     TIMESTAMPTZ NOT NULL,
+            last_bucket      TIMESTAMPTZ NOT NULL,
+            bucket_count     INTEGER NOT NULL DEFAULT 1,
+            peak_value       DOUBLE PRECISION,
+            threshold        DOUBLE PRECISION,
+            is_open          BOOLEAN NOT NULL DEFAULT TRUE
+        );
+    """))
+
+    print("✔ exceedance_events table created")
+
+    # -------------------------------------------------------------
+    # 2️⃣ Indexes: per-site / per-parameter time lookups and at most
+    #    one open event per (station parameter, rule)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_exceedance_events_site_rule_start
+        ON public.exceedance_events (site_id, rule, start_bucket);
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_exceedance_events_sp_rule_start
+        ON public.exceedance_events (station_param_id, rule, start_bucket);
+    """))
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_exceedance_events_open
+        ON public.exceedance_events (station_param_id, rule)
+        WHERE is_open;
+    """))
+
+    print("✔ exceedance_events indexes created")
+    print("✔ Backfill history with: python -m app.ingestion.exceedance_events --days 90")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Drop the events table
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        DROP TABLE IF EXISTS public.exceedance_events;
+    """))
+
+    print("✔ exceedance_events dropped (downgrade)")
@@ -0,0 +1,82 @@
+from alembic import op
+from sqlalchemy import text
+
+# Revision identifiers
+revision = "s14_availability_1day_cagg"
+down_revision = "s13_exceedance_events"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Daily reading counts per station parameter (IST days),
+    #    rolled up from the hourly sensor_stddev_1hr aggregate
+    #    (hierarchical continuous aggregate, TimescaleDB >= 2.9)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS public.sensor_availability_1day
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT
+            time_bucket('1 day', bucket_ist) AS day,
+            station_param_id,
+            SUM(n)   AS n,
+            COUNT(*) AS hours
+        FROM public.sensor_stddev_1hr
+        GROUP BY time_bucket('1 day', bucket_ist), station_param_id
+        WITH NO DATA;
+    """))
+
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_sensor_availability_1day_sp_day
+        ON public.sensor_availability_1day (station_param_id, day);
+    """))
+
+    print("✔ sensor_availability_1day continuous aggregate created")
+
+    # -------------------------------------------------------------
+    # 2️⃣ Refresh policy: closed days are materialized; the current
+    #    day is served by real-time aggregation over the hourly CAGG
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        SELECT add_continuous_aggregate_policy(
+            'public.sensor_availability_1day',
+            start_offset      => INTERVAL '4 days',
+            end_offset        => INTERVAL '1 day',
+            schedule_interval => INTERVAL '1 hour',
+            if_not_exists     => TRUE
+        );
+    """))
+
+    print("✔ Refresh policy added (every 1 hour, last 4 days)")
+
+    # -------------------------------------------------------------
+    # 3️⃣ Backfill history (bucket_ist is a local IST timestamp)
+    # -------------------------------------------------------------
+    conn.execute(text("COMMIT"))
+    conn.execute(text("""
+        CALL refresh_continuous_aggregate(
+            'public.sensor_availability_1day',
+            NULL,
+            (now() AT TIME ZONE 'Asia/Kolkata') - INTERVAL '1 day'
+        );
+    """))
+
+    print("✔ sensor_availability_1day backfilled")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Drop the daily aggregate (removes its refresh policy)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        DROP MATERIALIZED VIEW IF EXISTS public.sensor_availability_1day CASCADE;
+    """))
+
+    print("✔ sensor_availability_1day dropped (downgrade)")
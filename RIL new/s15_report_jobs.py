@@ -0,0 +1,81 @@
+from alembic import op
+from sqlalchemy import text
+
+# Revision identifiers
+revision = "s15_report_jobs"
+down_revision = "s14_availability_1day_cagg"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Background report jobs: one row per computation, shared by
+    #    every user who submits the same report spec
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS public.report_jobs (
+            id            VARCHAR(32) PRIMARY KEY,
+            spec_key      VARCHAR(64) NOT NULL,
+            kind          VARCHAR(40) NOT NULL,
+            site_id       INTEGER,
+            scope         VARCHAR(120) NOT NULL,
+            spec          JSONB NOT NULL,
+            submitted_by  JSONB NOT NULL,
+            status        VARCHAR(10) NOT NULL DEFAULT 'queued',
+            attempts      INTEGER NOT NULL DEFAULT 0,
+            bytes_written BIGINT NOT NULL DEFAULT 0,
+            error         TEXT,
+            file_path     TEXT,
+            file_name     TEXT,
+            media_type    VARCHAR(100),
+            size          BIGINT,
+            worker        VARCHAR(120),
+            created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+            started_at    TIMESTAMPTZ,
+            heartbeat_at  TIMESTAMPTZ,
+            finished_at   TIMESTAMPTZ,
+            expires_at    TIMESTAMPTZ
+        );
+    """))
+
+    print("✔ report_jobs table created")
+
+    # -------------------------------------------------------------
+    # 2️⃣ Indexes: at most one live job per spec (deduplication),
+    #    queue order and per-scope running counts for the dispatcher
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_report_jobs_spec_live
+        ON public.report_jobs (spec_key)
+        WHERE status IN ('queued', 'running', 'done');
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_report_jobs_status_created
+        ON public.report_jobs (status, created_at);
+    """))
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_report_jobs_running_scope
+        ON public.report_jobs (scope)
+        WHERE status = 'running';
+    """))
+
+    print("✔ report_jobs indexes created")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Drop the job table (result files under uploads/reports
+    #    are left for manual cleanup)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        DROP TABLE IF EXISTS public.report_jobs;
+    """))
+
+    print("✔ report_jobs dropped (downgrade)")
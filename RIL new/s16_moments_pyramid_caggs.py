@@ -0,0 +1,120 @@
+from alembic import op
+from sqlalchemy import text
+
+# Revision identifiers
+revision = "s16_moments_pyramid_caggs"
+down_revision = "s15_report_jobs"
+branch_labels = None
+depends_on = None
+
+# (view, bucket, source, refresh policy) — each level rolls up the one above,
+# keeping n / sum / sum of squares / min / max so means and standard
+# deviations re-aggregate exactly (hierarchical CAGGs, TimescaleDB >= 2.9)
+PYRAMID = [
+    ("sensor_moments_1min",  "1 minute",   None,                    ("2 days", "1 minute",   "5 minutes")),
+    ("sensor_moments_5min",  "5 minutes",  "sensor_moments_1min",   ("2 days", "5 minutes",  "5 minutes")),
+    ("sensor_moments_15min", "15 minutes", "sensor_moments_5min",   ("4 days", "15 minutes", "15 minutes")),
+    ("sensor_moments_1hr",   "1 hour",     "sensor_moments_15min",  ("4 days", "1 hour",     "30 minutes")),
+]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ 1-minute moments straight from sensor_data
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS public.sensor_moments_1min
+        WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+        SELECT
+            time_bucket('1 minute', time) AS bucket,
+            station_param_id,
+            COUNT(*)                                          AS n,
+            SUM(value::double precision)                      AS sum_x,
+            SUM(value::double precision * value::double precision) AS sum_x2,
+            MIN(value::double precision)                      AS min_value,
+            MAX(value::double precision)                      AS max_value
+        FROM public.sensor_data
+        GROUP BY time_bucket('1 minute', time), station_param_id
+        WITH NO DATA;
+    """))
+
+    print("✔ sensor_moments_1min continuous aggregate created")
+
+    # -------------------------------------------------------------
+    # 2️⃣ 5 min → 15 min → 1 hr (UTC buckets), each from the level
+    #    below; IST hours stay with sensor_stddev_1hr
+    # -------------------------------------------------------------
+    for view, bucket, source, _ in PYRAMID[1:]:
+        conn.execute(text(f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS public.{view}
+            WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+            SELECT
+                time_bucket('{bucket}', bucket) AS bucket,
+                station_param_id,
+                SUM(n)::bigint    AS n,
+                SUM(sum_x)        AS sum_x,
+                SUM(sum_x2)       AS sum_x2,
+                MIN(min_value)    AS min_value,
+                MAX(max_value)    AS max_value
+            FROM public.{source}
+            GROUP BY time_bucket('{bucket}', bucket), station_param_id
+            WITH NO DATA;
+        """))
+        print(f"✔ {view} continuous aggregate created (from {source})")
+
+    for view, _, _, _ in PYRAMID:
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_{view}_sp_bucket
+            ON public.{view} (station_param_id, bucket);
+        """))
+
+    print("✔ (station_param_id, bucket) indexes created")
+
+    # -------------------------------------------------------------
+    # 3️⃣ Refresh policies: the finer levels run first and more often,
+    #    the open tail is read from sensor_data by utils/series.py
+    # -------------------------------------------------------------
+    for view, _, _, (start_offset, end_offset, schedule) in PYRAMID:
+        conn.execute(text(f"""
+            SELECT add_continuous_aggregate_policy(
+                'public.{view}',
+                start_offset      => INTERVAL '{start_offset}',
+                end_offset        => INTERVAL '{end_offset}',
+                schedule_interval => INTERVAL '{schedule}',
+                if_not_exists     => TRUE
+            );
+        """))
+        print(f"✔ Refresh policy added for {view} (every {schedule}, last {start_offset})")
+
+    # -------------------------------------------------------------
+    # 4️⃣ Backfill history bottom-up (the 1-minute level scans
+    #    sensor_data once; everything above reads the level below)
+    # -------------------------------------------------------------
+    for view, _, _, (_, end_offset, _) in PYRAMID:
+        conn.execute(text("COMMIT"))
+        conn.execute(text(f"""
+            CALL refresh_continuous_aggregate(
+                'public.{view}',
+                NULL,
+                now() - INTERVAL '{end_offset}'
+            );
+        """))
+        print(f"✔ {view} backfilled")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Drop the pyramid top-down (removes the refresh policies)
+    # -------------------------------------------------------------
+    for view, _, _, _ in reversed(PYRAMID):
+        conn.execute(text(f"""
+            DROP MATERIALIZED VIEW IF EXISTS public.{view} CASCADE;
+        """))
+
+    print("✔ sensor_moments_* continuous aggregates dropped (downgrade)")
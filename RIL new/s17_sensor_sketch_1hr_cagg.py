@@ -0,0 +1,92 @@
+from alembic import op
+from sqlalchemy import text
+
+# Revision identifiers
+revision = "s17_sensor_sketch_1hr_cagg"
+down_revision = "s16_moments_pyramid_caggs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Hourly quantile sketch per station parameter: reading counts
+    #    per logarithmic bin (DDSketch, 1 % relative accuracy).
+    #    Bins add up across hours, so any range merges exactly.
+    #    The bin expression and filter must match utils/quantiles.py
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS public.sensor_sketch_1hr
+        WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+        SELECT
+            time_bucket('1 hour', time) AS bucket,
+            station_param_id,
+            sign(value)::smallint AS sign,
+            CASE WHEN value = 0 THEN 0
+                 ELSE ceil(ln(abs(value::double precision)) / ln(1.01::double precision / 0.99::double precision))::int
+            END AS bin,
+            COUNT(*) AS n
+        FROM public.sensor_data
+        WHERE abs(value::double precision) < 'Infinity'::double precision   -- no NULL / NaN / ±Inf
+        GROUP BY
+            time_bucket('1 hour', time),
+            station_param_id,
+            sign(value)::smallint,
+            CASE WHEN value = 0 THEN 0
+                 ELSE ceil(ln(abs(value::double precision)) / ln(1.01::double precision / 0.99::double precision))::int
+            END
+        WITH NO DATA;
+    """))
+
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_sensor_sketch_1hr_sp_bucket
+        ON public.sensor_sketch_1hr (station_param_id, bucket);
+    """))
+
+    print("✔ sensor_sketch_1hr continuous aggregate created")
+
+    # -------------------------------------------------------------
+    # 2️⃣ Refresh policy (the open hour is read from sensor_data)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        SELECT add_continuous_aggregate_policy(
+            'public.sensor_sketch_1hr',
+            start_offset      => INTERVAL '4 days',
+            end_offset        => INTERVAL '1 hour',
+            schedule_interval => INTERVAL '30 minutes',
+            if_not_exists     => TRUE
+        );
+    """))
+
+    print("✔ Refresh policy added (every 30 minutes, last 4 days)")
+
+    # -------------------------------------------------------------
+    # 3️⃣ Backfill history
+    # -------------------------------------------------------------
+    conn.execute(text("COMMIT"))
+    conn.execute(text("""
+        CALL refresh_continuous_aggregate(
+            'public.sensor_sketch_1hr',
+            NULL,
+            now() - INTERVAL '1 hour'
+        );
+    """))
+
+    print("✔ sensor_sketch_1hr backfilled")
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("COMMIT"))
+
+    # -------------------------------------------------------------
+    # 1️⃣ Drop the sketch aggregate (removes its refresh policy)
+    # -------------------------------------------------------------
+    conn.execute(text("""
+        DROP MATERIALIZED VIEW IF EXISTS public.sensor_sketch_1hr CASCADE;
+    """))
+
+    print("✔ sensor_sketch_1hr dropped (downgrade)")
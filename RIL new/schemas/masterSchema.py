@@ -2,7 +2,7 @@
 
 
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 class SiteCreation(BaseModel):
@@ -135,4 +135,8 @@ class StationCalibrationUpdate(BaseModel):
     calib_to_ist: str    # e.g., "2025-11-25 14:30:00"
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class ReportJobSubmit(BaseModel):
+    kind: str = Field(..., description="sensor_report | raw_data | raw_data_multi | klm | kld")
+    spec: Dict[str, Any] = Field(default_factory=dict)   # arguments of the report endpoint
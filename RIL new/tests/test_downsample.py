@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from app.utils.downsample import downsample_rows, lttb_indices, minmax_indices
+
+METHODS = {"minmax": minmax_indices, "lttb": lttb_indices}
+
+
+def _series(n=50_000, seed=0):
+    """One-minute noisy sine with one positive and one negative spike."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n, dtype=np.float64) * 60
+    y = np.sin(x / 86400) + rng.normal(0, 0.05, n)
+    peak, trough = n // 3, 2 * n // 3 + 17
+    y[peak] = 50.0
+    y[trough] = -40.0
+    return x, y, peak, trough
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_spikes_are_kept(method):
+    x, y, peak, trough = _series()
+    idx = METHODS[method](x, y, 1200)
+    assert len(idx) <= 1200
+    assert peak in idx and trough in idx
+    assert np.all(np.diff(idx) > 0)
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_spikes_next_to_the_ends_are_kept(method):
+    x, y, _, _ = _series(n=10_000)
+    y[1] = 99.0
+    y[-2] = -99.0
+    idx = METHODS[method](x, y, 200)
+    assert 1 in idx and len(y) - 2 in idx
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_first_and_last_points_are_kept(method):
+    x, y, _, _ = _series(n=10_000, seed=3)
+    idx = METHODS[method](x, y, 300)
+    assert idx[0] == 0
+    assert idx[-1] == len(x) - 1
+
+
+def test_lttb_returns_exactly_max_points():
+    x, y, _, _ = _series(n=10_000)
+    assert len(lttb_indices(x, y, 500)) == 500
+
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("n", [0, 1, 5, 100])
+def test_short_series_pass_through(method, n):
+    x = np.arange(n, dtype=np.float64)
+    y = np.zeros(n)
+    assert METHODS[method](x, y, 100).tolist() == list(range(n))
+
+
+def test_minmax_handles_identical_timestamps():
+    x = np.zeros(1000)
+    y = np.arange(1000, dtype=np.float64)
+    idx = minmax_indices(x, y, 10)
+    assert 0 < len(idx) <= 10
+    assert 999 in idx
+
+
+def _rows(n, spids=(1, 2)):
+    t0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(n):
+        for spid in spids:
+            value = float(i % 7)
+            if i == 3:
+                value = None
+            elif i == 4:
+                value = float("nan")
+            elif i == 777 and spid == 1:
+                value = 100.0
+            elif i == 1234 and spid == 2:
+                value = -100.0
+            rows.append((t0 + timedelta(minutes=i), spid, value))
+    return rows
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_rows_are_decimated_per_station_parameter(method):
+    out = downsample_rows(_rows(5000), 100, method)
+
+    by_spid = {}
+    for ts, spid, value in out:
+        by_spid.setdefault(spid, []).append((ts, value))
+    assert set(by_spid) == {1, 2}
+    assert all(len(points) <= 100 for points in by_spid.values())
+
+    # each parameter keeps its own spike
+    assert 100.0 in [v for _, v in by_spid[1]] and -100.0 not in [v for _, v in by_spid[1]]
+    assert -100.0 in [v for _, v in by_spid[2]] and 100.0 not in [v for _, v in by_spid[2]]
+
+    assert out == sorted(out, key=lambda r: (r[0], r[1]))
+
+
+def test_rows_without_a_finite_value_are_dropped():
+    rows = _rows(50)
+    out = downsample_rows(rows, 1000)
+    assert all(value is not None and np.isfinite(value) for _, _, value in out)
+    assert len(out) == len(rows) - 4      # i == 3 (None) and i == 4 (NaN), both parameters
+
+
+def test_short_rows_pass_through_unchanged():
+    rows = [r for r in _rows(20) if r[2] is not None and np.isfinite(r[2])]
+    assert downsample_rows(rows, 1000) == rows
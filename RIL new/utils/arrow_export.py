@@ -0,0 +1,185 @@
+"""
+Columnar (Arrow IPC stream / Parquet) output for report endpoints.
+
+Rows from a server-side cursor are collected into typed record batches —
+timestamps with time zone, float64 values, dictionary-encoded names — and
+each batch is written and sent as soon as it is full:
+
+    columns = [("time_interval", "timestamp"), ("avg_value", "float64"),
+               ("station_name", "dictionary")]
+    body = arrow_stream(rows, columns, "parquet")
+    return StreamingResponse(body, media_type=media_type("parquet"))
+
+pandas / polars load the result without parsing (`pd.read_parquet`,
+`pa.ipc.open_stream(...).read_pandas()`).  pyarrow is only imported when a
+columnar format is requested; without it those requests get a 501.
+"""
+
+from datetime import datetime
+from typing import Iterable, Iterator, List, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+from fastapi import HTTPException
+
+IST = ZoneInfo("Asia/Kolkata")
+
+BATCH_ROWS = 65536
+COMPRESSION = "zstd"
+
+FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise HTTPException(501, "Arrow / Parquet export needs pyarrow installed on the server")
+    return pyarrow
+
+
+def is_columnar(fmt: str) -> bool:
+    return fmt in FORMATS
+
+
+def check_format(fmt: str):
+    """400 on an unknown columnar format, 501 without pyarrow — call before opening a cursor."""
+    if fmt not in FORMATS:
+        raise HTTPException(400, f"Invalid format. Allowed: {', '.join(FORMATS)}")
+    _pyarrow()
+
+
+def media_type(fmt: str) -> str:
+    return FORMATS[fmt][0]
+
+
+def extension(fmt: str) -> str:
+    return FORMATS[fmt][1]
+
+
+def _arrow_type(pa, kind: str, tz: str):
+    if kind == "timestamp":
+        return pa.timestamp("us", tz=tz)
+    if kind == "float64":
+        return pa.float64()
+    if kind == "int64":
+        return pa.int64()
+    if kind == "dictionary":
+        return pa.dictionary(pa.int32(), pa.string())
+    if kind == "string":
+        return pa.string()
+    raise ValueError(f"unknown column kind {kind!r}")
+
+
+def schema(columns: Sequence[Tuple[str, str]], tz: str = "Asia/Kolkata"):
+    pa = _pyarrow()
+    return pa.schema([(name, _arrow_type(pa, kind, tz)) for name, kind in columns])
+
+
+def _array(pa, values: list, kind: str, tz: str):
+    if kind == "dictionary":
+        return pa.array(values, pa.string()).dictionary_encode()
+    if kind == "timestamp":
+        # naive timestamps in this schema (bucket_ist, ...) are IST wall time
+        values = [v.replace(tzinfo=IST) if isinstance(v, datetime) and v.tzinfo is None else v for v in values]
+    elif kind == "float64":
+        values = [float(v) if v is not None else None for v in values]
+    elif kind == "int64":
+        values = [int(v) if v is not None else None for v in values]
+    return pa.array(values, _arrow_type(pa, kind, tz))
+
+
+def record_batches(rows: Iterable[Sequence], columns: Sequence[Tuple[str, str]],
+                   batch_rows: int = BATCH_ROWS, tz: str = "Asia/Kolkata") -> Iterator:
+    """RecordBatches of `batch_rows` rows; each row is a sequence in `columns` order."""
+    pa = _pyarrow()
+    sch = schema(columns, tz)
+    buffers: List[list] = [[] for _ in columns]
+    n = 0
+
+    def _batch():
+        arrays = [_array(pa, buf, kind, tz) for buf, (_, kind) in zip(buffers, columns)]
+        return pa.RecordBatch.from_arrays(arrays, schema=sch)
+
+    for row in rows:
+        for buf, v in zip(buffers, row):
+            buf.append(v)
+        n += 1
+        if n >= batch_rows:
+            yield _batch()
+            for buf in buffers:
+                buf.clear()
+            n = 0
+    if n:
+        yield _batch()
+
+
+class _Sink:
+    """File-like object pyarrow writes into; `drain()` hands over what was written."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def arrow_stream(rows: Iterable[Sequence], columns: Sequence[Tuple[str, str]], fmt: str,
+                 batch_rows: int = BATCH_ROWS, tz: str = "Asia/Kolkata") -> Iterator[bytes]:
+    """
+    Encode `rows` as an Arrow IPC stream or a Parquet file (one row group per
+    batch), yielding bytes after the schema and after every batch.
+    """
+    check_format(fmt)
+    return _encode(_pyarrow(), rows, columns, fmt, batch_rows, tz)
+
+
+def _encode(pa, rows, columns, fmt, batch_rows, tz) -> Iterator[bytes]:
+    sch = schema(columns, tz)
+    sink = _Sink()
+    out = pa.PythonFile(sink, mode="w")
+
+    if fmt == "arrow":
+        writer = pa.ipc.new_stream(out, sch, options=pa.ipc.IpcWriteOptions(compression=COMPRESSION))
+    else:
+        writer = pa.parquet.ParquetWriter(out, sch, compression=COMPRESSION)
+
+    try:
+        data = sink.drain()
+        if data:
+            yield data
+        for batch in record_batches(rows, columns, batch_rows, tz):
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
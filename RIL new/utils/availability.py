@@ -0,0 +1,156 @@
+"""
+Data availability: readings received as a percentage of readings expected.
+
+Received readings come from the reading counts `n` of the continuous
+aggregates: whole IST days from `sensor_availability_1day` (rolled up from
+the hourly aggregate, current day in real time), the partial hours at either
+end of a window from `sensor_stddev_1hr`.  Expected readings come from each
+station parameter's `param_interval` (seconds between readings).  One query
+covers every parameter asked for, so a year for a whole site is ~365 rows
+per parameter:
+
+    counts = window_counts(db, spids, start_ist, end_ist)     # spid -> readings
+    pct = availability(counts.get(spid, 0), interval, seconds)
+    site_pct = site_availability(db, site_id, start_ist, end_ist)
+    by_site = sites_availability(db, site_ids, start_ist, end_ist)
+
+Windows are half-open [start, end) in IST; aware datetimes are converted,
+naive ones are taken as IST (as `bucket_ist` is).
+"""
+
+import math
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+
+from .topology import topology
+
+IST = ZoneInfo("Asia/Kolkata")
+
+# [start, day_start) and [day_end, end) from hours, [day_start, day_end) from days
+WINDOW_COUNTS_SQL = text("""
+    SELECT station_param_id, SUM(n) AS actual
+    FROM (
+        SELECT station_param_id, n
+        FROM sensor_availability_1day
+        WHERE station_param_id = ANY(:spids)
+          AND day >= :day_start
+          AND day <  :day_end
+        UNION ALL
+        SELECT station_param_id, n
+        FROM sensor_stddev_1hr
+        WHERE station_param_id = ANY(:spids)
+          AND ((bucket_ist >= :start_ist AND bucket_ist < :day_start)
+            OR (bucket_ist >= :day_end   AND bucket_ist < :end_ist))
+    ) c
+    GROUP BY station_param_id
+""")
+
+DAILY_COUNTS_SQL = text("""
+    SELECT station_param_id, day::date AS day, n AS actual
+    FROM sensor_availability_1day
+    WHERE station_param_id = ANY(:spids)
+      AND day >= :start_ist
+      AND day <  :end_ist
+    ORDER BY station_param_id, day
+""")
+
+
+def to_ist(ts: datetime) -> datetime:
+    """Naive IST timestamp, comparable with `bucket_ist`."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(IST).replace(tzinfo=None)
+    return ts
+
+
+def expected_readings(interval: Optional[int], seconds: float) -> int:
+    """Readings a parameter logging every `interval` seconds produces in `seconds`."""
+    if not interval or interval <= 0:
+        return 0
+    return math.ceil(seconds / float(interval))
+
+
+def availability(actual: float, interval: Optional[int], seconds: float) -> Optional[float]:
+    """Percentage (0–100, 2 decimals); None when the parameter has no interval."""
+    expected = expected_readings(interval, seconds)
+    if not expected:
+        return None
+    return round(min(max(actual / expected * 100, 0.0), 100.0), 2)
+
+
+def window_counts(db, spids: Iterable[int], start: datetime, end: datetime) -> Dict[int, int]:
+    """station_param_id -> readings received in [start, end)."""
+    spids = sorted(set(spids))
+    start, end = to_ist(start), to_ist(end)
+    if not spids or end <= start:
+        return {}
+    day_start = datetime.combine(start.date(), datetime.min.time())
+    if day_start < start:
+        day_start += timedelta(days=1)
+    day_end = datetime.combine(end.date(), datetime.min.time())
+    if day_end <= day_start:
+        # no whole day inside the window: hours only
+        day_start = day_end = end
+    rows = db.execute(WINDOW_COUNTS_SQL, {
+        "spids": spids, "start_ist": start, "end_ist": end,
+        "day_start": day_start, "day_end": day_end,
+    })
+    return {r.station_param_id: int(r.actual or 0) for r in rows}
+
+
+def daily_counts(db, spids: Iterable[int], from_date: date, to_date: date) -> Dict[int, Dict[date, int]]:
+    """station_param_id -> {IST day -> readings}, for days with data in [from_date, to_date]."""
+    spids = sorted(set(spids))
+    out: Dict[int, Dict[date, int]] = {spid: {} for spid in spids}
+    if not spids:
+        return out
+    rows = db.execute(DAILY_COUNTS_SQL, {
+        "spids": spids,
+        "start_ist": datetime.combine(from_date, datetime.min.time()),
+        "end_ist": datetime.combine(to_date + timedelta(days=1), datetime.min.time()),
+    })
+    for r in rows:
+        out[r.station_param_id][r.day] = int(r.actual or 0)
+    return out
+
+
+def site_availability(db, site_id: int, start: datetime, end: datetime,
+                      params=None) -> float:
+    """
+    Mean availability over the site's station parameters that have an
+    interval (optionally only `params`, ParamInfo from the topology).
+    """
+    if params is None:
+        topo = topology.site(db, site_id)
+        params = topo.params if topo is not None else ()
+    params = [p for p in params if p.interval and p.interval > 0]
+    if not params:
+        return 0.0
+    values = params_availability(db, params, start, end).values()
+    return round(sum(values) / len(values), 2)
+
+
+def params_availability(db, params, start: datetime, end: datetime) -> Dict[int, Optional[float]]:
+    """station_param_id -> availability over [start, end) for ParamInfo-like `params`."""
+    params = list(params)
+    seconds = (to_ist(end) - to_ist(start)).total_seconds()
+    counts = window_counts(db, (p.station_param_id for p in params), start, end)
+    return {
+        p.station_param_id: availability(counts.get(p.station_param_id, 0), p.interval, seconds)
+        for p in params
+    }
+
+
+def sites_availability(db, site_ids: Iterable[int], start: datetime, end: datetime) -> Dict[int, float]:
+    """site_id -> mean availability over [start, end), one count query for all sites."""
+    by_site = {}
+    for site_id in site_ids:
+        topo = topology.site(db, site_id)
+        by_site[site_id] = [p for p in topo.params if p.interval and p.interval > 0] if topo is not None else []
+    pct = params_availability(db, (p for ps in by_site.values() for p in ps), start, end)
+    return {
+        site_id: round(sum(pct[p.station_param_id] for p in ps) / len(ps), 2) if ps else 0.0
+        for site_id, ps in by_site.items()
+    }
@@ -0,0 +1,115 @@
+"""
+State of a continuous aggregate, read from the TimescaleDB catalog.
+
+    state = cagg_state(db, "sensor_agg_15min")   # None if unavailable
+    state.watermark        # buckets before it are materialized
+    state.closed_before    # ... and outside the refresh policy's window,
+                           # so no policy run rewrites them any more
+
+Both are aware datetimes (buckets of `timestamp` aggregates such as
+`bucket_ist` are taken as IST wall time).  Values are kept per worker for
+STATE_TTL seconds; a stale watermark is only ever earlier than the real one.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+IST = ZoneInfo("Asia/Kolkata")
+PG_EPOCH = datetime(2000, 1, 1)
+STATE_TTL = 60.0
+
+# undefined function / table / column, missing schema: the catalog query
+# cannot work on this server (TimescaleDB before 2.12, or no TimescaleDB)
+MISSING_SQLSTATES = {"42883", "42P01", "42703", "3F000"}
+
+# watermark: internal time (µs since 2000-01-01) of the materialization
+# hypertable, UTC for timestamptz buckets, wall time for timestamp buckets
+STATE_SQL = text("""
+    SELECT
+        d.column_type::regtype::text AS column_type,
+        _timescaledb_functions.cagg_watermark(h.id) AS watermark,
+        j.job_id IS NOT NULL AS has_policy,
+        (j.config ->> 'start_offset')::interval AS start_offset
+    FROM timescaledb_information.continuous_aggregates ca
+    JOIN _timescaledb_catalog.hypertable h
+      ON h.schema_name = ca.materialization_hypertable_schema
+     AND h.table_name  = ca.materialization_hypertable_name
+    JOIN _timescaledb_catalog.dimension d ON d.hypertable_id = h.id
+    LEFT JOIN timescaledb_information.jobs j
+      ON j.proc_name = 'policy_refresh_continuous_aggregate'
+     AND j.hypertable_schema = ca.materialization_hypertable_schema
+     AND j.hypertable_name   = ca.materialization_hypertable_name
+    WHERE ca.view_schema = 'public' AND ca.view_name = :view
+    LIMIT 1
+""")
+
+
+class CaggState:
+    __slots__ = ("watermark", "start_offset", "has_policy")
+
+    def __init__(self, watermark: datetime, start_offset: Optional[timedelta], has_policy: bool):
+        self.watermark = watermark
+        self.start_offset = start_offset
+        self.has_policy = has_policy
+
+    @property
+    def closed_before(self) -> Optional[datetime]:
+        if self.start_offset is None:
+            # no policy: only manual refreshes; a policy without start_offset refreshes everything
+            return None if self.has_policy else self.watermark
+        return min(self.watermark, datetime.now(timezone.utc) - self.start_offset)
+
+
+_states: Dict[str, Tuple[float, Optional[CaggState]]] = {}
+_lock = threading.Lock()
+_unavailable = False
+
+
+def _missing_catalog(error: BaseException) -> bool:
+    orig = getattr(error, "orig", None) or error
+    return (getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)) in MISSING_SQLSTATES
+
+
+def cagg_state(db, view: str) -> Optional[CaggState]:
+    global _unavailable
+    now = time.monotonic()
+    with _lock:
+        cached = _states.get(view)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    if _unavailable:
+        return None
+    try:
+        with db.begin_nested():
+            row = db.execute(STATE_SQL, {"view": view}).fetchone()
+    except Exception as error:
+        logger.exception("reading the state of continuous aggregate %s failed", view)
+        if _missing_catalog(error):
+            # e.g. TimescaleDB before 2.12 (no _timescaledb_functions): for good
+            _unavailable = True
+        else:
+            # lock timeout, connection blip: serve raw data for one TTL, then retry
+            with _lock:
+                _states[view] = (now + STATE_TTL, None)
+        return None
+
+    state = None
+    if row is not None and row.watermark is not None:
+        try:
+            watermark = PG_EPOCH + timedelta(microseconds=row.watermark)
+        except OverflowError:
+            watermark = None      # -infinity: nothing materialized yet
+        if watermark is not None:
+            watermark = watermark.replace(tzinfo=timezone.utc if row.column_type == "timestamp with time zone" else IST)
+            state = CaggState(watermark, row.start_offset, row.has_policy)
+    with _lock:
+        _states[view] = (now + STATE_TTL, state)
+    return state
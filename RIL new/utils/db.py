@@ -0,0 +1,17 @@
+from contextlib import contextmanager
+
+from ..database.session import getdb
+
+
+@contextmanager
+def db_session():
+    """
+    Session for code running outside a request (workers, listeners,
+    CLI commands) with the same lifecycle as the `getdb` dependency.
+    """
+    gen = getdb()
+    db = next(gen)
+    try:
+        yield db
+    finally:
+        gen.close()
@@ -0,0 +1,268 @@
+"""
+Exceedance lookups over `exceedance_events`, the runs of exceeding 15-minute
+buckets written at ingest by ingestion/exceedance_events:
+
+    events = site_events(db, site_id, start_utc, end_utc, RULE_THRESHOLD)
+    buckets = site_exceedances(db, site_id, start_utc, end_utc)
+    by_site = all_site_exceedances(db, start_utc, end_utc)
+    exceeding = exceeding_now(db, site_id)
+    per_day = daily_exceedance_counts(db, station_param_id, start_utc, end_utc)
+
+A bucket exceeds the threshold rule when its average is above the station
+parameter's threshold by more than 10 %:
+
+    avg_value > para_threshold * 1.10
+
+and the site_level rule when its highest reading is above the site-level
+parameter threshold.
+
+An open event counts as "exceeding now" only while its next bucket can
+still arrive: a writer that stopped (or restarted) before closing it leaves
+`is_open` set, so `exceeding_now` also requires the last bucket to be within
+OPEN_HORIZON.
+
+`site_exceedances` / `all_site_exceedances` expand the events of one site
+(or of all sites, in the same single query) into their buckets; results are
+cached per worker for one 15-minute bucket, and dropped on any topology
+message (e.g. a threshold edit).
+
+Windows the events table was not built for are rebuilt from sensor_data
+with `python -m app.ingestion.exceedance_events --days N`.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from . import pubsub
+from .latest_cache import BUCKET_SECONDS
+from .topology import CHANNEL as TOPOLOGY_CHANNEL
+
+EXCEEDANCE_FACTOR = 1.10
+
+RULE_THRESHOLD = "threshold"     # 15-min average > para_threshold * EXCEEDANCE_FACTOR
+RULE_SITE_LEVEL = "site_level"   # 15-min max > site_level_parameter_threshold
+
+CLOSE_GRACE = 120      # seconds after a bucket ends before it is classified without newer data
+SWEEP_INTERVAL = 30    # seconds between scans for such buckets
+# last bucket + the bucket after it + grace + sweep delay
+OPEN_HORIZON = timedelta(seconds=2 * 900 + CLOSE_GRACE + SWEEP_INTERVAL)
+
+SITE_EVENTS_SQL = text("""
+    SELECT id, site_id, station_param_id, rule, start_bucket, last_bucket,
+           bucket_count, peak_value, threshold, is_open
+    FROM exceedance_events
+    WHERE site_id = :site_id
+      AND rule = :rule
+      AND start_bucket <  :end_utc
+      AND last_bucket  >= :start_utc
+    ORDER BY station_param_id, start_bucket
+""")
+
+# The events' buckets inside [start_utc, end_utc), each with the value its
+# rule compared (15-min average or max) read back from sensor_data.
+EXCEEDANCE_SQL = """
+    WITH buckets AS (
+        SELECT e.site_id,
+               e.station_param_id,
+               e.threshold,
+               generate_series(
+                   GREATEST(e.start_bucket, CAST(:start_utc AS timestamptz)),
+                   LEAST(e.last_bucket, CAST(:end_utc AS timestamptz) - INTERVAL '15 minutes'),
+                   INTERVAL '15 minutes'
+               ) AS bucket
+        FROM exceedance_events e
+        WHERE e.rule = :rule
+          AND e.start_bucket <  :end_utc
+          AND e.last_bucket  >= :start_utc
+          {site_filter}
+    )
+    SELECT b.site_id, b.station_param_id, b.bucket, {agg}(sd.value) AS value, b.threshold
+    FROM buckets b
+    LEFT JOIN sensor_data sd
+           ON sd.station_param_id = b.station_param_id
+          AND sd.time >= b.bucket
+          AND sd.time <  b.bucket + INTERVAL '15 minutes'
+    GROUP BY 1, 2, 3, 5
+    ORDER BY 1, 2, 3
+"""
+EXCEEDANCE_AGG = {RULE_THRESHOLD: "AVG", RULE_SITE_LEVEL: "MAX"}
+
+OPEN_SITE_EVENTS_SQL = text("""
+    SELECT station_param_id
+    FROM exceedance_events
+    WHERE site_id = :site_id AND rule = :rule AND is_open
+      AND last_bucket >= now() - CAST(:horizon AS interval)
+""")
+
+# Exceeding buckets per IST day: the overlap of each event with the day,
+# clipped to [start_utc, end_utc), in 15-minute buckets (by bucket start).
+DAILY_COUNTS_SQL = text("""
+    WITH days AS (
+        SELECT d::date AS day,
+               GREATEST(d::date::timestamp AT TIME ZONE 'Asia/Kolkata', CAST(:start_utc AS timestamptz)) AS lo,
+               LEAST((d::date + 1)::timestamp AT TIME ZONE 'Asia/Kolkata', CAST(:end_utc AS timestamptz)) AS hi
+        FROM generate_series(
+            (CAST(:start_utc AS timestamptz) AT TIME ZONE 'Asia/Kolkata')::date::timestamp,
+            ((CAST(:end_utc AS timestamptz) - INTERVAL '1 microsecond') AT TIME ZONE 'Asia/Kolkata')::date::timestamp,
+            INTERVAL '1 day'
+        ) AS d
+    ),
+    grid AS (
+        -- first and last 15-minute bucket starting inside the clipped day
+        SELECT day,
+               to_timestamp(ceil(EXTRACT(EPOCH FROM lo) / 900) * 900) AS first_bucket,
+               to_timestamp((ceil(EXTRACT(EPOCH FROM hi) / 900) - 1) * 900) AS last_bucket
+        FROM days
+    )
+    SELECT
+        grid.day,
+        COALESCE(SUM(GREATEST(
+            FLOOR(EXTRACT(EPOCH FROM (
+                LEAST(e.last_bucket, grid.last_bucket) - GREATEST(e.start_bucket, grid.first_bucket)
+            )) / 900) + 1,
+            0
+        )), 0)::int AS exceed_count
+    FROM grid
+    LEFT JOIN exceedance_events e
+           ON e.station_param_id = :station_param_id
+          AND e.rule = :rule
+          AND e.start_bucket <= grid.last_bucket
+          AND e.last_bucket  >= grid.first_bucket
+    GROUP BY grid.day
+    ORDER BY grid.day
+""")
+
+
+def site_events(db, site_id: int, start_utc: datetime, end_utc: datetime,
+                rule: str = RULE_THRESHOLD) -> list:
+    """Events of one site overlapping [start_utc, end_utc), by parameter then start."""
+    return db.execute(SITE_EVENTS_SQL, {
+        "site_id": site_id, "rule": rule, "start_utc": start_utc, "end_utc": end_utc,
+    }).fetchall()
+
+
+class Exceedance(NamedTuple):
+    site_id: int
+    station_param_id: int
+    bucket: datetime
+    value: Optional[float]
+    threshold: float
+
+
+class ExceedanceCache:
+    """
+    Bucket lists keyed by (site or None, rule, window), valid for one 15-min
+    bucket.  The bucket is counted from CLOSE_GRACE + SWEEP_INTERVAL after its
+    start, when the bucket before it has been classified.
+    """
+
+    def __init__(self):
+        self._bucket: Optional[int] = None
+        self._entries: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        self._subscribed = False
+
+    @staticmethod
+    def _epoch() -> int:
+        now = int(time.time()) - CLOSE_GRACE - SWEEP_INTERVAL
+        return now - now % BUCKET_SECONDS
+
+    def get(self, key: tuple):
+        self._ensure_subscribed()
+        bucket = self._epoch()
+        with self._lock:
+            if self._bucket != bucket:
+                self._bucket = bucket
+                self._entries.clear()
+            return self._entries.get(key)
+
+    def put(self, key: tuple, value):
+        with self._lock:
+            if self._bucket == self._epoch():
+                self._entries[key] = value
+
+    def clear(self, _msg: Optional[dict] = None):
+        with self._lock:
+            self._entries.clear()
+
+    def _ensure_subscribed(self):
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        pubsub.subscribe(TOPOLOGY_CHANNEL, self.clear)
+
+
+_cache = ExceedanceCache()
+
+
+def _exceedances(db, site_id: Optional[int], start_utc: datetime, end_utc: datetime,
+                 rule: str) -> List[Exceedance]:
+    sql = EXCEEDANCE_SQL.format(
+        site_filter="AND e.site_id = :site_id" if site_id is not None else "",
+        agg=EXCEEDANCE_AGG[rule],
+    )
+    return [
+        Exceedance(r.site_id, r.station_param_id, r.bucket,
+                   float(r.value) if r.value is not None else None, r.threshold)
+        for r in db.execute(text(sql), {
+            "site_id": site_id, "rule": rule, "start_utc": start_utc, "end_utc": end_utc,
+        })
+    ]
+
+
+def site_exceedances(db, site_id: int, start_utc: datetime, end_utc: datetime,
+                     rule: str = RULE_THRESHOLD) -> List[Exceedance]:
+    """Exceeding buckets of one site starting in [start_utc, end_utc), by parameter then time."""
+    key = (site_id, rule, start_utc, end_utc)
+    hit = _cache.get(key)
+    if hit is not None:
+        return hit
+    rows = _exceedances(db, site_id, start_utc, end_utc, rule)
+    _cache.put(key, rows)
+    return rows
+
+
+def all_site_exceedances(db, start_utc: datetime, end_utc: datetime,
+                         rule: str = RULE_THRESHOLD) -> Dict[int, List[Exceedance]]:
+    """Exceeding buckets of every site starting in [start_utc, end_utc), grouped by site."""
+    key = (None, rule, start_utc, end_utc)
+    hit = _cache.get(key)
+    if hit is not None:
+        return hit
+    by_site: Dict[int, List[Exceedance]] = defaultdict(list)
+    for row in _exceedances(db, None, start_utc, end_utc, rule):
+        by_site[row.site_id].append(row)
+    by_site = dict(by_site)
+    _cache.put(key, by_site)
+    return by_site
+
+
+def exceeding_now(db, site_id: int, rule: str = RULE_THRESHOLD) -> set:
+    """station_param_ids of the site whose latest classified bucket exceeds and is still reporting."""
+    return {
+        r.station_param_id
+        for r in db.execute(OPEN_SITE_EVENTS_SQL, {"site_id": site_id, "rule": rule, "horizon": OPEN_HORIZON})
+    }
+
+
+def daily_exceedance_counts(db, station_param_id: int, start_utc: datetime, end_utc: datetime,
+                            rule: str = RULE_THRESHOLD) -> Dict[date, int]:
+    """
+    IST day -> number of exceeding 15-min buckets starting in [start_utc,
+    end_utc), for every day the range touches.
+    """
+    return {
+        r.day: r.exceed_count
+        for r in db.execute(DAILY_COUNTS_SQL, {
+            "station_param_id": station_param_id, "rule": rule,
+            "start_utc": start_utc, "end_utc": end_utc,
+        })
+    }
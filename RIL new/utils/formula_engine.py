@@ -0,0 +1,328 @@
+"""
+Safe compiled expressions for water-balance / plant formulas.
+
+Replaces the `re.sub` + `eval` evaluators.  A formula is parsed once, checked
+against an AST whitelist (numbers, + - * / // % **, unary +/-, parentheses,
+abs/min/max/round), its references are mapped to slots and the result is
+compiled to a plain Python function `f(v)` taking the value vector.  Compiled
+formulas and tables are cached by content hash.
+
+References may be ordinary identifiers (`T12`, `F84`), tag-style names with a
+dash (`T-5`, which Python would read as a subtraction) or, in tables, labels
+with spaces (`Fresh Water`) and section-scoped labels (`Domestic.Fresh
+Water`); those are swapped for slot identifiers before parsing.
+
+    compile_formula("(T1 + T2) * 0.5").evaluate({"T1": 10, "T2": 20})   -> 15.0
+    compile_table(table_formulae).evaluate(param_map)                   -> {section: {label: value}}
+
+Table cells are evaluated as a dependency DAG in topological order, so a cell
+may reference cells defined after it; cells on a cycle evaluate to the error
+value.  Values may also be numpy arrays, in which case a formula is evaluated
+element-wise for all of them in one call.
+"""
+
+import ast
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+CACHE_SIZE = 4096
+
+# Totaliser / flow tags as used in DashboardPageFormulas and StationFormula
+TAG_RE = re.compile(r"\b[FT]-?\d+\b")
+
+_ALLOWED_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_ALLOWED_UNARYOPS = (ast.UAdd, ast.USub)
+_FUNCS = {"abs": abs, "min": min, "max": max, "round": round}
+
+_MISSING = object()
+
+
+class FormulaError(ValueError):
+    """Formula is not a valid arithmetic expression."""
+
+
+class MissingValue(KeyError):
+    """A referenced name has no value."""
+
+
+def _digest(*parts: str) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class _LRU:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_formula_cache = _LRU(CACHE_SIZE)
+_table_cache = _LRU(CACHE_SIZE)
+
+
+# ─── Compilation ─────────────────────────────────────────────────────
+class _SlotRewriter(ast.NodeTransformer):
+    """Validates the tree and turns every Name into `v[i]`."""
+
+    def __init__(self, slot_names: Dict[str, str]):
+        self.slot_names = slot_names   # placeholder identifier -> reference name
+        self.names: List[str] = []
+        self._index: Dict[str, int] = {}
+
+    def _slot(self, name: str) -> int:
+        if name not in self._index:
+            self._index[name] = len(self.names)
+            self.names.append(name)
+        return self._index[name]
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _ALLOWED_BINOPS):
+            raise FormulaError(f"operator {type(node.op).__name__} not allowed")
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, _ALLOWED_UNARYOPS):
+            raise FormulaError(f"operator {type(node.op).__name__} not allowed")
+        node.operand = self.visit(node.operand)
+        return node
+
+    def visit_Constant(self, node):
+        if type(node.value) not in (int, float):
+            raise FormulaError("only numeric constants are allowed")
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCS or node.keywords:
+            raise FormulaError("only abs/min/max/round calls are allowed")
+        node.args = [self.visit(a) for a in node.args]
+        return node
+
+    def visit_Name(self, node):
+        name = self.slot_names.get(node.id, node.id)
+        idx = self._slot(name)
+        return ast.copy_location(
+            ast.Subscript(
+                value=ast.Name(id="v", ctx=ast.Load()),
+                slice=ast.Constant(value=idx),
+                ctx=ast.Load(),
+            ),
+            node,
+        )
+
+    def generic_visit(self, node):
+        raise FormulaError(f"{type(node).__name__} not allowed in formulas")
+
+
+def _substitute_names(expr: str, names: Iterable[str]) -> Tuple[str, Dict[str, str]]:
+    """Swap references that are not Python identifiers for slot placeholders."""
+    special = sorted(
+        {n for n in names if n and not n.isidentifier()} | {t for t in TAG_RE.findall(expr) if "-" in t},
+        key=len,
+        reverse=True,
+    )
+    if not special:
+        return expr, {}
+    placeholders = {n: f"__ref{i}__" for i, n in enumerate(special)}
+    pattern = re.compile("|".join(rf"(?<![\w.]){re.escape(n)}(?!\w)" for n in special))
+    rewritten = pattern.sub(lambda m: placeholders[m.group(0)], expr)
+    return rewritten, {ph: name for name, ph in placeholders.items()}
+
+
+class CompiledFormula:
+    __slots__ = ("source", "names", "fn")
+
+    def __init__(self, source: str, names: Tuple[str, ...], fn):
+        self.source = source
+        self.names = names
+        self.fn = fn
+
+    def vector(self, values: Mapping[str, Any], default: Any = _MISSING) -> list:
+        v = []
+        for name in self.names:
+            x = values.get(name, default)
+            if x is _MISSING:
+                raise MissingValue(name)
+            v.append(0.0 if x is None else x)
+        return v
+
+    def evaluate(self, values: Mapping[str, Any], default: Any = _MISSING):
+        """Evaluate against `values`; a missing name raises MissingValue unless `default` is given."""
+        return self.fn(self.vector(values, default))
+
+
+def compile_formula(expr: str, names: Iterable[str] = ()) -> CompiledFormula:
+    """
+    Compile `expr` once (cached by hash).  `names` lists references that are
+    not plain identifiers (labels with spaces, `Section.Label`).
+    """
+    names = tuple(sorted(set(names)))
+    key = _digest(expr, *names)
+    cached = _formula_cache.get(key)
+    if cached is not None:
+        return cached
+
+    rewritten, slot_names = _substitute_names(expr, names)
+    try:
+        tree = ast.parse(rewritten.strip(), mode="eval")
+    except SyntaxError as e:
+        raise FormulaError(f"invalid formula {expr!r}: {e.msg}") from None
+    rewriter = _SlotRewriter(slot_names)
+    body = rewriter.visit(tree).body
+
+    lam = ast.Expression(body=ast.Lambda(
+        args=ast.arguments(
+            posonlyargs=[], args=[ast.arg(arg="v")], vararg=None,
+            kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[],
+        ),
+        body=body,
+    ))
+    ast.fix_missing_locations(lam)
+    fn = eval(compile(lam, "<formula>", "eval"), {"__builtins__": {}, **_FUNCS})
+
+    compiled = CompiledFormula(expr, tuple(rewriter.names), fn)
+    _formula_cache.put(key, compiled)
+    return compiled
+
+
+def evaluate(expr: str, values: Mapping[str, Any], default: Any = _MISSING):
+    return compile_formula(expr).evaluate(values, default)
+
+
+# ─── Tables (Section.Label DAG) ──────────────────────────────────────
+class CompiledTable:
+    """
+    `{section: {label: formula}}` compiled into cells evaluated in
+    topological order.  Inside a formula, `Section.Label` refers to any cell
+    and a bare `Label` to a cell of the same section; every other name is a
+    parameter looked up in the value map.
+    """
+
+    def __init__(self, table: Dict[str, Dict[str, Any]]):
+        self.cells: List[Tuple[str, str]] = []
+        cell_index: Dict[Tuple[str, str], int] = {}
+        for section, columns in table.items():
+            for label in columns:
+                cell_index[(section, label)] = len(self.cells)
+                self.cells.append((section, label))
+
+        self._formulas: List[Optional[CompiledFormula]] = []
+        # per cell: list of ("cell", idx) | ("param", name) in slot order
+        self._sources: List[list] = []
+        deps: List[set] = []
+        for section, columns in table.items():
+            scoped = {f"{s}.{l}": i for (s, l), i in cell_index.items()}
+            local = {l: cell_index[(section, l)] for l in columns}
+            for label, expr in columns.items():
+                if not expr or not isinstance(expr, str):
+                    self._formulas.append(None)
+                    self._sources.append([])
+                    deps.append(set())
+                    continue
+                try:
+                    compiled = compile_formula(expr, list(scoped) + list(local))
+                except FormulaError:
+                    compiled = None
+                sources, cell_deps = [], set()
+                for name in compiled.names if compiled else ():
+                    if name in scoped:
+                        sources.append(("cell", scoped[name]))
+                        cell_deps.add(scoped[name])
+                    elif name in local:
+                        sources.append(("cell", local[name]))
+                        cell_deps.add(local[name])
+                    else:
+                        sources.append(("param", name))
+                self._formulas.append(compiled)
+                self._sources.append(sources)
+                deps.append(cell_deps)
+
+        self.order, self.cyclic = _toposort(len(self.cells), deps)
+
+    def evaluate(self, params: Mapping[str, Any], ndigits: Optional[int] = 2,
+                 on_error: Any = 0.0) -> Dict[str, Dict[str, Any]]:
+        values: List[Any] = [on_error] * len(self.cells)
+        for idx in self.order:
+            compiled = self._formulas[idx]
+            if compiled is None:
+                values[idx] = 0.0
+                continue
+            try:
+                v = []
+                for kind, ref in self._sources[idx]:
+                    if kind == "cell":
+                        v.append(values[ref])
+                    else:
+                        x = params.get(ref, _MISSING)
+                        if x is _MISSING:
+                            raise MissingValue(ref)
+                        v.append(0.0 if x is None else x)
+                out = compiled.fn(v)
+                values[idx] = round(out, ndigits) if ndigits is not None else float(out)
+            except Exception:
+                values[idx] = on_error
+
+        result = defaultdict(dict)
+        for (section, label), value in zip(self.cells, values):
+            result[section][label] = value
+        return result
+
+
+def _toposort(n: int, deps: List[set]) -> Tuple[List[int], set]:
+    """Kahn's algorithm, ties broken by definition order; returns (order, cyclic)."""
+    dependents = defaultdict(list)
+    indegree = [0] * n
+    for node, ds in enumerate(deps):
+        for d in ds:
+            if d == node:
+                continue
+            dependents[d].append(node)
+            indegree[node] += 1
+    ready = [i for i in range(n) if indegree[i] == 0 and i not in deps[i]]
+    order: List[int] = []
+    while ready:
+        ready.sort(reverse=True)
+        node = ready.pop()
+        order.append(node)
+        for m in dependents[node]:
+            indegree[m] -= 1
+            if indegree[m] == 0 and m not in deps[m]:
+                ready.append(m)
+    cyclic = set(range(n)) - set(order)
+    return order, cyclic
+
+
+def compile_table(table: Dict[str, Dict[str, Any]]) -> CompiledTable:
+    key = _digest(json.dumps(table, sort_keys=True, default=str))
+    cached = _table_cache.get(key)
+    if cached is None:
+        cached = CompiledTable(table)
+        _table_cache.put(key, cached)
+    return cached
@@ -0,0 +1,264 @@
+"""
+Per-worker hot cache of the latest readings.
+
+    site_id -> station_param_id -> [value, time, bucket, bucket_sum, bucket_n]
+
+`bucket*` is the running sum/count of the 15-minute bucket holding the latest
+reading, so the "current 15-min average" (site_status_15min) is answered
+from memory as well.
+
+Feeding: every sensor_data flush calls `publish_readings()` in its write
+transaction; the rows go out on the `latest_values` channel (utils/pubsub,
+LISTEN/NOTIFY or the local stand-in) once committed and every worker applies
+them to the sites it holds.
+
+Bounds and fallback:
+    LATEST_CACHE_MAX_SITES         LRU of sites kept per worker
+    LATEST_CACHE_MAX_PARAMS        sites with more parameters are not kept
+                                   (always read from the DB)
+    LATEST_CACHE_MAX_AGE           seconds before a site is re-read from
+                                   latest_sensor_data, in case a notification
+                                   was lost
+A listener reconnect (`{"all": True}`) drops everything.
+
+Notifications for a site that arrive while it is being loaded are buffered
+and replayed onto the loaded entry before it is cached; batches whose newest
+reading is already in the loaded bucket sum are skipped.
+
+Names, units and thresholds used next to the values come from the site's
+topology snapshot (utils/topology).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from . import pubsub
+
+CHANNEL = "latest_values"
+MAX_SITES = int(os.getenv("LATEST_CACHE_MAX_SITES", "500"))
+MAX_PARAMS_PER_SITE = int(os.getenv("LATEST_CACHE_MAX_PARAMS", "2000"))
+MAX_AGE = float(os.getenv("LATEST_CACHE_MAX_AGE", "300"))
+
+BUCKET_SECONDS = 900         # IST is UTC+05:30, so 15-min buckets align in both
+NOTIFY_PAYLOAD_LIMIT = 7500  # pg_notify payloads must stay under 8000 bytes
+
+VALUE, TIME, BUCKET, BSUM, BN = range(5)
+
+LOAD_SITE_SQL = text("""
+    SELECT
+        l.station_param_id,
+        l.value,
+        l.time,
+        c.bsum,
+        c.bn,
+        c.btime
+    FROM latest_sensor_data l
+    LEFT JOIN (
+        SELECT station_param_id, SUM(value) AS bsum, COUNT(*) AS bn, MAX(time) AS btime
+        FROM sensor_data
+        WHERE site_id = :site_id
+          AND time >= :bucket_start
+        GROUP BY station_param_id
+    ) c ON c.station_param_id = l.station_param_id
+    WHERE l.site_id = :site_id
+""")
+
+
+def bucket_of(ts: datetime) -> int:
+    epoch = int(ts.timestamp())
+    return epoch - epoch % BUCKET_SECONDS
+
+
+def current_bucket() -> int:
+    now = int(time.time())
+    return now - now % BUCKET_SECONDS
+
+
+class SiteLatest:
+    __slots__ = ("site_id", "values", "loaded_at")
+
+    def __init__(self, site_id: int):
+        self.site_id = site_id
+        self.values: Dict[int, list] = {}
+        self.loaded_at = time.monotonic()
+
+    def latest(self, spid: int):
+        """(value, time) of the newest reading, or None."""
+        e = self.values.get(spid)
+        return (e[VALUE], e[TIME]) if e else None
+
+    def bucket_avg(self, spid: int, bucket: Optional[int] = None) -> Optional[float]:
+        """Average of `bucket` (default: the current 15-min bucket), None if empty."""
+        e = self.values.get(spid)
+        bucket = current_bucket() if bucket is None else bucket
+        if not e or e[BUCKET] != bucket or not e[BN]:
+            return None
+        return e[BSUM] / e[BN]
+
+
+class LatestCache:
+
+    def __init__(self, max_sites: int = MAX_SITES, max_params: int = MAX_PARAMS_PER_SITE,
+                 max_age: float = MAX_AGE):
+        self.max_sites = max_sites
+        self.max_params = max_params
+        self.max_age = max_age
+        self._sites: "OrderedDict[int, SiteLatest]" = OrderedDict()
+        self._loading: Dict[int, List[list]] = {}   # site_id -> buffers of in-flight loads
+        self._lock = threading.Lock()
+        self._subscribed = False
+        self.hits = 0
+        self.misses = 0
+
+    # — reads —
+    def site(self, db, site_id: int) -> SiteLatest:
+        self._ensure_subscribed()
+        with self._lock:
+            entry = self._sites.get(site_id)
+            if entry is not None and time.monotonic() - entry.loaded_at < self.max_age:
+                self._sites.move_to_end(site_id)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        buffer = []
+        with self._lock:
+            self._loading.setdefault(site_id, []).append(buffer)
+        try:
+            entry, counted = self._load(db, site_id)
+        finally:
+            with self._lock:
+                buffers = self._loading[site_id]
+                buffers.remove(buffer)
+                if not buffers:
+                    del self._loading[site_id]
+        with self._lock:
+            keep = len(entry.values) <= self.max_params and None not in buffer
+            for rows in buffer:
+                if not keep:
+                    break
+                keep = self._apply_rows(entry, [
+                    row for row in rows if row[2] > counted.get(row[0], float("-inf"))
+                ])
+            if keep:
+                self._sites[site_id] = entry
+                self._sites.move_to_end(site_id)
+                while len(self._sites) > self.max_sites:
+                    self._sites.popitem(last=False)
+        return entry
+
+    def _load(self, db, site_id: int):
+        """(entry, {station_param_id: epoch of the newest reading in its bucket sum})."""
+        bucket = current_bucket()
+        entry = SiteLatest(site_id)
+        counted: Dict[int, float] = {}
+        rows = db.execute(LOAD_SITE_SQL, {
+            "site_id": site_id,
+            "bucket_start": datetime.fromtimestamp(bucket, timezone.utc),
+        }).fetchall()
+        for r in rows:
+            if r.value is None:
+                continue
+            has_bucket = bool(r.bn)
+            entry.values[r.station_param_id] = [
+                float(r.value),
+                r.time.astimezone(timezone.utc),
+                bucket if has_bucket else None,
+                float(r.bsum) if has_bucket else 0.0,
+                int(r.bn) if has_bucket else 0,
+            ]
+            if has_bucket:
+                counted[r.station_param_id] = r.btime.timestamp()
+        return entry, counted
+
+    # — updates —
+    def _ensure_subscribed(self):
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        pubsub.subscribe(CHANNEL, self.apply)
+
+    def apply(self, msg: dict):
+        if msg.get("all"):
+            with self._lock:
+                self._sites.clear()
+                for buffers in self._loading.values():
+                    for buffer in buffers:
+                        buffer.append(None)
+            return
+        site_id = msg.get("site_id")
+        rows = msg.get("rows") or ()
+        with self._lock:
+            for buffer in self._loading.get(site_id, ()):
+                buffer.append(rows)
+            entry = self._sites.get(site_id)
+            if entry is not None and not self._apply_rows(entry, rows):
+                del self._sites[site_id]
+
+    def _apply_rows(self, entry: SiteLatest, rows) -> bool:
+        """Fold notified rows into `entry` (lock held); False once it outgrows max_params."""
+        for spid, value, t, bucket, bsum, bn in rows:
+            ts = datetime.fromtimestamp(t, timezone.utc)
+            e = entry.values.get(spid)
+            if e is None:
+                if len(entry.values) >= self.max_params:
+                    return False
+                entry.values[spid] = [value, ts, bucket, bsum, bn]
+                continue
+            if ts >= e[TIME]:
+                e[VALUE], e[TIME] = value, ts
+            if e[BUCKET] == bucket:
+                e[BSUM] += bsum
+                e[BN] += bn
+            elif e[BUCKET] is None or bucket > e[BUCKET]:
+                e[BUCKET], e[BSUM], e[BN] = bucket, bsum, bn
+        return True
+
+
+def publish_readings(db, rows: List[dict]):
+    """
+    Announce a batch of sensor_data rows (call inside the after-write transaction).
+    Per site and parameter: the newest reading plus the sum/count of that
+    reading's 15-min bucket within the batch.
+    """
+    per_site: Dict[int, Dict[int, list]] = defaultdict(dict)
+    for r in rows:
+        spid = r["station_param_id"]
+        value = float(r["value"])
+        t = r["time"].timestamp()
+        bucket = bucket_of(r["time"])
+        e = per_site[r["site_id"]].get(spid)
+        if e is None:
+            per_site[r["site_id"]][spid] = [spid, value, t, bucket, value, 1]
+            continue
+        if t >= e[2]:
+            e[1], e[2] = value, t
+        if bucket == e[3]:
+            e[4] += value
+            e[5] += 1
+        elif bucket > e[3]:
+            e[3], e[4], e[5] = bucket, value, 1
+
+    for site_id, items in per_site.items():
+        chunk, size = [], 0
+        for item in items.values():
+            item_size = len(json.dumps(item)) + 1
+            if chunk and size + item_size > NOTIFY_PAYLOAD_LIMIT:
+                pubsub.publish(db, CHANNEL, {"site_id": site_id, "rows": chunk})
+                chunk, size = [], 0
+            chunk.append(item)
+            size += item_size
+        if chunk:
+            pubsub.publish(db, CHANNEL, {"site_id": site_id, "rows": chunk})
+
+
+latest_cache = LatestCache()
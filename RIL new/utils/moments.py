@@ -0,0 +1,183 @@
+"""
+Mergeable moments (n, Σx, Σx²) of sensor readings: exact means and standard
+deviations over any window without re-reading raw data.
+
+    m = window_moments(db, spids, start, end, by_day=True)
+    m.n, m.mean, m.stddev          # float arrays aligned with m.keys
+    m.get((spid, day))             # (n, mean, stddev) or None
+
+`Moments` keeps one (n, Σx, Σx²) triple per group in three float64 arrays.
+Rows from different sources (CAGG buckets, raw tails) are scattered into
+their groups with `np.add.at`, and two Moments merge by adding the arrays.
+Sums add exactly where averaging averages or standard deviations does not.
+
+`window_moments` reads [start, end) in one query: whole buckets from the
+coarsest aggregate that has them materialized (sensor_stddev_1hr IST hours,
+then sensor_moments_15min / 5min / 1min), the edges and the open tail from
+sensor_data.  Groups are station parameters, or (station parameter, IST
+date) with `by_day=True`.
+"""
+
+from datetime import datetime, timedelta
+from typing import Hashable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from .cagg import cagg_state
+from .series import IST_ORIGIN, UTC_ORIGIN, as_ist, ceil_bucket, floor_bucket
+
+
+class Moments:
+    __slots__ = ("keys", "index", "n", "sum_x", "sum_x2")
+
+    def __init__(self, keys: Iterable[Hashable] = ()):
+        self.keys: List[Hashable] = list(dict.fromkeys(keys))
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        self.n = np.zeros(len(self.keys))
+        self.sum_x = np.zeros(len(self.keys))
+        self.sum_x2 = np.zeros(len(self.keys))
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence]) -> "Moments":
+        """Rows (key, n, Σx, Σx²); several rows of a key add up."""
+        rows = list(rows)
+        m = cls(r[0] for r in rows)
+        if rows:
+            idx = np.fromiter((m.index[r[0]] for r in rows), dtype=np.intp, count=len(rows))
+            data = np.nan_to_num(np.array([r[1:4] for r in rows], dtype=np.float64))
+            m.add_at(idx, data[:, 0], data[:, 1], data[:, 2])
+        return m
+
+    def add_at(self, idx, n, sum_x, sum_x2):
+        """Scatter-add moments into groups `idx` (repeated indexes accumulate)."""
+        np.add.at(self.n, idx, n)
+        np.add.at(self.sum_x, idx, sum_x)
+        np.add.at(self.sum_x2, idx, sum_x2)
+
+    def merge(self, other: "Moments") -> "Moments":
+        out = Moments(self.keys + other.keys)
+        for m in (self, other):
+            if m.keys:
+                idx = np.fromiter((out.index[k] for k in m.keys), dtype=np.intp, count=len(m.keys))
+                out.add_at(idx, m.n, m.sum_x, m.sum_x2)
+        return out
+
+    __add__ = merge
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.n > 0, self.sum_x / self.n, np.nan)
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Population variance (as STDDEV_POP), NaN for empty groups."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var = (self.sum_x2 - self.sum_x * self.sum_x / self.n) / self.n
+        return np.where(self.n > 0, np.maximum(var, 0.0), np.nan)
+
+    @property
+    def stddev(self) -> np.ndarray:
+        return np.sqrt(self.variance)
+
+    def get(self, key: Hashable) -> Optional[Tuple[int, float, float]]:
+        i = self.index.get(key)
+        if i is None:
+            return None
+        return int(self.n[i]), float(self.mean[i]), float(self.stddev[i])
+
+
+class _Source(NamedTuple):
+    view: str
+    width: timedelta
+    origin: datetime
+    day: str        # IST date of a bucket
+    sql: str
+
+
+def _moments_source(view: str, width: timedelta) -> _Source:
+    return _Source(view, width, UTC_ORIGIN, "(bucket AT TIME ZONE 'Asia/Kolkata')::date", f"""
+        SELECT station_param_id, {{day}} AS day,
+               SUM(n)::double precision AS n, SUM(sum_x) AS sum_x, SUM(sum_x2) AS sum_x2
+        FROM {view}
+        WHERE station_param_id = ANY(:spids)
+          AND bucket >= :{{p}}start AND bucket < :{{p}}end
+        GROUP BY 1, 2""")
+
+
+# {p}: prefix of the segment's :start / :end parameters, {day}: group date or NULL
+SOURCES = (
+    _Source("sensor_stddev_1hr", timedelta(hours=1), IST_ORIGIN, "bucket_ist::date", """
+        SELECT station_param_id, {day} AS day,
+               SUM(n)::double precision AS n, SUM(sum_x)::double precision AS sum_x,
+               SUM(sum_x2)::double precision AS sum_x2
+        FROM sensor_stddev_1hr
+        WHERE station_param_id = ANY(:spids)
+          AND bucket_ist >= (CAST(:{p}start AS timestamptz) AT TIME ZONE 'Asia/Kolkata')
+          AND bucket_ist <  (CAST(:{p}end AS timestamptz) AT TIME ZONE 'Asia/Kolkata')
+        GROUP BY 1, 2"""),
+    _moments_source("sensor_moments_15min", timedelta(minutes=15)),
+    _moments_source("sensor_moments_5min", timedelta(minutes=5)),
+    _moments_source("sensor_moments_1min", timedelta(minutes=1)),
+)
+
+RAW = _Source("sensor_data", timedelta(0), UTC_ORIGIN, "(time AT TIME ZONE 'Asia/Kolkata')::date", """
+        SELECT station_param_id, {day} AS day,
+               COUNT(*)::double precision AS n,
+               SUM(value::double precision) AS sum_x,
+               SUM(value::double precision * value::double precision) AS sum_x2
+        FROM sensor_data
+        WHERE station_param_id = ANY(:spids)
+          AND time >= :{p}start AND time < :{p}end
+        GROUP BY 1, 2""")
+
+DAY = timedelta(days=1)
+
+
+def _fill(db, lo: datetime, hi: datetime, sources: Sequence[_Source]) -> List[Tuple[_Source, datetime, datetime]]:
+    """Cover [lo, hi): the first source's materialized whole buckets, the gaps around them by the rest."""
+    if lo >= hi:
+        return []
+    if not sources:
+        return [(RAW, lo, hi)]
+    source, rest = sources[0], sources[1:]
+    state = cagg_state(db, source.view)
+    if state is not None:
+        a = ceil_bucket(lo, source.width, source.origin)
+        b = floor_bucket(min(hi, state.watermark), source.width, source.origin)
+        if a < b:
+            return _fill(db, lo, a, rest) + [(source, a, b)] + _fill(db, b, hi, rest)
+    return _fill(db, lo, hi, rest)
+
+
+def window_moments(db, station_param_ids: Sequence[int], start: datetime, end: datetime,
+                   *, by_day: bool = False) -> Moments:
+    """
+    Moments of the readings in [start, end) per station parameter, or per
+    (station parameter, IST date) with `by_day`.  Naive datetimes are IST.
+    """
+    start, end = as_ist(start), as_ist(end)
+    if not station_param_ids or start >= end:
+        return Moments()
+
+    # a source bucket must not straddle a day boundary when grouping by day
+    sources = [
+        s for s in SOURCES
+        if not by_day or (DAY % s.width == timedelta(0) and (IST_ORIGIN - s.origin) % s.width == timedelta(0))
+    ]
+    params = {"spids": list(station_param_ids)}
+    parts = []
+    for i, (source, lo, hi) in enumerate(_fill(db, start, end, sources)):
+        prefix = f"s{i}_"
+        params[prefix + "start"] = lo
+        params[prefix + "end"] = hi
+        parts.append(source.sql.replace("{p}", prefix).replace("{day}", source.day if by_day else "NULL::date"))
+
+    rows = db.execute(text("\n        UNION ALL".join(parts)), params).fetchall()
+    if by_day:
+        return Moments.from_rows(((r.station_param_id, r.day), r.n, r.sum_x, r.sum_x2) for r in rows)
+    return Moments.from_rows((r.station_param_id, r.n, r.sum_x, r.sum_x2) for r in rows)
@@ -0,0 +1,149 @@
+"""
+Cross-process invalidation / fan-out messages.
+
+    publish(db, "resolution_index", {"station_ids": [12]})
+    subscribe("resolution_index", callback)
+
+Backends (ENWISE_PUBSUB):
+    postgres (default)  pg_notify inside the caller's transaction, so the
+                        message is only delivered if the write commits.  A
+                        daemon thread LISTENs on a dedicated autocommit
+                        connection and dispatches to the local callbacks.
+    local               in-process only (single worker / dev); delivered
+                        after the caller's session commits.
+
+When the listener connection drops, messages may have been missed, so every
+subscriber receives `{"all": True}` after reconnecting and should treat it as
+"invalidate everything".
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from .db import db_session
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("ENWISE_PUBSUB", "postgres")
+
+_subscribers: Dict[str, List[Callable[[dict], None]]] = {}
+_lock = threading.Lock()
+_listener = None
+
+
+def _dispatch(channel: str, payload: dict):
+    for callback in list(_subscribers.get(channel, ())):
+        try:
+            callback(payload)
+        except Exception:
+            logger.exception("pubsub subscriber for %s failed", channel)
+
+
+def _dispatch_all_channels(payload: dict):
+    for channel in list(_subscribers):
+        _dispatch(channel, payload)
+
+
+def publish(db, channel: str, payload: dict):
+    """
+    Queue `payload` on `channel`; delivered when `db` commits.  `db` is a
+    Session, or a Connection when called from mapper/flush events.
+    """
+    if BACKEND == "local":
+        commit_event = "after_commit" if isinstance(db, Session) else "commit"
+        event.listen(db, commit_event, lambda *_: _dispatch(channel, payload), once=True)
+        return
+    db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": channel, "payload": json.dumps(payload, default=str)},
+    )
+
+
+def subscribe(channel: str, callback: Callable[[dict], None]):
+    global _listener
+    with _lock:
+        _subscribers.setdefault(channel, []).append(callback)
+        if BACKEND == "local":
+            return
+        if _listener is None:
+            _listener = _PgListener()
+            _listener.start()
+        _listener.listen(channel)
+
+
+class _PgListener(threading.Thread):
+    POLL_SECONDS = 5.0
+
+    def __init__(self):
+        super().__init__(name="pubsub-listener", daemon=True)
+        self._channels = set()
+        self._pending = set()
+        self._chan_lock = threading.Lock()
+
+    def listen(self, channel: str):
+        with self._chan_lock:
+            if channel not in self._channels:
+                self._channels.add(channel)
+                self._pending.add(channel)
+
+    def _connect(self):
+        with db_session() as db:
+            engine = db.get_bind()
+        raw = engine.raw_connection()
+        conn = getattr(raw, "dbapi_connection", None) or raw.connection
+        conn.autocommit = True
+        with self._chan_lock:
+            self._pending = set(self._channels)
+        return raw, conn
+
+    def run(self):
+        backoff = 1.0
+        first = True
+        while True:
+            raw = None
+            try:
+                raw, conn = self._connect()
+                if not first:
+                    _dispatch_all_channels({"all": True})
+                first = False
+                backoff = 1.0
+                self._loop(conn)
+            except Exception:
+                logger.exception("pubsub listener lost its connection; retrying in %.0fs", backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+    def _loop(self, conn):
+        while True:
+            with self._chan_lock:
+                pending, self._pending = self._pending, set()
+            if pending:
+                cur = conn.cursor()
+                for channel in pending:
+                    cur.execute(f'LISTEN "{channel}"')
+                cur.close()
+
+            if select.select([conn], [], [], self.POLL_SECONDS) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                n = conn.notifies.pop(0)
+                try:
+                    payload = json.loads(n.payload) if n.payload else {}
+                except ValueError:
+                    payload = {}
+                _dispatch(n.channel, payload)
@@ -0,0 +1,133 @@
+"""
+Mergeable quantile sketches of sensor readings: percentiles over any range
+without reading the raw values.
+
+    sketches = window_sketches(db, spids, start, end)      # {spid: Sketch}
+    p10, p50, p90 = sketches[spid].quantiles([0.1, 0.5, 0.9])
+
+A sketch counts readings per logarithmic bin (DDSketch): bin k of sign s
+holds the values with gamma^(k-1) < |x| <= gamma^k, gamma = (1 + ALPHA) /
+(1 - ALPHA), and a quantile is reported as the bin's midpoint, within
+ALPHA (1 %) of the true reading.  Counts add up, so hours merge exactly and
+the error does not grow with the range.
+
+`sensor_sketch_1hr` (s17_sensor_sketch_1hr_cagg) keeps the bins of every
+hour; `window_sketches` reads the whole materialized hours from it and bins
+the edges and the open tail from sensor_data with the same expression, in
+one query.  Without the aggregate everything is binned from sensor_data.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Sequence
+
+import numpy as np
+from sqlalchemy import text
+
+from .cagg import cagg_state
+from .series import UTC_ORIGIN, as_ist, ceil_bucket, floor_bucket
+
+ALPHA = 0.01
+GAMMA = (1 + ALPHA) / (1 - ALPHA)
+HOUR = timedelta(hours=1)
+
+# same expression (and finite-value filter below) as the sensor_sketch_1hr definition
+BIN_SQL = (
+    "CASE WHEN value = 0 THEN 0 "
+    "ELSE ceil(ln(abs(value::double precision)) / ln(1.01::double precision / 0.99::double precision))::int END"
+)
+
+SKETCH_SQL = """
+        SELECT station_param_id, sign, bin, SUM(n)::bigint AS n
+        FROM sensor_sketch_1hr
+        WHERE station_param_id = ANY(:spids)
+          AND bucket >= :{p}start AND bucket < :{p}end
+        GROUP BY 1, 2, 3"""
+
+RAW_SQL = f"""
+        SELECT station_param_id, sign(value)::smallint AS sign, {BIN_SQL} AS bin, COUNT(*)::bigint AS n
+        FROM sensor_data
+        WHERE station_param_id = ANY(:spids)
+          AND time >= :{{p}}start AND time < :{{p}}end
+          AND abs(value::double precision) < 'Infinity'::double precision
+        GROUP BY 1, 2, 3"""
+
+
+class Sketch:
+    """Reading counts per bin; `values` (bin midpoints) ascending."""
+
+    __slots__ = ("values", "counts")
+
+    def __init__(self, values: np.ndarray, counts: np.ndarray):
+        self.values = values
+        self.counts = counts
+
+    @classmethod
+    def from_bins(cls, bins: Iterable[Sequence]) -> "Sketch":
+        """Rows (sign, bin, n); repeated bins (several hours) add up."""
+        rows = np.array(list(bins), dtype=np.float64).reshape(-1, 3)
+        signs, keys, counts = rows[:, 0], rows[:, 1], rows[:, 2]
+        values = signs * 2 * GAMMA ** keys / (GAMMA + 1)
+        values[signs == 0] = 0.0
+        values, inverse = np.unique(values, return_inverse=True)
+        merged = np.zeros(len(values))
+        np.add.at(merged, inverse, counts)
+        return cls(values, merged)
+
+    def merge(self, other: "Sketch") -> "Sketch":
+        values, inverse = np.unique(np.concatenate([self.values, other.values]), return_inverse=True)
+        counts = np.zeros(len(values))
+        np.add.at(counts, inverse, np.concatenate([self.counts, other.counts]))
+        return Sketch(values, counts)
+
+    __add__ = merge
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def quantiles(self, qs: Sequence[float]) -> np.ndarray:
+        """Readings at ranks q * (count - 1); NaN for an empty sketch."""
+        if not self.count:
+            return np.full(len(qs), np.nan)
+        cumulative = np.cumsum(self.counts)
+        ranks = np.asarray(qs, dtype=np.float64) * (cumulative[-1] - 1)
+        return self.values[np.searchsorted(cumulative, ranks, side="right")]
+
+    def rank(self, x: float) -> float:
+        """Share of readings <= x (within the bin resolution)."""
+        if not self.count:
+            return float("nan")
+        return float(self.counts[self.values <= x].sum() / self.counts.sum())
+
+
+def _segments(db, start: datetime, end: datetime):
+    """(sql, start, end): whole materialized hours from the aggregate, the rest raw."""
+    state = cagg_state(db, "sensor_sketch_1hr")
+    if state is not None:
+        a = ceil_bucket(start, HOUR, UTC_ORIGIN)
+        b = floor_bucket(min(end, state.watermark), HOUR, UTC_ORIGIN)
+        if a < b:
+            return [(RAW_SQL, start, a), (SKETCH_SQL, a, b), (RAW_SQL, b, end)]
+    return [(RAW_SQL, start, end)]
+
+
+def window_sketches(db, station_param_ids: Sequence[int], start: datetime, end: datetime) -> Dict[int, Sketch]:
+    """Sketch of the readings in [start, end) per station parameter (only those with readings)."""
+    start, end = as_ist(start), as_ist(end)
+    if not station_param_ids or start >= end:
+        return {}
+
+    params = {"spids": list(station_param_ids)}
+    parts = []
+    for i, (sql, lo, hi) in enumerate(_segments(db, start, end)):
+        if lo >= hi:
+            continue
+        prefix = f"s{i}_"
+        params[prefix + "start"] = lo
+        params[prefix + "end"] = hi
+        parts.append(sql.replace("{p}", prefix))
+
+    bins: Dict[int, list] = {}
+    for spid, sign, key, n in db.execute(text("\n        UNION ALL".join(parts)), params):
+        bins.setdefault(spid, []).append((sign, key, n))
+    return {spid: Sketch.from_bins(rows) for spid, rows in bins.items()}
@@ -0,0 +1,604 @@
+"""
+Background report jobs.
+
+Long-range exports run in a worker pool instead of inside the request.
+The request path only submits a spec and polls:
+
+    job, created = submit(db, "sensor_report", {"site_id": 3, ...}, user)
+    job = get_job(db, job_id)          # status, bytes written, queue position
+
+Jobs live in `report_jobs`.  The key of a job is the sha256 of its kind and
+normalized spec, and a partial unique index allows one queued / running /
+done job per key, so identical submissions share one computation and one
+result file until it expires.
+
+Every API process (and `python -m app.utils.report_jobs` for a dedicated
+worker) runs a `ReportJobRunner`: a dispatcher thread claims queued jobs
+under an advisory lock, at most `ENWISE_REPORT_JOBS_PER_SITE` running per
+scope (a site, or a station for KLM/KLD), and hands them to a thread pool
+of `ENWISE_REPORT_WORKERS`.  A job calls the existing endpoint function with
+the submitter's user and writes its body to
+`uploads/reports/<job id>/<file name>`.  Running jobs heartbeat; jobs of a
+worker that died are requeued, up to MAX_ATTEMPTS.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import inspect
+import logging
+import os
+import re
+import secrets
+import shutil
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import orjson
+from dateutil import parser as date_parser
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import text
+
+from . import pubsub
+from .db import db_session
+from .permissions import enforce_site_access
+
+logger = logging.getLogger(__name__)
+
+IST = ZoneInfo("Asia/Kolkata")
+
+CHANNEL = "report_jobs"
+RESULT_DIR = os.path.join("uploads", "reports")
+RESULT_URL = "/uploads/reports"
+
+WORKERS = int(os.getenv("ENWISE_REPORT_WORKERS", "2"))
+PER_SCOPE = int(os.getenv("ENWISE_REPORT_JOBS_PER_SITE", "1"))
+
+POLL_INTERVAL = 5.0
+HEARTBEAT_INTERVAL = 10.0
+STALE_AFTER = 120           # seconds without a heartbeat before a running job is requeued
+SWEEP_INTERVAL = 60.0
+MAX_ATTEMPTS = 3
+RESULT_TTL = 24 * 3600      # results of closed periods
+LIVE_RESULT_TTL = 15 * 60   # results whose period reaches into the future
+KEEP_FINISHED = 30          # days finished / failed rows are kept
+
+USER_KEYS = ("user_id", "username", "role", "site_id")
+
+
+# ───────────────────────────────────────────────
+# Job kinds: spec fields and the endpoint that produces the result
+# ───────────────────────────────────────────────
+REQUIRED = object()
+
+
+def _id_or_all(v):
+    if isinstance(v, int) or str(v).strip().lower() == "all":
+        return v if isinstance(v, int) else "all"
+    return int(v)
+
+
+def _iso_date(v):
+    return v if isinstance(v, date) else date.fromisoformat(str(v))
+
+
+def _end_of_day(value) -> Optional[datetime]:
+    """End of the period a `to_date` spec value names (a bare date covers the whole day)."""
+    try:
+        ts = date_parser.parse(str(value))
+    except (ValueError, OverflowError):
+        return None
+    if len(str(value).strip()) <= 10:
+        ts += timedelta(days=1)
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=IST)
+
+
+def _klm_end(spec) -> datetime:
+    y, m, d = spec["year"], spec["month"], spec["day"]
+    if m == 0:
+        end = date(y + 1, 1, 1)
+    elif d:
+        end = date(y, m, d) + timedelta(days=1)
+    else:
+        end = date(y + (m // 12), (m % 12) + 1, 1)
+    # a totaliser day ends at 06:00 IST the next morning
+    return datetime.combine(end, datetime.min.time(), IST) + timedelta(hours=6)
+
+
+class JobKind:
+    def __init__(self, name: str, fields: Dict[str, Tuple[Callable, object]], call: Callable,
+                 until: Callable[[dict], Optional[datetime]], scope: Callable[[dict], str]):
+        self.name = name
+        self.fields = fields
+        self.call = call
+        self.until = until
+        self.scope = scope
+
+    def normalize(self, spec: dict) -> dict:
+        unknown = sorted(set(spec) - set(self.fields))
+        if unknown:
+            raise HTTPException(400, f"Unknown fields for {self.name}: {', '.join(unknown)}")
+        out = {}
+        for field, (cast, default) in self.fields.items():
+            value = spec.get(field, default)
+            if value is REQUIRED:
+                raise HTTPException(400, f"{self.name} needs '{field}'")
+            try:
+                out[field] = cast(value) if value is not None else None
+            except (TypeError, ValueError):
+                raise HTTPException(400, f"Invalid value for '{field}': {value!r}")
+        return out
+
+
+def _sensor_report(db, spec, user):
+    from ..api.site_dashboard.avg_report import export_sensor_data_csv_gz
+    return export_sensor_data_csv_gz(user=user, db=db, **spec)
+
+
+def _raw_data(db, spec, user):
+    from ..api.reportgenerator.raw_data import export_raw_data_gz
+    return export_raw_data_gz(user=user, db=db, debug=False, **spec)
+
+
+def _raw_data_multi(db, spec, user):
+    from ..api.reportgenerator.raw_data import export_raw_data_multi_gz
+    return export_raw_data_multi_gz(user=user, db=db, **spec)
+
+
+def _klm(db, spec, user):
+    from ..api.reportgenerator.offlineworking_report import get_klm_report_optimized
+    return get_klm_report_optimized(user=user, db=db, **spec)
+
+
+def _kld(db, spec, user):
+    from ..api.reportgenerator.offlineworking_report import get_kld_report
+    return get_kld_report(user=user, db=db, type="KLD", **spec)
+
+
+def _site_scope(spec):
+    return f"site:{spec['site_id']}"
+
+
+def _station_scope(spec):
+    return f"station:{spec['station_name']}"
+
+
+KINDS: Dict[str, JobKind] = {k.name: k for k in (
+    JobKind("sensor_report", {
+        "site_id": (int, REQUIRED),
+        "from_date": (str, REQUIRED),
+        "to_date": (str, REQUIRED),
+        "station_id": (_id_or_all, "all"),
+        "station_param_id": (_id_or_all, "all"),
+        "monitoring_type_id": (_id_or_all, "all"),
+        "time_interval": (str, "1hr"),
+        "output_format": (str, "csv"),
+    }, _sensor_report, lambda s: _end_of_day(s["to_date"]), _site_scope),
+    JobKind("raw_data", {
+        "site_id": (int, REQUIRED),
+        "station_id": (int, REQUIRED),
+        "station_param_id": (int, REQUIRED),
+        "from_date": (str, REQUIRED),
+        "to_date": (str, REQUIRED),
+        "bucket": (str, None),
+    }, _raw_data, lambda s: _end_of_day(s["to_date"]), _site_scope),
+    JobKind("raw_data_multi", {
+        "site_id": (int, REQUIRED),
+        "from_date": (str, REQUIRED),
+        "to_date": (str, REQUIRED),
+        "station_param_ids": (str, "all"),
+        "bucket": (str, None),
+        "layout": (str, "long"),
+        "format": (str, "csv"),
+    }, _raw_data_multi, lambda s: _end_of_day(s["to_date"]), _site_scope),
+    JobKind("klm", {
+        "station_name": (str, REQUIRED),
+        "year": (int, REQUIRED),
+        "month": (int, REQUIRED),
+        "day": (int, None),
+        "plant_name": (str, ""),
+    }, _klm, _klm_end, _station_scope),
+    JobKind("kld", {
+        "station_name": (str, REQUIRED),
+        "from_date": (_iso_date, REQUIRED),
+        "to_date": (_iso_date, REQUIRED),
+        "plant_name": (str, None),
+    }, _kld, lambda s: _end_of_day(s["to_date"]), _station_scope),
+)}
+
+
+# ───────────────────────────────────────────────
+# SQL
+# ───────────────────────────────────────────────
+EXPIRE_KEY_SQL = text("""
+    UPDATE report_jobs SET status = 'expired'
+    WHERE spec_key = :key AND status = 'done' AND expires_at < now()
+""")
+
+INSERT_SQL = text("""
+    INSERT INTO report_jobs (id, spec_key, kind, site_id, scope, spec, submitted_by)
+    VALUES (:id, :key, :kind, :site_id, :scope, CAST(:spec AS JSONB), CAST(:user AS JSONB))
+    ON CONFLICT (spec_key) WHERE status IN ('queued', 'running', 'done') DO NOTHING
+    RETURNING id
+""")
+
+LIVE_JOB_SQL = text("""
+    SELECT id FROM report_jobs
+    WHERE spec_key = :key AND status IN ('queued', 'running', 'done')
+""")
+
+JOB_SQL = text("""
+    SELECT j.*,
+           CASE WHEN j.status = 'queued' THEN (
+               SELECT COUNT(*) FROM report_jobs q
+               WHERE q.status = 'queued' AND q.created_at < j.created_at
+           ) END AS queue_position
+    FROM report_jobs j
+    WHERE j.id = :id
+""")
+
+CLAIM_LOCK_SQL = text("SELECT pg_advisory_xact_lock(hashtext('report_jobs_claim'))")
+
+CLAIM_SQL = text("""
+    WITH running AS (
+        SELECT scope, COUNT(*) AS n
+        FROM report_jobs
+        WHERE status = 'running'
+        GROUP BY scope
+    )
+    UPDATE report_jobs j
+    SET status = 'running', attempts = attempts + 1, worker = :worker,
+        started_at = now(), heartbeat_at = now(), bytes_written = 0
+    WHERE j.id = (
+        SELECT q.id
+        FROM report_jobs q
+        LEFT JOIN running r ON r.scope = q.scope
+        WHERE q.status = 'queued' AND COALESCE(r.n, 0) < :per_scope
+        ORDER BY q.created_at
+        LIMIT 1
+        FOR UPDATE OF q SKIP LOCKED
+    )
+    RETURNING j.id
+""")
+
+HEARTBEAT_SQL = text("""
+    UPDATE report_jobs SET heartbeat_at = now(), bytes_written = :bytes
+    WHERE id = :id AND worker = :worker AND status = 'running'
+""")
+
+FINISH_SQL = text("""
+    UPDATE report_jobs
+    SET status = 'done', error = NULL, file_path = :path, file_name = :file_name,
+        media_type = :media_type, size = :size, bytes_written = :size,
+        finished_at = now(), expires_at = now() + :ttl * INTERVAL '1 second'
+    WHERE id = :id AND worker = :worker AND status = 'running'
+""")
+
+FAIL_SQL = text("""
+    UPDATE report_jobs SET status = 'failed', error = :error, finished_at = now()
+    WHERE id = :id AND worker = :worker AND status = 'running'
+""")
+
+REQUEUE_OWN_SQL = text("""
+    UPDATE report_jobs SET status = 'queued', worker = NULL
+    WHERE worker = :worker AND status = 'running'
+""")
+
+REQUEUE_STALE_SQL = text("""
+    UPDATE report_jobs
+    SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'queued' END,
+        error  = CASE WHEN attempts >= :max_attempts THEN 'Worker stopped responding' END,
+        finished_at = CASE WHEN attempts >= :max_attempts THEN now() END,
+        worker = NULL
+    WHERE status = 'running' AND heartbeat_at < now() - :stale * INTERVAL '1 second'
+""")
+
+EXPIRE_SQL = text("""
+    UPDATE report_jobs SET status = 'expired'
+    WHERE status = 'done' AND expires_at < now()
+""")
+
+EXPIRED_FILES_SQL = text("""
+    SELECT id FROM report_jobs WHERE status = 'expired' AND file_path IS NOT NULL
+""")
+
+CLEAR_FILES_SQL = text("""
+    UPDATE report_jobs SET file_path = NULL WHERE id = ANY(:ids)
+""")
+
+PURGE_SQL = text("""
+    DELETE FROM report_jobs
+    WHERE status IN ('expired', 'failed') AND finished_at < now() - :days * INTERVAL '1 day'
+""")
+
+
+# ───────────────────────────────────────────────
+# Submitting and reading jobs
+# ───────────────────────────────────────────────
+def spec_key(kind: str, spec: dict) -> str:
+    body = orjson.dumps({"kind": kind, "spec": spec}, default=str, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(body).hexdigest()
+
+
+def submit(db, kind: str, spec: dict, user: dict) -> Tuple[dict, bool]:
+    """
+    Queue a report, or join the live job with the same kind and spec.
+    Returns (job, created).  Site access is checked here and again when
+    the job runs.
+    """
+    job_kind = KINDS.get(kind)
+    if job_kind is None:
+        raise HTTPException(400, f"Invalid kind. Allowed: {', '.join(KINDS)}")
+    spec = job_kind.normalize(spec or {})
+    site_id = spec.get("site_id")
+    if site_id is not None:
+        enforce_site_access(user, site_id)
+    key = spec_key(kind, spec)
+
+    for _ in range(3):
+        db.execute(EXPIRE_KEY_SQL, {"key": key})
+        row = db.execute(INSERT_SQL, {
+            "id": secrets.token_hex(16),
+            "key": key,
+            "kind": kind,
+            "site_id": site_id,
+            "scope": job_kind.scope(spec),
+            "spec": orjson.dumps(spec, default=str).decode(),
+            "user": orjson.dumps({k: user.get(k) for k in USER_KEYS}).decode(),
+        }).first()
+        if row is not None:
+            pubsub.publish(db, CHANNEL, {"job_id": row.id})
+            db.commit()
+            return get_job(db, row.id), True
+        db.commit()
+        live = db.execute(LIVE_JOB_SQL, {"key": key}).first()
+        if live is not None:
+            return get_job(db, live.id), False
+    raise HTTPException(409, "Report job is being replaced, submit again")
+
+
+def get_job(db, job_id: str) -> Optional[dict]:
+    row = db.execute(JOB_SQL, {"id": job_id}).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def authorize(user: dict, job: dict):
+    """Site jobs follow site access; station (KLM/KLD) jobs are open to any signed-in user, like their endpoints."""
+    if job["site_id"] is not None:
+        enforce_site_access(user, job["site_id"])
+
+
+def job_view(job: dict) -> dict:
+    done = job["status"] == "done"
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "spec": job["spec"],
+        "status": job["status"],
+        "queue_position": job.get("queue_position"),
+        "attempts": job["attempts"],
+        "bytes_written": job["bytes_written"],
+        "size": job["size"] if done else None,
+        "error": job["error"],
+        "file_name": job["file_name"] if done else None,
+        "download_url": f"/api/report-jobs/{job['id']}/download" if done else None,
+        "file_url": f"{RESULT_URL}/{job['id']}/{job['file_name']}" if done else None,
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "expires_at": job["expires_at"] if done else None,
+    }
+
+
+def result_path(job: dict) -> Optional[str]:
+    if job["status"] != "done" or not job["file_path"] or not os.path.isfile(job["file_path"]):
+        return None
+    return job["file_path"]
+
+
+# ───────────────────────────────────────────────
+# Producing a result file
+# ───────────────────────────────────────────────
+class JobFailed(Exception):
+    pass
+
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def _file_name(headers, fallback: str) -> str:
+    match = re.search(r'filename="?([^";]+)"?', headers.get("content-disposition", ""))
+    name = os.path.basename(match.group(1)) if match else fallback
+    return _UNSAFE.sub("_", name).lstrip(".") or fallback
+
+
+async def _produce(job_kind: JobKind, db, spec: dict, user: dict, fh, written: list) -> Tuple[str, str]:
+    """Run the endpoint and copy its body into `fh`; returns (file name, media type)."""
+    result = job_kind.call(db, spec, user)
+    if inspect.isawaitable(result):
+        result = await result
+
+    if hasattr(result, "body_iterator"):
+        async for chunk in result.body_iterator:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            fh.write(chunk)
+            written[0] += len(chunk)
+        return _file_name(result.headers, f"{job_kind.name}.bin"), result.media_type
+
+    if isinstance(result, dict) and result.get("status") == "error":
+        raise JobFailed(result.get("message") or "Report failed")
+    body = orjson.dumps(jsonable_encoder(result))
+    fh.write(body)
+    written[0] += len(body)
+    return f"{job_kind.name}_report.json", "application/json"
+
+
+class ReportJobRunner:
+    def __init__(self, workers: int = WORKERS, per_scope: int = PER_SCOPE):
+        self.workers = workers
+        self.per_scope = per_scope
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._slots = threading.Semaphore(workers)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None or self.workers <= 0:
+            return
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="report-job")
+        pubsub.subscribe(CHANNEL, lambda payload: self._wake.set())
+        self._thread = threading.Thread(target=self._loop, name="report-job-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info("report job runner %s started (%d workers, %d per site)",
+                    self.worker_id, self.workers, self.per_scope)
+
+    def stop(self):
+        """Stop claiming and hand this worker's running jobs back to the queue."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout=POLL_INTERVAL)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        try:
+            with db_session() as db:
+                db.execute(REQUEUE_OWN_SQL, {"worker": self.worker_id})
+                db.commit()
+        except Exception:
+            logger.exception("could not requeue running report jobs")
+        self._thread = None
+
+    # 1️⃣ Dispatcher: sweep, then claim while a slot is free
+    def _loop(self):
+        last_sweep = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() - last_sweep > SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                try:
+                    self._sweep()
+                except Exception:
+                    logger.exception("report job sweep failed")
+
+            job_id = None
+            if self._slots.acquire(blocking=False):
+                try:
+                    job_id = self._claim()
+                except Exception:
+                    logger.exception("claiming a report job failed")
+                if job_id is None:
+                    self._slots.release()
+                else:
+                    self._pool.submit(self._execute, job_id)
+            if job_id is None:
+                self._wake.wait(POLL_INTERVAL)
+                self._wake.clear()
+
+    def _claim(self) -> Optional[str]:
+        with db_session() as db:
+            db.execute(CLAIM_LOCK_SQL)
+            row = db.execute(CLAIM_SQL, {"worker": self.worker_id, "per_scope": self.per_scope}).first()
+            db.commit()
+        return row.id if row is not None else None
+
+    def _sweep(self):
+        with db_session() as db:
+            db.execute(REQUEUE_STALE_SQL, {"max_attempts": MAX_ATTEMPTS, "stale": STALE_AFTER})
+            db.execute(EXPIRE_SQL)
+            ids = [r.id for r in db.execute(EXPIRED_FILES_SQL)]
+            for job_id in ids:
+                shutil.rmtree(os.path.join(RESULT_DIR, job_id), ignore_errors=True)
+            if ids:
+                db.execute(CLEAR_FILES_SQL, {"ids": ids})
+            db.execute(PURGE_SQL, {"days": KEEP_FINISHED})
+            db.commit()
+
+    # 2️⃣ One job: heartbeat while the endpoint body is written to disk
+    def _execute(self, job_id: str):
+        written = [0]
+        done = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job_id, written, done), daemon=True)
+        part = os.path.join(RESULT_DIR, job_id, f".{self.worker_id.replace(':', '_')}.part")
+        params = {"id": job_id, "worker": self.worker_id}
+        try:
+            beat.start()
+            with db_session() as db:
+                job = get_job(db, job_id)
+                job_kind = KINDS[job["kind"]]
+                spec = job_kind.normalize(job["spec"])       # dates come back from JSONB as strings
+                os.makedirs(os.path.dirname(part), exist_ok=True)
+                with open(part, "wb") as fh:
+                    file_name, media = asyncio.run(
+                        _produce(job_kind, db, spec, job["submitted_by"], fh, written)
+                    )
+                path = os.path.join(RESULT_DIR, job_id, file_name)
+                os.replace(part, path)
+
+                until = job_kind.until(spec)
+                live = until is None or until > datetime.now(IST)
+                db.execute(FINISH_SQL, {
+                    **params, "path": path, "file_name": file_name, "media_type": media,
+                    "size": os.path.getsize(path), "ttl": LIVE_RESULT_TTL if live else RESULT_TTL,
+                })
+                db.commit()
+        except Exception as e:
+            if isinstance(e, HTTPException):
+                error = str(e.detail)
+            elif isinstance(e, JobFailed):
+                error = str(e)
+            else:
+                logger.exception("report job %s failed", job_id)
+                error = "Report generation failed"
+            try:
+                with db_session() as db:
+                    db.execute(FAIL_SQL, {**params, "error": error})
+                    db.commit()
+            except Exception:
+                logger.exception("could not mark report job %s failed", job_id)
+        finally:
+            done.set()
+            if os.path.exists(part):
+                os.remove(part)
+            self._slots.release()
+            self._wake.set()
+
+    def _heartbeat(self, job_id: str, written: list, done: threading.Event):
+        while not done.wait(HEARTBEAT_INTERVAL):
+            try:
+                with db_session() as db:
+                    db.execute(HEARTBEAT_SQL, {"id": job_id, "worker": self.worker_id, "bytes": written[0]})
+                    db.commit()
+            except Exception:
+                logger.exception("report job %s heartbeat failed", job_id)
+
+
+report_jobs = ReportJobRunner()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background report jobs")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--per-site", type=int, default=PER_SCOPE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    runner = ReportJobRunner(args.workers, args.per_site)
+    stopped = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopped.set())
+    runner.start()
+    stopped.wait()
+    runner.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Result cache for reports over closed windows.
+
+A window is closed once it ends before both the watermark of the continuous
+aggregate it reads (everything before it is materialized) and the start of
+the aggregate's refresh window (`now() - start_offset` of its refresh
+policy).  No policy run rewrites those buckets, so the report bytes are
+fixed and can be served again without running the query:
+
+    key = result_cache.key(db, "sensor_report", params, "sensor_agg_15min", ist_end, site_id)
+    if key is not None:                          # None: window still open
+        body = result_cache.get(key)             # small results
+        chunks = result_cache.stream(key)        # large results, None on a miss
+        ...
+        return StreamingResponse(result_cache.tee(key, chunks), ...)
+
+Entries are keyed by sha256 of namespace, VERSION, normalized parameters
+and aggregate.  The watermark only decides whether a key is handed out: it
+moves on every refresh, and closed windows must keep their key.
+
+Tiers:
+    memory  per-worker LRU of entries up to RESULT_CACHE_MEMORY_ENTRY_KB,
+            RESULT_CACHE_MEMORY_MB in total
+    disk    RESULT_CACHE_DIR/<site_id>/<key>, shared by the workers of a
+            host, least recently used removed above RESULT_CACHE_DISK_MB
+
+Reports carry site / station / parameter names, so a topology `bump` drops
+the affected sites' entries in every worker.  After refreshing old buckets
+by hand (`CALL refresh_continuous_aggregate(...)`) run
+`python -m app.utils.result_cache [--site-id N]`.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+from zoneinfo import ZoneInfo
+
+import orjson
+from . import pubsub
+from .cagg import cagg_state
+from .topology import CHANNEL as TOPOLOGY_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+IST = ZoneInfo("Asia/Kolkata")
+
+CHANNEL = "result_cache"
+VERSION = 1                  # bump when a cached report's output changes
+
+DIRECTORY = os.getenv("RESULT_CACHE_DIR", os.path.join("cache", "results"))
+DISK_MAX_BYTES = int(os.getenv("RESULT_CACHE_DISK_MB", "2048")) * 1024 * 1024
+MEMORY_MAX_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+MEMORY_ENTRY_MAX_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_ENTRY_KB", "1024")) * 1024
+
+SCAN_INTERVAL = 300.0        # seconds between disk usage rescans
+EVICT_TO = 0.9               # evict down to this share of DISK_MAX_BYTES
+STALE_TMP = 3600             # seconds before an unfinished write is removed
+READ_CHUNK = 1024 * 1024
+
+CacheKey = namedtuple("CacheKey", ["site_id", "digest"])
+
+
+def _normalize(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(IST)
+        return value.isoformat()
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+
+def _read_chunks(fh) -> Iterator[bytes]:
+    try:
+        while True:
+            data = fh.read(READ_CHUNK)
+            if not data:
+                break
+            yield data
+    finally:
+        fh.close()
+
+
+class ResultCache:
+
+    def __init__(self, directory: str = DIRECTORY, disk_max_bytes: int = DISK_MAX_BYTES,
+                 memory_max_bytes: int = MEMORY_MAX_BYTES, memory_entry_max_bytes: int = MEMORY_ENTRY_MAX_BYTES):
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_entry_max_bytes = memory_entry_max_bytes
+        self._memory: "OrderedDict[CacheKey, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None
+        self._last_scan = 0.0
+        self._generation = 0      # bumped on every invalidation
+        self._lock = threading.Lock()
+        self._subscribed = False
+
+    # 1️⃣ Keys: only for windows the aggregate will not change any more
+    def key(self, db, namespace: str, params: dict, cagg: str, window_end: datetime,
+            site_id: int) -> Optional[CacheKey]:
+        """Cache key for a report over a window ending at `window_end`; None while the window is open."""
+        self._ensure_subscribed()
+        state = cagg_state(db, cagg)
+        closed = state.closed_before if state is not None else None
+        if closed is None:
+            return None
+        if window_end.tzinfo is None:
+            window_end = window_end.replace(tzinfo=IST)
+        if window_end > closed:
+            return None
+        body = orjson.dumps({
+            "namespace": namespace,
+            "version": VERSION,
+            "cagg": cagg,
+            "params": {k: _normalize(v) for k, v in params.items()},
+        }, option=orjson.OPT_SORT_KEYS)
+        return CacheKey(site_id, hashlib.sha256(body).hexdigest())
+
+    # 2️⃣ Reads: memory first, then disk (touching the file keeps it recent)
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        chunks = self.stream(key)
+        return b"".join(chunks) if chunks is not None else None
+
+    def stream(self, key: CacheKey) -> Optional[Iterator[bytes]]:
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                return iter((body,))
+        path = self._path(key)
+        try:
+            fh = open(path, "rb")
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        if os.fstat(fh.fileno()).st_size <= self.memory_entry_max_bytes:
+            with fh:
+                body = fh.read()
+            self._remember(key, body)
+            return iter((body,))
+        return _read_chunks(fh)
+
+    # 3️⃣ Writes: a temporary file renamed into place once complete
+    def put(self, key: CacheKey, body: bytes):
+        generation = self._generation
+        self._remember(key, body)
+        path = self._path(key)
+        tmp = self._tmp_path(path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as fh:
+                fh.write(body)
+            self._commit(tmp, path, len(body), generation)
+        except OSError:
+            logger.warning("could not write result cache entry %s", path, exc_info=True)
+            self._discard(tmp)
+
+    def tee(self, key: CacheKey, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass `chunks` through, writing them to the cache; the entry is only
+        kept when the body was sent to the end.
+        """
+        generation = self._generation
+        path = self._path(key)
+        tmp = self._tmp_path(path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fh = open(tmp, "wb")
+        except OSError:
+            logger.warning("could not write result cache entry %s", path, exc_info=True)
+            yield from chunks
+            return
+
+        size = 0
+        small = []
+        complete = False
+        try:
+            for chunk in chunks:
+                if fh is not None:
+                    try:
+                        fh.write(chunk)
+                    except OSError:
+                        logger.warning("could not write result cache entry %s", path, exc_info=True)
+                        fh.close()
+                        fh = None
+                size += len(chunk)
+                if small is not None:
+                    small.append(chunk)
+                    if size > self.memory_entry_max_bytes:
+                        small = None
+                yield chunk
+            complete = True
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            if fh is not None:
+                fh.close()
+            if complete and fh is not None:
+                try:
+                    self._commit(tmp, path, size, generation)
+                except OSError:
+                    logger.warning("could not write result cache entry %s", path, exc_info=True)
+                if small is not None and generation == self._generation:
+                    self._remember(key, b"".join(small))
+            self._discard(tmp)
+
+    def _commit(self, tmp: str, path: str, size: int, generation: int):
+        # an invalidation that raced with the computation must not be overwritten
+        if generation != self._generation:
+            return
+        os.replace(tmp, path)
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+            due = (
+                self._disk_bytes is None
+                or self._disk_bytes > self.disk_max_bytes
+                or time.monotonic() - self._last_scan > SCAN_INTERVAL
+            )
+        if due:
+            self._evict()
+
+    def _remember(self, key: CacheKey, body: bytes):
+        if len(body) > self.memory_entry_max_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            self._memory[key] = body
+            self._memory_bytes += len(body)
+            while self._memory_bytes > self.memory_max_bytes:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_bytes -= len(dropped)
+
+    # 4️⃣ Disk bound: least recently used files go first
+    def _evict(self):
+        entries = []
+        now = time.time()
+        sites = os.scandir(self.directory) if os.path.isdir(self.directory) else ()
+        for site in sites:
+            if not site.is_dir():
+                continue
+            for entry in os.scandir(site.path):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    if now - st.st_mtime > STALE_TMP:
+                        self._discard(entry.path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.disk_max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.disk_max_bytes * EVICT_TO:
+                    break
+                self._discard(path)
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+            self._last_scan = time.monotonic()
+
+    # 5️⃣ Invalidation (topology bumps, manual refreshes)
+    def _ensure_subscribed(self):
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        pubsub.subscribe(CHANNEL, self.apply)
+        pubsub.subscribe(TOPOLOGY_CHANNEL, self.apply)
+
+    def apply(self, msg: dict):
+        site_ids = set(msg.get("site_ids") or ())
+        clear_all = msg.get("all") or msg.get("station_ids") or not site_ids
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._memory if clear_all or k.site_id in site_ids]:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._disk_bytes = None
+        if clear_all:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        else:
+            for site_id in site_ids:
+                shutil.rmtree(os.path.join(self.directory, str(site_id)), ignore_errors=True)
+
+    def _path(self, key: CacheKey) -> str:
+        return os.path.join(self.directory, str(key.site_id), key.digest)
+
+    def _tmp_path(self, path: str) -> str:
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _discard(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def invalidate(db, *, site_ids: Iterable[int] = ()):
+    """Drop cached reports of `site_ids` (all sites without ids) in every worker once `db` commits."""
+    site_ids = list(site_ids)
+    pubsub.publish(db, CHANNEL, {"site_ids": site_ids, "all": not site_ids})
+
+
+result_cache = ResultCache()
+
+
+def main():
+    from .db import db_session
+
+    parser = argparse.ArgumentParser(description="Drop cached report results")
+    parser.add_argument("--site-id", type=int, action="append", default=[], help="only this site (repeatable)")
+    args = parser.parse_args()
+
+    with db_session() as db:
+        invalidate(db, site_ids=args.site_id)
+        db.commit()
+    result_cache.apply({"site_ids": args.site_id, "all": not args.site_id})
+
+
+if __name__ == "__main__":
+    main()
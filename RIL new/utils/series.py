@@ -0,0 +1,242 @@
+"""
+Bucketed averages of station parameters, read from the coarsest tier that
+fits the request:
+
+    rows = fetch_series(db, spids, start, end, "1 hour", origin=IST_ORIGIN)
+    for ts, station_param_id, value in rows:
+        ...
+
+Tiers, coarsest first:
+    sensor_moments_1hr    hourly UTC buckets    \
+    sensor_stddev_1hr     hourly IST buckets     |  n / sum_x: exact means
+    sensor_moments_15min  15-minute buckets      |
+    sensor_agg_15min      15-minute buckets (mean of the 15-minute means)
+    sensor_moments_5min   5-minute buckets       |
+    sensor_moments_1min   1-minute buckets      /
+    sensor_data           raw readings
+
+Views that do not exist yet (see s16_moments_pyramid_caggs) are skipped.
+
+A tier can serve a bucket when the bucket is a whole number of its own
+buckets on the same grid (`origin` is where the grid starts, as in
+`time_bucket`; hourly IST buckets do not line up with UTC hours).  Each tier
+serves the whole buckets it has materialized (before its watermark, see
+utils/cagg.py); the partial buckets at both ends of the range and the tail
+past the last watermark come from raw data, all in one UNION ALL query
+ordered by time.  Without a usable tier the query is a plain `time_bucket`
+over sensor_data.
+
+`counts=True` adds the number of readings behind each value as a fourth
+column and skips tiers that do not store it.
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional, Sequence, Union
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text
+
+from .cagg import cagg_state
+
+IST = ZoneInfo("Asia/Kolkata")
+
+# time_bucket's default origin (a Monday), and the same instant on IST wall time
+UTC_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+IST_ORIGIN = datetime(2000, 1, 3, tzinfo=IST)
+
+BUCKET_RE = re.compile(r"^\s*(\d+)\s*(minute|min|hour|hr|day|week)s?\s*$", re.IGNORECASE)
+UNITS = {"minute": 60, "min": 60, "hour": 3600, "hr": 3600, "day": 86400, "week": 604800}
+
+
+class Tier(NamedTuple):
+    view: str
+    width: timedelta
+    origin: datetime
+    counts: bool
+    sql: str
+
+
+def _moments(view: str, width: timedelta) -> Tier:
+    return Tier(view, width, UTC_ORIGIN, True, f"""
+        SELECT time_bucket(CAST(:bucket AS interval), bucket, CAST(:origin AS timestamptz)) AS ts,
+               station_param_id,
+               (SUM(sum_x) / NULLIF(SUM(n), 0))::double precision AS value,
+               SUM(n)::bigint AS n
+        FROM {view}
+        WHERE station_param_id = ANY(:spids)
+          AND bucket >= :{{p}}start AND bucket < :{{p}}end
+        GROUP BY 1, 2""")
+
+
+# {p}: prefix of the segment's :start / :end parameters
+TIERS = (
+    _moments("sensor_moments_1hr", timedelta(hours=1)),
+    Tier("sensor_stddev_1hr", timedelta(hours=1), IST_ORIGIN, True, """
+        SELECT time_bucket(CAST(:bucket AS interval), bucket_ist AT TIME ZONE 'Asia/Kolkata',
+                           CAST(:origin AS timestamptz)) AS ts,
+               station_param_id,
+               (SUM(sum_x) / NULLIF(SUM(n), 0))::double precision AS value,
+               SUM(n)::bigint AS n
+        FROM sensor_stddev_1hr
+        WHERE station_param_id = ANY(:spids)
+          AND bucket_ist >= (CAST(:{p}start AS timestamptz) AT TIME ZONE 'Asia/Kolkata')
+          AND bucket_ist <  (CAST(:{p}end AS timestamptz) AT TIME ZONE 'Asia/Kolkata')
+        GROUP BY 1, 2"""),
+    _moments("sensor_moments_15min", timedelta(minutes=15)),
+    Tier("sensor_agg_15min", timedelta(minutes=15), UTC_ORIGIN, False, """
+        SELECT time_bucket(CAST(:bucket AS interval), bucket, CAST(:origin AS timestamptz)) AS ts,
+               station_param_id,
+               AVG(avg_value)::double precision AS value,
+               NULL::bigint AS n
+        FROM sensor_agg_15min
+        WHERE station_param_id = ANY(:spids)
+          AND bucket >= :{p}start AND bucket < :{p}end
+        GROUP BY 1, 2"""),
+    _moments("sensor_moments_5min", timedelta(minutes=5)),
+    _moments("sensor_moments_1min", timedelta(minutes=1)),
+)
+
+RAW_SQL = """
+        SELECT time_bucket(CAST(:bucket AS interval), time, CAST(:origin AS timestamptz)) AS ts,
+               station_param_id,
+               AVG(value::double precision) AS value,
+               COUNT(*) AS n
+        FROM sensor_data
+        WHERE station_param_id = ANY(:spids){site}
+          AND time >= :{p}start AND time < :{p}end
+        GROUP BY 1, 2"""
+
+
+class Segment(NamedTuple):
+    source: str
+    start: datetime
+    end: datetime
+
+
+class SeriesPlan(NamedTuple):
+    sql: str
+    params: dict
+    segments: List[Segment]
+
+    def execute(self, conn):
+        """Rows (ts, station_param_id, value[, n]) ordered by time, then station_param_id."""
+        return conn.execute(text(self.sql), self.params)
+
+    def describe(self) -> List[dict]:
+        return [{"source": s.source, "from": s.start.isoformat(), "to": s.end.isoformat()} for s in self.segments]
+
+
+def parse_bucket(bucket: Union[str, timedelta]) -> timedelta:
+    """'15 minutes', '1 hour', '1440 minutes', '1 day' -> timedelta; ValueError otherwise."""
+    if isinstance(bucket, timedelta):
+        width = bucket
+    else:
+        match = BUCKET_RE.match(bucket)
+        if not match:
+            raise ValueError(f"Unsupported bucket: {bucket!r}")
+        width = timedelta(seconds=int(match.group(1)) * UNITS[match.group(2).lower()])
+    if width <= timedelta(0):
+        raise ValueError(f"Unsupported bucket: {bucket!r}")
+    return width
+
+
+def floor_bucket(t: datetime, width: timedelta, origin: datetime) -> datetime:
+    return origin + ((t - origin) // width) * width
+
+
+def ceil_bucket(t: datetime, width: timedelta, origin: datetime) -> datetime:
+    floor = floor_bucket(t, width, origin)
+    return floor if floor == t else floor + width
+
+
+def as_ist(t: datetime) -> datetime:
+    return t if t.tzinfo is not None else t.replace(tzinfo=IST)
+
+
+def usable(tier: Tier, width: timedelta, origin: datetime, counts: bool = False) -> bool:
+    """Whether every bucket of the request grid is a whole number of `tier` buckets."""
+    return (
+        width % tier.width == timedelta(0)
+        and (origin - tier.origin) % tier.width == timedelta(0)
+        and (tier.counts or not counts)
+    )
+
+
+def plan_series(
+    db,
+    station_param_ids: Sequence[int],
+    start: datetime,
+    end: datetime,
+    bucket: Union[str, timedelta],
+    *,
+    origin: datetime = UTC_ORIGIN,
+    site_id: Optional[int] = None,
+    counts: bool = False,
+    tiers: Sequence[Tier] = TIERS,
+) -> SeriesPlan:
+    """
+    Split [start, end) into tier segments.  `db` is a Session (the tier
+    watermarks are read through it); naive datetimes are taken as IST.
+    `tiers=()` reads everything from sensor_data (benchmarks).
+    """
+    width = parse_bucket(bucket)
+    start, end = as_ist(start), as_ist(end)
+
+    # 1️⃣ Whole request buckets inside the range; the partial ones go to raw data
+    first = ceil_bucket(start, width, origin)
+    last = floor_bucket(end, width, origin)
+
+    segments: List[Segment] = []
+    pos = start
+    if first < last:
+        for tier in tiers:
+            if not usable(tier, width, origin, counts):
+                continue
+            state = cagg_state(db, tier.view)
+            if state is None:
+                continue
+            # 2️⃣ Up to the last whole request bucket the tier has materialized
+            limit = floor_bucket(min(last, state.watermark), width, origin)
+            seg_start = max(pos, first)
+            if limit > seg_start:
+                if seg_start > pos:
+                    segments.append(Segment("sensor_data", pos, seg_start))
+                segments.append(Segment(tier.view, seg_start, limit))
+                pos = limit
+    # 3️⃣ Not yet materialized tail (or everything) from raw readings
+    if pos < end or not segments:
+        segments.append(Segment("sensor_data", pos, end))
+
+    params = {
+        "bucket": f"{int(width.total_seconds())} seconds",
+        "origin": origin,
+        "spids": list(station_param_ids),
+    }
+    sql_by_view = {tier.view: tier.sql for tier in tiers}
+    site = ""
+    if site_id is not None:
+        site = "\n          AND site_id = :site_id"
+        params["site_id"] = site_id
+
+    parts = []
+    for i, seg in enumerate(segments):
+        prefix = f"s{i}_"
+        params[prefix + "start"] = seg.start
+        params[prefix + "end"] = seg.end
+        template = sql_by_view.get(seg.source, RAW_SQL)
+        parts.append(template.replace("{site}", site).replace("{p}", prefix))
+
+    columns = "ts, station_param_id, value, n" if counts else "ts, station_param_id, value"
+    sql = (
+        f"SELECT {columns}\nFROM (" + "\n        UNION ALL".join(parts) + "\n) s\n"
+        "ORDER BY ts, station_param_id"
+    )
+    return SeriesPlan(sql, params, segments)
+
+
+def fetch_series(db, station_param_ids: Sequence[int], start: datetime, end: datetime,
+                 bucket: Union[str, timedelta], *, conn=None, **kwargs):
+    """plan_series(...) executed on `conn` (e.g. a streaming connection), `db` by default."""
+    plan = plan_series(db, station_param_ids, start, end, bucket, **kwargs)
+    return plan.execute(conn if conn is not None else db)
@@ -0,0 +1,219 @@
+"""
+Helpers for streaming raw-data exports straight from a server-side cursor.
+
+    rows = conn.execution_options(stream_results=True).execute(sql, params)
+    body = gzip_stream(csv_wide(rows, columns))
+    return StreamingResponse(body, media_type="application/gzip")
+
+Row formatters take `(ts, station_param_id, value)` rows ordered by time and
+yield bytes; `csv_chunks` encodes arbitrary rows in batches.  `gzip_stream`
+compresses into ~64 KB chunks and sends the first chunk (gzip + CSV header)
+at once, so memory stays flat and the client sees a byte before the query
+has been read to the end.
+"""
+
+import csv
+import datetime
+import gzip
+import io
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import orjson
+from fastapi import HTTPException
+
+CHUNK_SIZE = 65536
+CSV_BATCH_ROWS = 1000
+
+ALLOWED_BUCKETS = {
+    "1 minute","2 minutes","5 minutes","10 minutes","15 minutes",
+    "30 minutes","60 minutes","120 minutes","240 minutes","1440 minutes"
+}
+
+LAYOUTS = ("long", "wide")
+FORMATS = ("csv", "json")
+
+
+def parse_iso(ts: str, field: str):
+    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%d %H:%M:%S%z"):
+        try:
+            return datetime.datetime.strptime(ts, fmt)
+        except ValueError:
+            pass
+    raise HTTPException(400, f"Invalid {field} format. Use ISO8601 with timezone.")
+
+
+def normalize_bucket(b: Optional[str]) -> str:
+    if not b:
+        return "1 minute"
+    if b not in ALLOWED_BUCKETS:
+        raise HTTPException(400, f"Invalid bucket. Allowed: {', '.join(sorted(ALLOWED_BUCKETS))}")
+    return b
+
+
+def select_params(topo, station_param_ids: str) -> list:
+    """
+    ParamInfo of the site for "all" or a comma-separated list of ids;
+    400 on ids that are not numbers or not station parameters of the site.
+    """
+    if topo is None:
+        raise HTTPException(404, "Site not found")
+    if station_param_ids.strip().lower() == "all":
+        return list(topo.params)
+    try:
+        ids = [int(x) for x in station_param_ids.split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(400, "station_param_ids must be 'all' or a comma-separated list of ids")
+    unknown = [i for i in ids if i not in topo.param_by_id]
+    if not ids or unknown:
+        raise HTTPException(400, f"Unknown station_param_ids for this site: {unknown or station_param_ids}")
+    return [topo.param_by_id[i] for i in dict.fromkeys(ids)]
+
+
+def site_param(topo, station_param_id: int):
+    """ParamInfo of `station_param_id`; 404 unless it is a station parameter of the site."""
+    if topo is None:
+        raise HTTPException(404, "Site not found")
+    param = topo.param_by_id.get(station_param_id)
+    if param is None:
+        raise HTTPException(404, "Station parameter not found for this site")
+    return param
+
+
+def column_names(topo, params) -> Dict[int, str]:
+    """station_param_id -> "Station - Parameter" header."""
+    return {
+        p.station_param_id: f"{topo.station_by_id[p.station_id].name} - {p.parameter_name or p.label}"
+        for p in params
+    }
+
+
+def gzip_stream(chunks: Iterable[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Gzip `chunks`, yielding compressed output after the first chunk and then
+    roughly every `chunk_size` bytes.
+    """
+    buf = io.BytesIO()
+    first = True
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        for chunk in chunks:
+            gz.write(chunk)
+
+            # Yield chunks periodically (~64KB)
+            if first or buf.tell() > chunk_size:
+                first = False
+                gz.flush()
+                buf.seek(0)
+                yield buf.read()
+                buf.seek(0)
+                buf.truncate(0)
+
+        # Flush any remaining data
+        gz.flush()
+    buf.seek(0)
+    yield buf.read()
+
+
+def csv_chunks(header: Optional[List], rows: Iterable[List], batch: int = CSV_BATCH_ROWS,
+               lineterminator: str = "\r\n") -> Iterator[bytes]:
+    """CSV-encode `rows` (lists of values), yielding the header alone, then `batch` rows at a time."""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator=lineterminator)
+    if header is not None:
+        writer.writerow(header)
+        yield out.getvalue().encode("utf-8")
+        out.seek(0)
+        out.truncate(0)
+    n = 0
+    for row in rows:
+        writer.writerow(row)
+        n += 1
+        if n >= batch:
+            yield out.getvalue().encode("utf-8")
+            out.seek(0)
+            out.truncate(0)
+            n = 0
+    if n:
+        yield out.getvalue().encode("utf-8")
+
+
+def _csv_line(values: List) -> bytes:
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow(values)
+    return out.getvalue().encode("utf-8")
+
+
+def _value(v):
+    return float(v) if v is not None else None
+
+
+def csv_long(rows, names: Dict[int, str]) -> Iterator[bytes]:
+    """timestamp,station_param_id,name,value — one line per reading."""
+    yield b"timestamp,station_param_id,name,value\n"
+    quoted = {spid: _csv_line([name]).rstrip(b"\n").decode() for spid, name in names.items()}
+    for ts, spid, v in rows:
+        yield f"{ts.isoformat()},{spid},{quoted.get(spid, '')},{'' if v is None else float(v)}\n".encode("utf-8")
+
+
+def wide_rows(rows, spids: List[int]):
+    """(ts, [value per spid]) per timestamp; `rows` must be ordered by time."""
+    index = {spid: i for i, spid in enumerate(spids)}
+    current_ts, values = None, None
+    for ts, spid, v in rows:
+        if ts != current_ts:
+            if current_ts is not None:
+                yield current_ts, values
+            current_ts, values = ts, [None] * len(spids)
+        i = index.get(spid)
+        if i is not None:
+            values[i] = _value(v)
+    if current_ts is not None:
+        yield current_ts, values
+
+
+def csv_wide(rows, names: Dict[int, str]) -> Iterator[bytes]:
+    """timestamp plus one column per station parameter (empty where missing)."""
+    spids = list(names)
+    yield _csv_line(["timestamp"] + [names[s] for s in spids])
+    for ts, values in wide_rows(rows, spids):
+        yield (ts.isoformat() + "," + ",".join("" if v is None else str(v) for v in values) + "\n").encode("utf-8")
+
+
+def json_long(rows, meta: dict) -> Iterator[bytes]:
+    yield b'{"meta":'
+    yield orjson.dumps(meta)
+    yield b',"raw_data":['
+    first = True
+    for ts, spid, v in rows:
+        if not first:
+            yield b","
+        yield orjson.dumps({"timestamp": ts.isoformat(), "station_param_id": spid, "value": _value(v)})
+        first = False
+    yield b"]}"
+
+
+def json_wide(rows, names: Dict[int, str], meta: dict) -> Iterator[bytes]:
+    spids = list(names)
+    yield b'{"meta":'
+    yield orjson.dumps({**meta, "columns": [{"station_param_id": s, "name": names[s]} for s in spids]})
+    yield b',"raw_data":['
+    first = True
+    for ts, values in wide_rows(rows, spids):
+        if not first:
+            yield b","
+        yield orjson.dumps({"timestamp": ts.isoformat(), "values": values})
+        first = False
+    yield b"]}"
+
+
+def validate_layout(layout: str, fmt: str):
+    if layout not in LAYOUTS:
+        raise HTTPException(400, f"Invalid layout. Allowed: {', '.join(LAYOUTS)}")
+    if fmt not in FORMATS:
+        raise HTTPException(400, f"Invalid format. Allowed: {', '.join(FORMATS)}")
+
+
+def format_rows(rows, layout: str, fmt: str, names: Dict[int, str], meta: dict) -> Iterator[bytes]:
+    validate_layout(layout, fmt)
+    if fmt == "csv":
+        return csv_wide(rows, names) if layout == "wide" else csv_long(rows, names)
+    return json_wide(rows, names, meta) if layout == "wide" else json_long(rows, meta)
@@ -0,0 +1,235 @@
+"""
+Per-worker snapshot of a site's master data.
+
+    site -> group, stations, station_parameters (+ analyser_parameter,
+    parameters, analysers, monitoring_types)
+
+Read endpoints fetch sensor values by station_param_id and join them to the
+snapshot in Python instead of re-joining the master tables in every query:
+
+    topo = topology.site(db, site_id)          # None if the site does not exist
+    for p in topo.params:                      # ParamInfo, station_param_id order
+        station = topo.station_by_id[p.station_id]
+
+A snapshot is immutable once built (records use __slots__, collections are
+tuples, indexes are never written after construction); a change produces a
+new snapshot with a higher `version`.  CRUD endpoints call `bump()` before
+`db.commit()`:
+
+    bump(db, site_ids=[site_id])       # site / station / station parameter writes
+    bump(db, station_ids=[station_id])
+    bump(db)                           # parameters, analysers, monitoring types,
+                                       # groups – shared by every site
+
+Every worker drops the affected snapshots once the write commits (utils/pubsub,
+`topology` channel); a listener reconnect drops everything, and snapshots
+older than TOPOLOGY_TTL seconds are re-read in case a message was lost.
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import text
+
+from . import pubsub
+
+CHANNEL = "topology"
+TTL = float(os.getenv("TOPOLOGY_TTL", "600"))
+MAX_SITES = int(os.getenv("TOPOLOGY_MAX_SITES", "500"))
+
+SITE_SQL = text("""
+    SELECT
+        s.id, s.siteuid, s.site_name, s.address, s.city, s.state, s.ganga_basin,
+        s.latitude, s.longitude, s.auth_expiry, s.group_id,
+        g.group_name, g.ind_code
+    FROM site s
+    LEFT JOIN "group" g ON g.id = s.group_id
+    WHERE s.id = :site_id
+""")
+
+STATIONS_SQL = text("""
+    SELECT id, station_uid, name, calibration_expiry_date, latitude, longitude
+    FROM stations
+    WHERE site_id = :site_id
+    ORDER BY id
+""")
+
+PARAMS_SQL = text("""
+    SELECT
+        sp.id              AS station_param_id,
+        sp.station_id,
+        sp.pram_lable      AS label,
+        sp.para_unit       AS unit,
+        sp.para_threshold  AS threshold,
+        sp.is_editable,
+        sp.param_interval  AS interval,
+        sp.analyser_param_id,
+        p.id               AS parameter_id,
+        p.uuid             AS parameter_uuid,
+        p.name             AS parameter_name,
+        p.label            AS parameter_label,
+        p.unit             AS parameter_unit,
+        p.min_thershold    AS min_threshold,
+        p.max_thershold    AS max_threshold,
+        mt.id              AS monitoring_type_id,
+        mt.monitoring_type,
+        a.id               AS analyser_id,
+        a.analyser_uid,
+        a.analyser_name
+    FROM station_parameters sp
+    JOIN stations st                  ON st.id = sp.station_id
+    LEFT JOIN analyser_parameter ap   ON ap.id = sp.analyser_param_id
+    LEFT JOIN parameters p            ON p.id = ap.parameter_id
+    LEFT JOIN monitoring_types mt     ON mt.id = p.monitoring_type_id
+    LEFT JOIN analysers a             ON a.id = ap.analyser_id
+    WHERE st.site_id = :site_id
+    ORDER BY sp.id
+""")
+
+
+class SiteInfo:
+    __slots__ = (
+        "id", "siteuid", "site_name", "address", "city", "state", "ganga_basin",
+        "latitude", "longitude", "auth_expiry", "group_id", "group_name", "ind_code",
+    )
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+
+class StationInfo:
+    __slots__ = ("id", "station_uid", "name", "calibration_expiry_date", "latitude", "longitude")
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+
+class ParamInfo:
+    """A station parameter with its parameter / analyser / monitoring type.
+
+    Fields from the LEFT JOINed tables are None when the link is missing.
+    """
+
+    __slots__ = (
+        "station_param_id", "station_id", "label", "unit", "threshold", "is_editable",
+        "interval", "analyser_param_id",
+        "parameter_id", "parameter_uuid", "parameter_name", "parameter_label", "parameter_unit",
+        "min_threshold", "max_threshold", "monitoring_type_id", "monitoring_type",
+        "analyser_id", "analyser_uid", "analyser_name",
+    )
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+
+class SiteTopology:
+    __slots__ = (
+        "version", "loaded_at", "site", "stations", "params",
+        "station_by_id", "station_by_uid", "param_by_id", "params_by_station",
+    )
+
+    def __init__(self, version: int, site: SiteInfo, stations, params):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.site = site
+        self.stations: Tuple[StationInfo, ...] = tuple(stations)
+        self.params: Tuple[ParamInfo, ...] = tuple(params)
+        self.station_by_id: Dict[int, StationInfo] = {s.id: s for s in self.stations}
+        self.station_by_uid: Dict[str, StationInfo] = {s.station_uid: s for s in self.stations}
+        self.param_by_id: Dict[int, ParamInfo] = {p.station_param_id: p for p in self.params}
+        by_station: Dict[int, list] = {s.id: [] for s in self.stations}
+        for p in self.params:
+            by_station.setdefault(p.station_id, []).append(p)
+        self.params_by_station: Dict[int, Tuple[ParamInfo, ...]] = {
+            k: tuple(v) for k, v in by_station.items()
+        }
+
+
+class TopologyCache:
+
+    def __init__(self, ttl: float = TTL, max_sites: int = MAX_SITES):
+        self.ttl = ttl
+        self.max_sites = max_sites
+        self._sites: "OrderedDict[int, SiteTopology]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._versions = itertools.count(1)
+        self._generation = 0      # bumped on every invalidation
+        self._subscribed = False
+
+    def site(self, db, site_id: int) -> Optional[SiteTopology]:
+        self._ensure_subscribed()
+        with self._lock:
+            topo = self._sites.get(site_id)
+            if topo is not None and time.monotonic() - topo.loaded_at < self.ttl:
+                self._sites.move_to_end(site_id)
+                return topo
+            generation = self._generation
+
+        topo = self._load(db, site_id)
+        if topo is None:
+            return None
+        with self._lock:
+            # an invalidation that raced with the load must not be overwritten
+            if generation == self._generation:
+                self._sites[site_id] = topo
+                self._sites.move_to_end(site_id)
+                while len(self._sites) > self.max_sites:
+                    self._sites.popitem(last=False)
+        return topo
+
+    def _load(self, db, site_id: int) -> Optional[SiteTopology]:
+        site = db.execute(SITE_SQL, {"site_id": site_id}).fetchone()
+        if site is None:
+            return None
+        stations = db.execute(STATIONS_SQL, {"site_id": site_id}).fetchall()
+        params = db.execute(PARAMS_SQL, {"site_id": site_id}).fetchall()
+        return SiteTopology(
+            next(self._versions),
+            SiteInfo(site),
+            [StationInfo(r) for r in stations],
+            [ParamInfo(r) for r in params],
+        )
+
+    def _ensure_subscribed(self):
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        pubsub.subscribe(CHANNEL, self.apply)
+
+    def apply(self, msg: dict):
+        with self._lock:
+            self._generation += 1
+            site_ids = set(msg.get("site_ids") or ())
+            station_ids = set(msg.get("station_ids") or ())
+            if msg.get("all") or not (site_ids or station_ids):
+                self._sites.clear()
+                return
+            for site_id, topo in list(self._sites.items()):
+                if site_id in site_ids or station_ids.intersection(topo.station_by_id):
+                    del self._sites[site_id]
+
+
+def bump(db, *, site_ids: Iterable[int] = (), station_ids: Iterable[int] = ()):
+    """
+    Call from CRUD endpoints before `db.commit()`.  Without ids every site's
+    snapshot is dropped (shared master data changed).
+    """
+    site_ids, station_ids = list(site_ids), list(station_ids)
+    pubsub.publish(db, CHANNEL, {
+        "site_ids": site_ids,
+        "station_ids": station_ids,
+        "all": not (site_ids or station_ids),
+    })
+
+
+topology = TopologyCache()
@@ -0,0 +1,198 @@
+"""
+KLD / KLM usage reports computed over a whole date range at once.
+
+Instead of a query per day × plant × T-tag, the daily usages of every tag
+referenced by the station's formulas are loaded with one query into a
+(tag → float array over the day axis) map, and each StationFormula is
+evaluated once over that axis (utils/formula_engine works element-wise on
+NumPy arrays).
+
+KLM first/last totaliser values come from the `totaliser_day_bounds`
+continuous aggregate (first/last reading per T-tag per totaliser day, i.e.
+IST day starting 06:00): the days of a whole year are read once and each
+month / month-to-date period is reduced from them in memory.
+"""
+
+import bisect
+import math
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+from sqlalchemy import text
+
+from .formula_engine import compile_formula
+
+TAG_RE = re.compile(r"T\d+")
+
+IST = ZoneInfo("Asia/Kolkata")
+DAY_START = time(6, 0)  # totaliser day boundary (IST)
+
+FORMULAS_SQL = text("""
+    SELECT plant_name, formula, cfo_limit_kld, cfo_limit_klm
+    FROM station_formulas
+    WHERE station_name = :station_name AND is_active = TRUE
+      AND (:plant_name IS NULL OR plant_name = :plant_name)
+""")
+
+# One site per tag (totaliser_data.parameter_name is unique in practice),
+# then every daily usage of those tags in the range.
+DAILY_USAGE_SQL = text("""
+    WITH tags AS (
+        SELECT DISTINCT ON (parameter_name) parameter_name, site_id
+        FROM totaliser_data
+        WHERE parameter_name = ANY(:params)
+        ORDER BY parameter_name, id
+    )
+    SELECT u.parameter_name, u.date, u.usage
+    FROM daily_totaliser_usage u
+    JOIN tags t
+      ON t.site_id = u.site_id
+     AND t.parameter_name = u.parameter_name
+    WHERE u.date BETWEEN :from_date AND :to_date
+""")
+
+
+def load_daily_usage(db, params: List[str], from_date: date, to_date: date) -> Dict[str, np.ndarray]:
+    """tag -> usage per day from `from_date` to `to_date` (0.0 where missing)."""
+    days = (to_date - from_date).days + 1
+    usage = {p: np.zeros(days) for p in params}
+    if not params or days <= 0:
+        return usage
+    rows = db.execute(DAILY_USAGE_SQL, {
+        "params": params, "from_date": from_date, "to_date": to_date,
+    }).fetchall()
+    for name, day, value in rows:
+        if value:
+            usage[name][(day - from_date).days] = float(value)
+    return usage
+
+
+def evaluate_over_days(formula: str, usage: Dict[str, np.ndarray], days: int) -> List[Optional[float]]:
+    """
+    Evaluate `formula` for every day; a day whose result cannot be computed
+    (e.g. division by zero) is None, as is every day if the formula is invalid.
+    """
+    try:
+        compiled = compile_formula(formula)
+    except Exception:
+        return [None] * days
+
+    try:
+        with np.errstate(all="ignore"):
+            out = np.broadcast_to(np.asarray(compiled.evaluate(usage), dtype=float), (days,))
+        values = out.tolist()
+    except Exception:
+        # e.g. min()/max() are not element-wise; evaluate day by day
+        values = []
+        for i in range(days):
+            try:
+                values.append(float(compiled.evaluate({p: a[i] for p, a in usage.items()})))
+            except Exception:
+                values.append(None)
+
+    return [v if v is not None and math.isfinite(v) else None for v in values]
+
+
+def compute_kld_report(db, station_name: str, from_date: date, to_date: date,
+                       plant_name: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Rows of the KLD report, date-major then plant, as `get_kld_report` returns them."""
+    formulas = db.execute(FORMULAS_SQL, {"station_name": station_name, "plant_name": plant_name}).fetchall()
+    days = max((to_date - from_date).days + 1, 0)
+    if not formulas or not days:
+        return []
+
+    params = sorted({p for f in formulas for p in TAG_RE.findall(f.formula)})
+    usage = load_daily_usage(db, params, from_date, to_date)
+
+    per_plant = []
+    for f in formulas:
+        tags = set(TAG_RE.findall(f.formula))
+        values = evaluate_over_days(f.formula, {p: usage[p] for p in tags}, days)
+        cfo = float(f.cfo_limit_kld) if f.cfo_limit_kld is not None else None
+        per_plant.append((f.plant_name, values, cfo))
+
+    results = []
+    for i in range(days):
+        single_date = from_date + timedelta(days=i)
+        for plant, values, cfo in per_plant:
+            v = values[i]
+            results.append({
+                "date": single_date,
+                "plant": plant,
+                "station": station_name,
+                "kld_usage": abs(round(v, 2)) if v is not None else None,
+                "cfo_limit_kld": cfo,
+            })
+    return results
+
+
+# ─── KLM: first/last values from daily boundaries ────────────────────
+DAY_BOUNDS_SQL = text("""
+    SELECT
+        b.param_label,
+        (b.day AT TIME ZONE 'Asia/Kolkata')::date      AS day,
+        b.first_value,
+        b.first_time AT TIME ZONE 'Asia/Kolkata'       AS first_time,
+        b.last_value,
+        b.last_time  AT TIME ZONE 'Asia/Kolkata'       AS last_time
+    FROM totaliser_day_bounds b
+    JOIN unnest(CAST(:sids AS integer[]), CAST(:params AS text[])) AS t(site_id, param_label)
+      ON t.site_id = b.site_id
+     AND t.param_label = b.param_label
+    WHERE b.day >= :start_utc
+      AND b.day <  :end_utc
+    ORDER BY b.param_label, b.day
+""")
+
+
+def day_start(d: date) -> datetime:
+    """Start of totaliser day `d` (06:00 IST) as an aware datetime."""
+    return datetime.combine(d, DAY_START, tzinfo=IST)
+
+
+class DayBounds:
+    """Per T-tag daily first/last readings over a span of totaliser days."""
+
+    def __init__(self, rows):
+        self._days: Dict[str, List[date]] = {}
+        self._rows: Dict[str, list] = {}
+        for r in rows:
+            self._days.setdefault(r.param_label, []).append(r.day)
+            self._rows.setdefault(r.param_label, []).append(r)
+
+    @classmethod
+    def load(cls, db, site_map: Dict[str, int], start_day: date, end_day: date) -> "DayBounds":
+        """Days `start_day` (inclusive) to `end_day` (exclusive) for the tags in `site_map`."""
+        if not site_map or end_day <= start_day:
+            return cls([])
+        params = sorted(site_map)
+        rows = db.execute(DAY_BOUNDS_SQL, {
+            "sids": [site_map[p] for p in params],
+            "params": params,
+            "start_utc": day_start(start_day),
+            "end_utc": day_start(end_day),
+        }).fetchall()
+        return cls(rows)
+
+    def reduce(self, params: List[str], start_day: date, end_day: date) -> Tuple[dict, dict, dict, dict]:
+        """
+        First value/time and last value/time of each tag over
+        [start_day, end_day); tags without readings get 0.0 / None.
+        """
+        fv, ft, lv, lt = {}, {}, {}, {}
+        for p in params:
+            days = self._days.get(p, ())
+            lo = bisect.bisect_left(days, start_day)
+            hi = bisect.bisect_left(days, end_day)
+            if lo >= hi:
+                fv[p], ft[p], lv[p], lt[p] = 0.0, None, 0.0, None
+                continue
+            first, last = self._rows[p][lo], self._rows[p][hi - 1]
+            fv[p] = float(first.first_value or 0)
+            ft[p] = first.first_time.isoformat() if first.first_time else None
+            lv[p] = float(last.last_value or 0)
+            lt[p] = last.last_time.isoformat() if last.last_time else None
+        return fv, ft, lv, lt